@@ -0,0 +1,262 @@
+"""
+Headless benchmark and regression harness for the hot paths of Maroon Lines.
+
+Drives repository_control and the Timeline with synthetic histories and reports save, open, switch and render
+latencies. Run from src/main/python:
+
+    python benchmark.py --sizes 100 1000 10000 100000 --json bench.json
+    python benchmark.py --check
+    python benchmark.py --storage sqlite
+    python benchmark.py --storage memory
+
+With --storage memory, repos never touch the disk, which leaves the cost of the algorithms alone.
+
+"""
+import os
+import sys
+import json
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+from time import perf_counter
+
+# Render without a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+
+import utils.repository_control as repository_control
+from utils.repository_control import *
+from components.timeline import Timeline
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+DEFAULT_REPEATS = 5
+DEFAULT_MAX_RENDER_SIZE = 10000
+BRANCH_PROBABILITY = 0.1
+LINES_PER_VERSION = 50
+
+# Lines of a file large enough to be written in chunks
+LARGE_FILE_LINES = 100000
+
+# Versions of the synthetic history that get an object on disk, besides head
+SAMPLED_VERSIONS = 10
+
+
+def version_data(version):
+    """
+    Deterministic file content of a synthetic version.
+
+    :param version: version number
+    :return: file content
+    """
+    return ''.join('line {} of version {}\n'.format(line, version) for line in range(LINES_PER_VERSION))
+
+
+def synthetic_index(num_versions, seed=0):
+    """
+    Build an index of a history that mostly grows linearly, and branches off an older version now and then.
+
+    :param num_versions: number of versions in history
+    :param seed: seed for the branch choices
+    :return: tuple of python dict object and list of version numbers in the order of their hashes
+    """
+    rng = random.Random(seed)
+    file_hashes = [get_hash(version_data(version)) for version in range(num_versions)]
+
+    index = build_index_dict(version_data(0))
+    for version in range(1, num_versions):
+        if rng.random() < BRANCH_PROBABILITY:
+            update_index_dict_head(index, file_hashes[rng.randrange(version)])
+        add_file_hash_to_index_dict(index, file_hashes[version])
+
+    for version, file_hash in enumerate(file_hashes):
+        file_data = version_data(version)
+        file_meta = build_file_meta(len(file_data), LINES_PER_VERSION, len(zlib.compress(file_data.encode())))
+        add_file_meta_to_index_dict(index, file_hash, file_meta)
+
+    return index, file_hashes
+
+
+def create_synthetic_repo(file_path, num_versions):
+    """
+    Write a repo with a synthetic history. Only head and a sample of versions get objects.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param num_versions: number of versions in history
+    :return: list of version numbers that have objects
+    """
+    index, file_hashes = synthetic_index(num_versions)
+    head_version = file_hashes.index(index[INDEX_HEAD])
+
+    with open(file_path, 'w') as f:
+        f.write(version_data(head_version))
+
+    step = max(1, num_versions // SAMPLED_VERSIONS)
+    versions = sorted(set(range(0, num_versions, step)) | {head_version})
+
+    with repo_transaction():
+        make_repo(file_path)
+        write_repo_key(file_path)
+        write_repo_index(file_path, index)
+        for version in versions:
+            write_repo_file_object(file_path, version_data(version))
+
+    return versions
+
+
+def measure(function, repeats):
+    """
+    :param function: function to time
+    :param repeats: number of runs
+    :return: python dict object of median and worst latency in milliseconds
+    """
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        timings.append((perf_counter() - start) * 1000)
+
+    return {'median_ms': round(statistics.median(timings), 3), 'max_ms': round(max(timings), 3)}
+
+
+def benchmark_history(file_path, num_versions, repeats, render):
+    """
+    :return: python dict object of latencies for one history size
+    """
+    versions = create_synthetic_repo(file_path, num_versions)
+    head_file_data = version_data(versions[-1])
+    results = {'versions': num_versions}
+
+    # Save - a brand new version under head
+    counter = iter(range(num_versions, num_versions + repeats))
+    results['save'] = measure(lambda: add_file_object_to_index(file_path, version_data(next(counter))), repeats)
+
+    # Open - file content matches head, and file content matches an older version
+    results['open'] = measure(lambda: open_repo(file_path, head_file_data), repeats)
+    results['open_known_version'] = measure(lambda: open_repo(file_path, version_data(versions[0])), repeats)
+
+    # Switch - what the timeline does when it moves head to another version
+    def switch():
+        for version in (versions[1], versions[0]):
+            file_hash = get_hash(version_data(version))
+            repo_file_object(file_path, file_hash)
+            update_repo_index_head(file_path, file_hash)
+    results['switch'] = measure(switch, repeats)
+
+    # Load index - all the timeline reads of a history before drawing it
+    results['load_index'] = measure(lambda: repo_compact_index(file_path), repeats)
+
+    if render:
+        timeline = Timeline()
+        index = repo_compact_index(file_path)
+
+        def render_timeline():
+            timeline.render_graph(index, edit_mode=False)
+            timeline.canvas.draw()
+        results['render'] = measure(render_timeline, repeats)
+        timeline.close_figure()
+
+    remove_repo(file_path)
+    return results
+
+
+def check_regressions(file_path):
+    """
+    Assert the invariants of the hot paths on a small history.
+
+    :return: list of failure messages
+    """
+    failures = []
+    versions = create_synthetic_repo(file_path, 100)
+
+    def index_size():
+        index = repo_index(file_path)
+        return len(index_dict_nodes(index)), len(index[INDEX_ADOPTS])
+
+    size = index_size()
+    open_repo(file_path, version_data(versions[-1]))
+    if index_size() != size:
+        failures.append('Reopening a file at head changed the index')
+
+    older_file_data = version_data(versions[0])
+    for _ in range(3):
+        open_repo(file_path, older_file_data)
+    if index_size() != size:
+        failures.append('Reopening a file at a known version added versions or adopted edges')
+    if repo_index_head(file_path) != get_hash(older_file_data):
+        failures.append('Reopening a file at a known version did not move head')
+
+    open_repo(file_path, 'edited by a 3rd party\n')
+    if index_size() != (size[0] + 1, size[1] + 1):
+        failures.append('Reopening a file with unknown content was not adopted exactly once')
+
+    add_file_object_to_index(file_path, 'saved\n')
+    if index_size()[0] != size[0] + 2:
+        failures.append('Saving a new version did not add exactly one version')
+    if not index_dict_file_meta(repo_index(file_path), get_hash('saved\n')):
+        failures.append('Saving a new version did not record its metadata')
+
+    large_file_data = ''.join('line {} of a large file\n'.format(line) for line in range(LARGE_FILE_LINES))
+    edited_file_data = large_file_data.replace('line 5000 of', 'line 5000, edited, of', 1)
+    _, large_file_meta = add_file_object_to_index(file_path, large_file_data)
+    edited_file_hash, edited_file_meta = add_file_object_to_index(file_path, edited_file_data)
+    if edited_file_meta[META_COMPRESSED] * 10 > large_file_meta[META_COMPRESSED]:
+        failures.append('Saving a one-line edit of a large file rewrote most of it')
+    if repo_file_object(file_path, edited_file_hash) != edited_file_data:
+        failures.append('A large file did not read back as it was saved')
+
+    remove_repo(file_path)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark and regression harness for Maroon Lines.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='history sizes to benchmark')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help='runs per measurement')
+    parser.add_argument('--max-render-size', type=int, default=DEFAULT_MAX_RENDER_SIZE,
+                        help='largest history to render')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--check', action='store_true', help='only run the regression checks')
+    parser.add_argument('--storage', choices=[STORAGE_LOOSE, STORAGE_SQLITE, STORAGE_MEMORY],
+                        default=STORAGE_BACKEND, help="where repos are kept - 'memory' leaves out disk I/O")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    json_path = os.path.abspath(args.json) if args.json else None
+    original_directory = os.getcwd()
+
+    # Keep repos in a scratch directory instead of the application data location
+    working_directory = tempfile.mkdtemp(prefix='maroon-lines-benchmark-')
+    os.chdir(working_directory)
+    repository_control.USE_APP_DATA_LOCATION = False
+    repository_control.STORAGE_BACKEND = args.storage
+    file_path = os.path.join(working_directory, 'benchmark.txt')
+
+    try:
+        failures = check_regressions(file_path)
+        for failure in failures:
+            print('FAIL: {}'.format(failure))
+        if args.check:
+            return 1 if failures else 0
+
+        all_results = []
+        for num_versions in args.sizes:
+            results = benchmark_history(file_path, num_versions, args.repeats, num_versions <= args.max_render_size)
+            all_results.append(results)
+            print(json.dumps(results))
+
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump(all_results, f, indent=2)
+
+        return 1 if failures else 0
+    finally:
+        os.chdir(original_directory)
+        shutil.rmtree(working_directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
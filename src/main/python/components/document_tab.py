@@ -0,0 +1,112 @@
+import os
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import QTimer
+
+from utils.lru_cache import LRUCache
+from components.editor import PyQodeEditor
+from components.timeline import Timeline
+from components.time_slider import TimeSlider
+
+
+class DocumentTab(QWidget):
+    """
+    A class to represent a single open document - its editor, its timeline (with a time slider under it) and a
+    cached copy of its repo index.
+
+    Attributes
+    ----------
+    file_path - full file location of the document, None if it was never saved.
+    file_hash - hash of the version the document is on.
+    index - cached repo index. Mutated in place as versions are saved, while the disk copy is written behind.
+    compact_index - compact form of index, for the timeline and walks over the history. Rebuilt once index changes.
+    compact_index_key - tuple of the index compact_index was built from and its number of keys at the time.
+    timeline_stale - Boolean that indicates if the timeline has to be re-rendered once it is on screen.
+    timeline_edit_mode - Boolean that indicates if the timeline is, or is about to be, rendered in edit mode.
+    previews - cache of version previews shown when hovering over the timeline, keyed by hash.
+    file_objects - cache of file content of versions browsed recently, keyed by hash.
+    editor_states - cache of undo logs, cursor and scroll positions of versions browsed recently, keyed by hash.
+    pending_checkout - hash and content of the version on display, while it is not yet written to the working file.
+    working_file_hash - hash of the content last written to (or read from) the working file by the application.
+    pending_merge - hash of the version merged into the editor buffer, recorded as a second parent on the next save.
+    pending_version - hash of the version to browse to once the index is loaded, e.g. one picked in the project history.
+
+    """
+
+    DEFAULT_FILE_NAME = 'Untitled'
+    PREVIEW_CACHE_SIZE = 256
+    FILE_OBJECT_CACHE_SIZE = 32
+
+    # Time to settle on a version while browsing history, before it is checked out on disk
+    CHECKOUT_DELAY = 1000
+
+    def __init__(self):
+        super().__init__()
+
+        # Repo-related properties
+        self.file_path = None
+        self.file_hash = None
+        self.index = None
+        self.compact_index = None
+        self.compact_index_key = None
+        self.previews = LRUCache(self.PREVIEW_CACHE_SIZE)
+
+        # Browse mode related properties
+        self.file_objects = LRUCache(self.FILE_OBJECT_CACHE_SIZE)
+        self.editor_states = LRUCache(self.FILE_OBJECT_CACHE_SIZE)
+        self.requested_file_hash = None
+        self.pending_checkout = None
+        self.working_file_hash = None
+        self.pending_merge = None
+        self.pending_version = None
+        self.checkout_timer = QTimer()
+        self.checkout_timer.setSingleShot(True)
+        self.checkout_timer.setInterval(self.CHECKOUT_DELAY)
+
+        # Renders of the timeline requested within one pass of the event loop are done once, at the end of it
+        self.render_timer = QTimer()
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(0)
+
+        # Display-related properties
+        self.language = PyQodeEditor.DEFAULT_LANGUAGE
+        self.num_nodes = 1
+        self.timeline_stale = False
+        self.timeline_edit_mode = False
+
+        # Editor signal bookkeeping
+        self.head_node_changed = False
+
+        # Widget-related properties
+        self.layout = QHBoxLayout()
+        self.editor = PyQodeEditor()
+        self.timeline = Timeline()
+        self.time_slider = TimeSlider()
+
+        # Instantiate relevant components
+        self.configure_layout()
+
+    @property
+    def title(self):
+        """
+        Display name for the tab.
+
+        """
+        if not self.file_path:
+            return self.DEFAULT_FILE_NAME
+
+        return os.path.basename(self.file_path)
+
+    def configure_layout(self):
+        timeline_layout = QVBoxLayout()
+        timeline_layout.setContentsMargins(0, 0, 0, 0)
+        timeline_layout.setSpacing(0)
+        timeline_layout.addWidget(self.timeline)
+        timeline_layout.addWidget(self.time_slider)
+
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.layout.addWidget(self.editor, 85)
+        self.layout.addLayout(timeline_layout, 15)
+        self.setLayout(self.layout)
+
+    def close_timeline(self):
+        self.timeline.close_figure()
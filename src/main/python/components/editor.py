@@ -1,5 +1,6 @@
 import sys
 import os
+import itertools
 # Here, you might want to set the ``QT_API`` to use.
 # Valid values are: 'pyqt5', 'pyqt4' or 'pyside'
 # See
@@ -19,6 +20,13 @@ from PyQt5.QtWidgets import *
 import pygments.lexers as lexers
 from pygments.lexers import find_lexer_class, find_lexer_class_for_filename
 
+from utils.atomic_write import atomic_write
+from utils.undo_log import OperationLog, LOG_STEPS
+from utils.chunk_tree import ChunkTree
+from utils.lru_cache import LRUCache
+from utils.repository_control import get_hash
+from utils.profiler import profiled, CATEGORY_EDITOR, CATEGORY_HASH
+
 
 class LineNumberPanel(DefaultLineNumberPanel):
     """
@@ -50,8 +58,25 @@ class LineNumberPanel(DefaultLineNumberPanel):
 
 
 class PyQodeEditor(CodeEdit):
+    """
+    Inheriting from CodeEdit located in pyqode.
+
+    Undo history is kept in an OperationLog instead of the document's own undo stack, so that it can be saved
+    along with a version and restored when the version is opened again. A shadow copy of the text, kept a block at a
+    time, lets every change be recorded as an exact span - the document only reports where a change happened, not
+    what it removed. A change splices only the blocks it touched into the copy.
+
+    A ChunkTree over the document's blocks is kept up to date from the same changes. The hash of the text is
+    remembered per root of the tree, so telling whether the text is still that of a version does not take a copy
+    of the document, and only hashes the text again once it is different from any text hashed lately. The root of
+    the text last set or stored is kept aside with its hash - whether an edit left the text of that version is told
+    by comparing roots, without hashing the text at all.
+
+    """
 
     language = pyqtSignal(str)
+    modified_changed = pyqtSignal(bool)
+    operations_applied = pyqtSignal()
 
     THEME = 'qt'
     DEFAULT_LANGUAGE = 'Text'
@@ -63,17 +88,41 @@ class PyQodeEditor(CodeEdit):
     MIME = 'text/plain'
     ENCODING = 'utf-8'
 
+    # Keys of editor state
+    STATE_LOG = 'log'
+    STATE_CURSOR = 'cursor'
+    STATE_SCROLL = 'scroll'
+
+    TEXT_HASH_CACHE_SIZE = 64
+
     def __init__(self):
         super().__init__()
 
         self.highlighter = None
 
+        # Undo-related properties
+        self.operation_log = OperationLog()
+        self.shadow_blocks = ['']
+        self.shadow_length = 0
+        self.recording = True
+        self.step_open = False
+        self.applying_operations = False
+        self.text_changing = False
+        self.formatting = False
+
+        # Hash-related properties
+        self.chunk_tree = ChunkTree()
+        self.text_hashes = LRUCache(self.TEXT_HASH_CACHE_SIZE)
+        self.clean_root = self.chunk_tree.root
+        self.clean_hash = None
+
         # Instantiate Components
         # self.configure_backend()
         self.configure_modes_and_panels()
         self.configure_font()
         self.configure_aesthetics()
         self.configure_actions_and_shortcuts()
+        self.configure_undo_log()
         # self.file.open(__file__)
 
     # Start the backend as soon as possible
@@ -116,6 +165,12 @@ class PyQodeEditor(CodeEdit):
         zoom_in.triggered.connect(self.zoom_out)
         self.add_action(zoom_in, sub_menu=None)
 
+    def configure_undo_log(self):
+        self.document().setUndoRedoEnabled(False)
+        self.document().contentsChange.connect(self.handle_contents_change)
+        self.document().contentsChanged.connect(self.handle_contents_changed)
+        self.modificationChanged.connect(self.handle_modification_changed)
+
     def configure_scrollbar_aesthetics(self):
         self.setCenterOnScroll(False)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
@@ -231,25 +286,55 @@ class PyQodeEditor(CodeEdit):
             self.highlighter.pygments_style = self.THEME
             self.modes.append(self.highlighter)
 
-    def set_text(self, text):
+    @profiled(CATEGORY_EDITOR)
+    def set_text(self, text, text_hash=None):
+        """
+        :param text: new text
+        :param text_hash: hash of text, if already at hand
+        :return: None
+        """
+        self.recording = False
         self.setPlainText(text, self.MIME, self.ENCODING)
+        self.recording = True
+
+        # The document normalises line endings and the like - keep a copy of what it actually holds
+        self.shadow_blocks = self.block_texts(0, self.blockCount())
+        self.shadow_length = self.document().characterCount() - 1
+        self.chunk_tree = ChunkTree(self.shadow_blocks)
+        self.record_clean_text(text_hash if self.get_text() == text else None)
+        self.reset_operation_log()
         self.clear_modified_flag()
 
     def clear_text(self):
-        self.setPlainText('', self.MIME, self.ENCODING)
-        self.clear_modified_flag()
+        self.set_text('')
+
+    def replace_text(self, text):
+        """
+        Replace the whole text as a single edit - unlike set_text, it is recorded and can be undone.
+
+        :param text: new text
+        :return: None
+        """
+        cursor = QTextCursor(self.document())
+        cursor.beginEditBlock()
+        cursor.select(QTextCursor.Document)
+        cursor.insertText(text)
+        cursor.endEditBlock()
 
     def get_text(self):
         return self.toPlainText()
 
+    @profiled(CATEGORY_EDITOR)
     def load_file(self, file_path):
         with open(file_path, 'r') as f:
             self.set_text(f.read())
 
+    @profiled(CATEGORY_EDITOR)
     def store_file(self, file_path):
-        with open(file_path, 'w') as f:
-            f.write(self.get_text())
+        atomic_write(file_path, self.get_text())
 
+        self.record_clean_text()
+        self.operation_log.set_clean()
         self.clear_modified_flag()
 
     def get_lines(self):
@@ -259,7 +344,266 @@ class PyQodeEditor(CodeEdit):
         self.document().setModified(False)
 
     def set_modified_flag(self):
+        self.text_changing = True
         self.document().setModified(True)
+        self.text_changing = False
+
+    # Slot Function
+    def handle_contents_change(self, position, chars_removed, chars_added):
+        """
+        Bring the shadow copy in line with the document and record the change in the undo log.
+
+        """
+        self.text_changing = True
+        if not self.recording:
+            return
+
+        # Counts include the closing paragraph separator when the whole document changes - clamp them
+        new_length = self.document().characterCount() - 1
+        chars_added = min(chars_added, new_length - position)
+        chars_removed = self.shadow_length - new_length + chars_added
+
+        # Text before the change is untouched, so the block it starts in is where it was
+        block = self.document().findBlock(position)
+        removed = self.shadow_text(block.blockNumber(), position - block.position(), chars_removed)
+        added = self.text_between(position, position + chars_added)
+
+        # Formatting-only changes, e.g. by the syntax highlighter
+        if removed == added:
+            self.text_changing = False
+            return
+
+        self.shadow_length = new_length
+        self.update_blocks(position, chars_added)
+        if self.applying_operations:
+            return
+
+        # Changes made while handling a single event form a single step
+        self.operation_log.record(position, removed, added, group=self.step_open)
+        if not self.step_open:
+            self.step_open = True
+            QTimer.singleShot(0, self.close_operation_step)
+
+        self.emit_undo_redo_available()
+
+    # Slot Function
+    def handle_modification_changed(self, modified):
+        """
+        Pass the modified flag on, unless it was raised without the text changing. Without an undo stack the document
+        counts any change as a modification, formatting by the syntax highlighter included - the flag is put back once
+        such a change is through.
+
+        """
+        if modified and not self.text_changing and not self.applying_operations:
+            self.formatting = True
+        if not self.formatting:
+            self.modified_changed.emit(modified)
+
+    # Slot Function
+    def handle_contents_changed(self):
+        if self.formatting:
+            self.clear_modified_flag()
+            self.formatting = False
+        self.text_changing = False
+
+    def close_operation_step(self):
+        self.step_open = False
+
+    def update_blocks(self, position, chars_added):
+        """
+        Copy the blocks a change touched into the shadow copy, and rehash them.
+
+        :param position: position the change starts at
+        :param chars_added: number of characters the change added
+        :return: None
+        """
+        first = self.document().findBlock(position).blockNumber()
+        last = self.document().findBlock(position + chars_added).blockNumber()
+        if last < first:
+            last = self.blockCount() - 1
+
+        num_added = last - first + 1
+        num_removed = len(self.shadow_blocks) - self.blockCount() + num_added
+        texts = self.block_texts(first, num_added)
+        self.shadow_blocks[first:first + num_removed] = texts
+        self.chunk_tree.replace(first, num_removed, texts)
+
+    def block_texts(self, first, count):
+        """
+        :param first: number of first block
+        :param count: number of blocks
+        :return: list of text of blocks, with separators and spaces replaced the way toPlainText does it
+        """
+        texts = []
+        block = self.document().findBlockByNumber(first)
+        while block.isValid() and len(texts) < count:
+            texts.append(block.text().replace('\u2028', '\n').replace('\xa0', ' '))
+            block = block.next()
+        return texts
+
+    def shadow_text(self, first, offset, length):
+        """
+        :param first: number of the block the text starts in
+        :param offset: position of the text in that block
+        :param length: number of characters, a separator between blocks counting as one
+        :return: text of the shadow copy - the text before the change being handled
+        """
+        parts = []
+        for text in itertools.islice(self.shadow_blocks, first, None):
+            if length <= 0:
+                break
+
+            part = text[offset:offset + length]
+            parts.append(part)
+            length -= len(part)
+            if length > 0:
+                parts.append('\n')
+                length -= 1
+            offset = 0
+
+        return ''.join(parts)
+
+    @profiled(CATEGORY_HASH)
+    def text_hash(self):
+        """
+        :return: hash of the text on display, as get_hash would compute it from get_text
+        """
+        root = self.chunk_tree.root
+        text_hash = self.text_hashes.get(root)
+        if text_hash is None:
+            text_hash = get_hash(self.get_text())
+            self.text_hashes.put(root, text_hash)
+
+        if root == self.clean_root:
+            self.clean_hash = text_hash
+        return text_hash
+
+    def record_clean_text(self, text_hash=None):
+        """
+        Keep the root of the text on display aside, as the text of a version.
+
+        :param text_hash: hash of the text on display, if known - it is worked out on first use otherwise
+        :return: None
+        """
+        self.clean_root = self.chunk_tree.root
+        self.clean_hash = text_hash
+        if text_hash:
+            self.text_hashes.put(self.clean_root, text_hash)
+
+    @profiled(CATEGORY_HASH)
+    def text_differs_from(self, text_hash):
+        """
+        :param text_hash: hash of a version
+        :return: Boolean representing if the text on display is not the text of the version
+        """
+        if self.clean_hash is None and self.chunk_tree.root == self.clean_root:
+            self.text_hash()
+
+        # Text last set or stored is that of the version - equal roots mean equal text
+        if self.clean_hash == text_hash:
+            return self.chunk_tree.root != self.clean_root
+
+        return self.text_hash() != text_hash
+
+    def text_between(self, start, end):
+        """
+        :param start: start position
+        :param end: end position
+        :return: text between positions, with separators and spaces replaced the way toPlainText does it
+        """
+        if start == end:
+            return ''
+
+        cursor = QTextCursor(self.document())
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        return cursor.selectedText().replace('\u2029', '\n').replace('\u2028', '\n').replace('\xa0', ' ')
+
+    def undo(self):
+        self.apply_operations(self.operation_log.undo())
+
+    def redo(self):
+        self.apply_operations(self.operation_log.redo())
+
+    def apply_operations(self, operations):
+        """
+        Replay replacements returned by the undo log in a single edit block, and place the cursor at the last one.
+
+        :param operations: list of (position, length, text) replacements, None if there is nothing to do
+        :return: None
+        """
+        if operations is None:
+            return
+
+        self.applying_operations = True
+        cursor = QTextCursor(self.document())
+        cursor.beginEditBlock()
+        for position, length, text in operations:
+            cursor.setPosition(position)
+            cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+            cursor.insertText(text)
+        cursor.endEditBlock()
+
+        self.setTextCursor(cursor)
+        self.document().setModified(not self.operation_log.is_clean())
+        self.applying_operations = False
+
+        self.emit_undo_redo_available()
+        self.operations_applied.emit()
+
+    def keyPressEvent(self, event):
+        # The document's undo stack is off, so the standard keys have to be routed to the undo log
+        if event.matches(QKeySequence.Undo):
+            self.undo()
+            return
+        if event.matches(QKeySequence.Redo):
+            self.redo()
+            return
+
+        super().keyPressEvent(event)
+
+    def reset_operation_log(self):
+        self.operation_log = OperationLog()
+        self.step_open = False
+        self.emit_undo_redo_available()
+
+    def emit_undo_redo_available(self):
+        self.undoAvailable.emit(self.operation_log.can_undo())
+        self.redoAvailable.emit(self.operation_log.can_redo())
+
+    def editor_state(self):
+        """
+        :return: python dict object of undo log, cursor position and scroll position
+        """
+        return {
+            self.STATE_LOG: self.operation_log.to_dict(),
+            self.STATE_CURSOR: self.textCursor().position(),
+            self.STATE_SCROLL: self.verticalScrollBar().value()
+        }
+
+    def state_is_blank(self, state):
+        """
+        :param state: python dict object returned by editor_state
+        :return: Boolean representing if state is what set_text leaves behind - nothing worth keeping
+        """
+        return not state[self.STATE_LOG][LOG_STEPS] and not state[self.STATE_CURSOR] and not state[self.STATE_SCROLL]
+
+    def restore_editor_state(self, state):
+        """
+        Put back the undo log, cursor and scroll position saved along with the text on display.
+
+        :param state: python dict object returned by editor_state
+        :return: None
+        """
+        self.operation_log = OperationLog.from_dict(state[self.STATE_LOG])
+        self.operation_log.set_clean()
+        self.step_open = False
+        self.emit_undo_redo_available()
+
+        cursor = self.textCursor()
+        cursor.setPosition(min(state[self.STATE_CURSOR], self.shadow_length))
+        self.setTextCursor(cursor)
+        self.verticalScrollBar().setValue(state[self.STATE_SCROLL])
 
     @staticmethod
     def remove_file(file_path):
@@ -1,16 +1,27 @@
 import sys
+import html
+import time
 import platform
+from functools import partial
 from random import random
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
 from utils.repository_control import *
+from utils.atomic_write import atomic_write
+from utils.repository_worker import RepositoryWorkerPool
+from utils.compact_index import CompactIndex
+from utils.file_watcher import FileWatcher
+from utils.profiler import enable_profiling, write_trace, PROFILE_TRACE_PATH
 from components.editor import PyQodeEditor
 from components.timeline import Timeline
+from components.document_tab import DocumentTab
 from components.unsaved_content_dialog import UnsavedContentDialog
 from components.alert_dialog import AlertDialog
 from components.menu_bar import MenuBar
+from components.performance_hud import PerformanceHud
+from components.project_history_dialog import ProjectHistoryDialog
 
 from IPython import embed
 
@@ -19,33 +30,62 @@ class MaroonLines(QMainWindow):
     """
     Class responsible for stitching up the various components together - Editor, Graph etc.
 
+    Every open document lives in its own tab. Repo I/O of all tabs goes through one shared worker pool.
+
     """
 
     DEFAULT_FILE_NAME = 'Untitled'
+    PACK_FILE_EXTENSION = '.mlpack'
+    PACK_FILE_FILTER = 'Maroon Lines History (*.mlpack)'
+    TRACE_FILE_FILTER = 'Chrome Trace (*.json)'
+
+    # Previews are read in a queue of their own, so that hovering never holds up (or cancels) jobs on the repo
+    PREVIEW_QUEUE = '{}:previews'
+
+    @property
+    def tab(self):
+        """
+        Tab in session.
+
+        """
+        return self.tabs.currentWidget()
+
+    @property
+    def editor(self):
+        return self.tab.editor
+
+    @property
+    def timeline(self):
+        return self.tab.timeline
 
     @property
     def file_path(self):
-        return self._file_path
+        return self.tab.file_path
 
     @file_path.setter
     def file_path(self, value):
-        self._file_path = value
-
-        if self.status_bar:
-            self.update_status_bar_file_path()
+        if self.tab.file_path:
+            self.file_watcher.unwatch_file(self.tab.file_path)
+        if value:
+            self.file_watcher.watch_file(value)
 
-        # Enable rename action only when there is a repo present.
-        if self.rename_move_action:
-            self.rename_move_action.setEnabled(value != None)
+        self.tab.file_path = value
+        self.tabs.setTabText(self.tabs.currentIndex(), self.tab.title)
 
-        # Enable clear history action only when there is a repo present.
-        if self.clear_history_action:
-            self.clear_history_action.setEnabled(value != None)
+        self.update_status_bar_file_path()
+        self.update_repo_actions()
 
         # Configure syntax highlighting everytime file name changes.
-        if self.editor:
-            extension = self.get_extension(value)
-            self.editor.configure_syntax_highlighting(extension)
+        extension = self.get_extension(value)
+        self.editor.configure_syntax_highlighting(extension)
+
+    @property
+    def file_hash(self):
+        return self.tab.file_hash
+
+    @file_hash.setter
+    def file_hash(self, value):
+        self.tab.file_hash = value
 
     @property
     def file_name(self):
@@ -59,44 +99,45 @@ class MaroonLines(QMainWindow):
         super(QMainWindow, self).__init__()
 
         # Repo-related properties
-        self.index = None
-        self.head_node_changed = False
+        self.repository_worker_pool = RepositoryWorkerPool()
+        self.file_watcher = FileWatcher(self.repository_worker_pool)
 
         # Widget-related properties
         self.layout = QHBoxLayout()
         self.central_widget = QWidget()
+        self.tabs = QTabWidget()
         self.menu_bar = MenuBar()
-        self.editor = PyQodeEditor()
-        self.timeline = Timeline()
         self.status_bar = QStatusBar()
         self.status_bar_num_lines_label = QLabel()
         self.status_bar_num_nodes_label = QLabel()
         self.status_bar_file_path_label = QLabel()
         self.status_bar_curr_language_label = QLabel()
+        self.performance_hud = PerformanceHud(self)
+        self.project_history_dialog = None
 
         # Menu bar related properties
         self.rename_move_action = None
         self.clear_history_action = None
-
-        # File-related properties
-        self.file_path = None
-        self.file_hash = None
+        self.verify_history_action = None
+        self.merge_version_action = None
+        self.unwatch_directory_action = None
+        self.performance_hud_action = None
 
         # Shortcuts and corresponding functions
-        self.undo_redo_key_pressed = False
         self.shortcut_arrow_functions = {
-            Qt.Key_Up: self.timeline.move_up,
-            Qt.Key_Down: self.timeline.move_down,
-            Qt.Key_Right: self.timeline.move_right,
-            Qt.Key_Left: self.timeline.move_left
+            Qt.Key_Up: Timeline.move_up,
+            Qt.Key_Down: Timeline.move_down,
+            Qt.Key_Right: Timeline.move_right,
+            Qt.Key_Left: Timeline.move_left
         }
 
         # Instantiate relevant components
         self.configure_layout_and_central_widget()
         self.configure_menu_bar()
         self.configure_status_bar()
-        self.configure_editor()
-        self.configure_timeline()
+        self.configure_worker_pool()
+        self.configure_file_watcher()
+        self.configure_tabs()
         self.configure_and_show_frame()
 
     def eventFilter(self, source, event):
@@ -104,10 +145,6 @@ class MaroonLines(QMainWindow):
         Event filter for Editor to ignore certain shortcuts pertaining to Graph.
 
         """
-        if event.type() == QEvent.KeyPress and event.modifiers() == Qt.ControlModifier and event.key() == Qt.Key_Z:
-            self.undo_redo_key_pressed = True
-            return False
-
         if event.type() != QEvent.KeyPress:
             return False
 
@@ -129,19 +166,42 @@ class MaroonLines(QMainWindow):
             return True
 
         traverse = self.shortcut_arrow_functions[event.key()]
-        traverse()
+        self.render_pending_timeline(self.tab)
+        traverse(self.timeline)
 
         return True
 
+    def changeEvent(self, event):
+        """
+        Timeline is not drawn while the window is minimized - draw it once the window is restored.
+
+        """
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange and not self.isMinimized() and self.tab:
+            self.tab.render_timer.start()
+
     def closeEvent(self, event):
         """
-        Ensure content is saved before window is closed.
+        Ensure content of every tab is saved before window is closed.
 
         """
-        if not self.content_is_saved(close_window=True):
-            event.ignore()
-        else:
-            event.accept()
+        for i in range(self.tabs.count()):
+            self.tabs.setCurrentIndex(i)
+            if not self.content_is_saved(close_window=True):
+                event.ignore()
+                return
+
+        for i in range(self.tabs.count()):
+            self.commit_checkout(self.tabs.widget(i))
+            self.save_editor_state(self.tabs.widget(i))
+
+        # Let pending repo writes land before the application goes down
+        self.repository_worker_pool.wait_for_all()
+
+        if PROFILE_TRACE_PATH:
+            write_trace(PROFILE_TRACE_PATH)
+
+        event.accept()
 
     def configure_layout_and_central_widget(self):
         """
@@ -166,6 +226,7 @@ class MaroonLines(QMainWindow):
 
         file_menu = self.menu_bar.addMenu('File')
         repo_menu = self.menu_bar.addMenu('Repo')
+        view_menu = self.menu_bar.addMenu('View')
 
         new_action = file_menu.addAction('New')
         new_action.setShortcut("Ctrl+N")
@@ -183,6 +244,10 @@ class MaroonLines(QMainWindow):
         save_as_action.setShortcut("Shift+Ctrl+S")
         save_as_action.triggered.connect(self.handle_save_as_action)
 
+        close_tab_action = file_menu.addAction('Close Tab')
+        close_tab_action.setShortcut("Ctrl+F4")
+        close_tab_action.triggered.connect(self.handle_close_tab_action)
+
         exit_action = file_menu.addAction('Exit')
         exit_action.setShortcut("Ctrl+W")
         exit_action.triggered.connect(self.handle_exit_action)
@@ -201,6 +266,48 @@ class MaroonLines(QMainWindow):
         self.clear_history_action.triggered.connect(self.handle_clear_history_action)
         self.clear_history_action.setEnabled(False)
 
+        self.verify_history_action = repo_menu.addAction('Verify History')
+        self.verify_history_action.triggered.connect(self.handle_verify_history_action)
+        self.verify_history_action.setEnabled(False)
+
+        self.label_version_action = repo_menu.addAction('Label Version...')
+        self.label_version_action.setShortcut("Ctrl+L")
+        self.label_version_action.triggered.connect(self.handle_label_version_action)
+        self.label_version_action.setEnabled(False)
+
+        self.merge_version_action = repo_menu.addAction('Merge Version...')
+        self.merge_version_action.triggered.connect(self.handle_merge_version_action)
+        self.merge_version_action.setEnabled(False)
+
+        self.export_history_action = repo_menu.addAction('Export History...')
+        self.export_history_action.triggered.connect(self.handle_export_history_action)
+        self.export_history_action.setEnabled(False)
+
+        self.import_history_action = repo_menu.addAction('Import History...')
+        self.import_history_action.triggered.connect(self.handle_import_history_action)
+        self.import_history_action.setEnabled(False)
+
+        self.pack_history_action = repo_menu.addAction('Compact History')
+        self.pack_history_action.triggered.connect(self.handle_pack_history_action)
+        self.pack_history_action.setEnabled(False)
+
+        project_history_action = repo_menu.addAction('Project History...')
+        project_history_action.triggered.connect(self.handle_project_history_action)
+
+        watch_directory_action = repo_menu.addAction('Watch Directory...')
+        watch_directory_action.triggered.connect(self.handle_watch_directory_action)
+
+        self.unwatch_directory_action = repo_menu.addAction('Stop Watching Directory')
+        self.unwatch_directory_action.triggered.connect(self.handle_unwatch_directory_action)
+        self.unwatch_directory_action.setEnabled(False)
+
+        self.performance_hud_action = view_menu.addAction('Performance HUD')
+        self.performance_hud_action.setCheckable(True)
+        self.performance_hud_action.toggled.connect(self.handle_performance_hud_action)
+
+        save_trace_action = view_menu.addAction('Save Performance Trace...')
+        save_trace_action.triggered.connect(self.handle_save_trace_action)
+
     def configure_status_bar(self):
         """
         Display 4 crucial information through the use of status bar
@@ -214,9 +321,9 @@ class MaroonLines(QMainWindow):
         self.setStatusBar(self.status_bar)
         self.status_bar.setStyleSheet("""
                 QStatusBar {
-                    background-color: #33333d; 
+                    background-color: #33333d;
                  }
-                 
+
                  QStatusBar::item {
                     border: 0px solid black;
                 }""")
@@ -231,12 +338,12 @@ class MaroonLines(QMainWindow):
         self.status_bar_num_nodes_label.setFont(QFont('Calibri', 13))
         self.status_bar_num_nodes_label.setStyleSheet("""padding-right: 2px; color: #CDD7D3;""")
 
-        self.status_bar_file_path_label.setText(self.file_name)
+        self.status_bar_file_path_label.setText(self.DEFAULT_FILE_NAME)
         self.status_bar_file_path_label.setAlignment(Qt.AlignCenter)
         self.status_bar_file_path_label.setFont(QFont('Calibri', 13))
         self.status_bar_file_path_label.setStyleSheet("""padding-right: 2px; color: #CDD7D3;""")
 
-        self.status_bar_curr_language_label.setText(self.editor.DEFAULT_LANGUAGE)
+        self.status_bar_curr_language_label.setText(PyQodeEditor.DEFAULT_LANGUAGE)
         self.status_bar_curr_language_label.setAlignment(Qt.AlignCenter)
         self.status_bar_curr_language_label.setFont(QFont('Calibri', 13))
         self.status_bar_curr_language_label.setStyleSheet("""padding-right: 2px; color: #CDD7D3;""")
@@ -246,7 +353,53 @@ class MaroonLines(QMainWindow):
         self.status_bar.addPermanentWidget(self.status_bar_file_path_label, 120)
         self.status_bar.addPermanentWidget(self.status_bar_num_nodes_label, 40)
 
-    def configure_editor(self):
+    def configure_worker_pool(self):
+        self.repository_worker_pool.job_failed.connect(self.handle_repository_job_failed)
+
+    def configure_file_watcher(self):
+        self.file_watcher.open_file_changed.connect(self.handle_open_file_changed)
+
+    def configure_tabs(self):
+        """
+        Tabs hold one document each. A fresh tab is always present.
+
+        """
+        self.tabs.setDocumentMode(True)
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.setStyleSheet("""
+                QTabBar::tab {
+                    background-color: rgb(51, 51, 61);
+                    color: rgb(205,215,211);
+                    padding: 6px 12px;
+                }
+
+                QTabBar::tab:selected {
+                    background-color: rgb(60, 60, 60);
+                }""")
+        self.tabs.currentChanged.connect(self.handle_current_tab_changed)
+        self.tabs.tabCloseRequested.connect(self.handle_tab_close_requested)
+        self.layout.addWidget(self.tabs)
+
+        self.create_tab()
+
+    def create_tab(self):
+        """
+        Add a tab with an empty document and switch to it.
+
+        :return: DocumentTab
+        """
+        tab = DocumentTab()
+        self.configure_editor(tab)
+        self.configure_timeline(tab)
+
+        self.tabs.addTab(tab, tab.title)
+        self.tabs.setCurrentWidget(tab)
+        self.render_timeline(tab)
+
+        return tab
+
+    def configure_editor(self, tab):
         """
         Monitor 3 crucial information
         1. Language used
@@ -254,18 +407,22 @@ class MaroonLines(QMainWindow):
         3. File modified signal after it was saved/opened/moved etc
 
         """
-        self.editor.language.connect(self.update_status_bar_language)
-        self.editor.textChanged.connect(self.update_status_bar_num_lines)
-        self.editor.modificationChanged.connect(self.display_graph_in_edit_mode)
-        self.editor.installEventFilter(self)
-        self.layout.addWidget(self.editor, 85)
-
-    def configure_timeline(self):
-        self.timeline.request_to_change_node.connect(self.handle_request_to_change_node)
-        self.timeline.head_node_changed.connect(self.load_repo_file_object)
-        self.timeline.num_nodes_changed.connect(self.update_status_bar_num_nodes)
-        self.render_timeline()
-        self.layout.addWidget(self.timeline, 15)
+        tab.editor.language.connect(partial(self.update_status_bar_language, tab))
+        tab.editor.textChanged.connect(partial(self.update_status_bar_num_lines, tab))
+        tab.editor.modified_changed.connect(partial(self.display_graph_in_edit_mode, tab))
+        tab.editor.operations_applied.connect(partial(self.handle_operations_applied, tab))
+        tab.editor.installEventFilter(self)
+        tab.checkout_timer.timeout.connect(partial(self.commit_checkout, tab))
+        tab.render_timer.timeout.connect(partial(self.handle_render_timer_timeout, tab))
+
+    def configure_timeline(self, tab):
+        tab.timeline.request_to_change_node.connect(partial(self.handle_request_to_change_node, tab))
+        tab.timeline.head_node_changed.connect(partial(self.load_repo_file_object, tab))
+        tab.timeline.num_nodes_changed.connect(partial(self.update_status_bar_num_nodes, tab))
+        tab.timeline.request_node_preview.connect(partial(self.handle_request_node_preview, tab))
+        tab.timeline.head_node_changed.connect(tab.time_slider.set_head)
+        tab.timeline.became_visible.connect(tab.render_timer.start)
+        tab.time_slider.request_to_change_node.connect(partial(self.handle_request_to_change_node, tab))
 
     def configure_and_show_frame(self):
         """
@@ -278,38 +435,49 @@ class MaroonLines(QMainWindow):
 
     def handle_new_action(self):
         """
-        Clean editor, graph and all relevant components to start afresh.
+        Open an empty document in a new tab.
 
         """
-        if not self.content_is_saved():
-            return
-
-        self.editor.clear_text()
-
-        self.update_file_path_and_hash()
-        self.render_timeline()
+        self.create_tab()
 
     def handle_open_action(self):
         """
         Load a new file and kickstart relevant component changes.
 
         """
-        if not self.content_is_saved():
-            return
-
         file_info = QFileDialog.getOpenFileName(self, 'Open File')
         file_path, file_type = str(file_info[0]), file_info[1]
 
         if not file_path:
             return
 
+        self.open_file(file_path)
+
+    def open_file(self, file_path):
+        """
+        :param file_path: full file location (inclusive of name and extension)
+        :return: tab of the file
+        """
+        # Files already open are brought to the front instead of being reloaded
+        tab = self.find_tab(file_path)
+        if tab:
+            self.tabs.setCurrentWidget(tab)
+            return tab
+
+        # Reuse the tab in session if nothing was written in it yet
+        if not self.file_is_virgin():
+            self.create_tab()
+
         self.editor.load_file(file_path)
 
-        self.load_index(file_path)
+        self.load_index(self.tab, file_path)
 
         self.update_file_path_and_hash(file_path)
+        self.load_editor_state(self.tab)
         self.render_timeline()
 
+        return self.tab
+
     def handle_save_action(self):
         """
         Save file in session and update repo.
@@ -320,16 +488,26 @@ class MaroonLines(QMainWindow):
         if not self.file_path:
             return self.handle_save_as_action()
 
+        self.commit_checkout(self.tab)
         self.editor.store_file(self.file_path)
 
         file_data = self.editor.get_text()
-        self.file_hash = get_hash(file_data)
-
-        if repo_file_object_exists(self.file_path, self.file_hash):
-            update_repo_index_head(self.file_path, self.file_hash)
+        self.file_hash = self.editor.text_hash()
+        self.tab.working_file_hash = self.file_hash
+        self.tab.file_objects.put(self.file_hash, file_data)
+
+        index = self.tab_index()
+        if self.file_hash in index:
+            update_index_dict_head(index, self.file_hash)
+            self.repository_worker_pool.submit(self.file_path, update_repo_index_head, self.file_path, self.file_hash)
         else:
-            add_file_object_to_index(self.file_path, file_data)
+            add_file_hash_to_index_dict(index, self.file_hash, merged_file_hash=self.tab.pending_merge)
+            self.repository_worker_pool.submit(self.file_path, add_file_object_to_index, self.file_path, file_data,
+                                               False, self.tab.pending_merge,
+                                               callback=partial(self.handle_file_object_recorded, self.tab))
+        self.tab.pending_merge = None
 
+        self.save_editor_state(self.tab)
         self.render_timeline()
 
         return True
@@ -350,23 +528,37 @@ class MaroonLines(QMainWindow):
         if self.file_path and self.file_path == file_path:
             return self.handle_save_action()
 
+        self.commit_checkout(self.tab)
         self.editor.store_file(file_path)
 
         # if there is an intent to create a copy of the file and its history
         if self.file_path and self.file_path != file_path:
-            copy_repo(old_file_path=self.file_path, new_file_path=file_path)
-            if self.index_head_differs_from_live_text(self.file_path):
+            index = copy_index_dict(self.tab_index())
+
+            # Pending writes to the old repo have to land before it is copied
+            self.repository_worker_pool.wait_for_repo(self.file_path)
+            self.repository_worker_pool.submit(file_path, copy_repo, self.file_path, file_path)
+
+            file_data = self.editor.get_text()
+            file_hash = get_hash(file_data)
+            if index[INDEX_HEAD] != file_hash:
                 # Check if newly saved content is pre-existing in repo history.
-                if repo_file_object_exists(self.file_path, self.file_hash):
-                    update_repo_index_head(self.file_path, self.file_hash)
+                if file_hash in index:
+                    update_index_dict_head(index, file_hash)
+                    self.repository_worker_pool.submit(file_path, update_repo_index_head, file_path, file_hash)
                 else:
-                    add_file_object_to_index(self.file_path, self.editor.get_text(), adopted=True)
+                    add_file_hash_to_index_dict(index, file_hash, adopted=True)
+                    self.repository_worker_pool.submit(file_path, add_file_object_to_index,
+                                                       file_path, file_data, True,
+                                                       callback=partial(self.handle_file_object_recorded, self.tab))
+            self.tab.index = index
 
         # brand new file - maiden save
         if not self.file_path:
             self.create_index(file_path)
 
         self.update_file_path_and_hash(file_path)
+        self.save_editor_state(self.tab)
         self.render_timeline()
 
         return True
@@ -385,14 +577,20 @@ class MaroonLines(QMainWindow):
         if not file_path or self.file_path == file_path:
             return
 
+        self.commit_checkout(self.tab)
         self.editor.remove_file(self.file_path)
         self.editor.store_file(file_path)
 
-        move_repo(old_file_path=self.file_path, new_file_path=file_path)
+        # Pending writes to the old repo have to land before it is moved
+        self.repository_worker_pool.wait_for_repo(self.file_path)
+        self.repository_worker_pool.submit(file_path, move_repo, self.file_path, file_path)
 
         self.update_file_path_and_hash(file_path)
         self.render_timeline()
 
+    def handle_close_tab_action(self):
+        self.handle_tab_close_requested(self.tabs.currentIndex())
+
     def handle_exit_action(self):
         self.close()
 
@@ -407,39 +605,290 @@ class MaroonLines(QMainWindow):
         if not clicked_button or clicked_button == QDialogButtonBox.Cancel:
             return
 
+        self.commit_checkout(self.tab)
+        self.tab.editor_states.clear()
+
         # There will be a case where uses wishes to clear history while the current text is not saved.
         # This accounts for that case - ensuring current text is not saved but its history is cleared.
-        if self.index_head_differs_from_live_text(self.file_path):
-            file_data = repo_file_object(self.file_path, self.file_hash)
-            edit_mode = True
-        else:
-            file_data = self.editor.get_text()
-            edit_mode = False
+        edit_mode = self.index_head_differs_from_live_text()
+
+        head_file_hash = self.tab_index()[INDEX_HEAD]
+        self.tab.index = build_index_dict_from_file_hashes([head_file_hash])
+        self.repository_worker_pool.submit(self.file_path, rebuilt_repo_from_file_object,
+                                           self.file_path, head_file_hash,
+                                           callback=partial(self.handle_file_object_recorded, self.tab))
 
-        rebuilt_repo(self.file_path, file_data)
         self.render_timeline(edit_mode=edit_mode)
 
+    def handle_label_version_action(self):
+        """
+        Name the version in session, e.g. 'before refactor'. An empty label removes it.
+
+        """
+        index = self.tab_index()
+        file_hash = index[INDEX_HEAD]
+        file_meta = index_dict_file_meta(index, file_hash)
+        label = file_meta[META_LABEL] if file_meta else None
+
+        label, accepted = QInputDialog.getText(self, 'Label Version', 'Label:', text=label or '')
+        if not accepted:
+            return
+
+        label = label.strip()
+        update_index_dict_label(index, file_hash, label)
+        self.repository_worker_pool.submit(self.file_path, update_repo_index_label, self.file_path, file_hash, label)
+
+    def handle_merge_version_action(self):
+        """
+        Bring another branch into the version in session. The two are merged line by line against their common
+        ancestor, and the result is saved as a version with both as parents. Lines changed differently on both
+        branches are left in the editor between conflict markers - the merge is recorded once they are saved.
+
+        """
+        if not self.content_is_saved():
+            return
+
+        tab = self.tab
+        index = self.tab_index(tab)
+        file_hash = index[INDEX_HEAD]
+
+        candidates = self.merge_candidates(index)
+        if not candidates:
+            self.status_bar.showMessage('There are no other branches to merge', 3000)
+            return
+
+        items = [self.describe_version(index, candidate) for candidate in candidates]
+        item, accepted = QInputDialog.getItem(self, 'Merge Version', 'Merge into the version in session:', items,
+                                              0, False)
+        if not accepted:
+            return
+
+        other_file_hash = candidates[items.index(item)]
+        compact_index = self.tab_compact_index(tab)
+        ids = compact_index.ids
+        base_file_hash = compact_index.hashes[compact_index.common_ancestor(ids[file_hash], ids[other_file_hash])]
+        if base_file_hash == other_file_hash:
+            self.status_bar.showMessage('Version is already part of the version in session', 3000)
+            return
+
+        # Nothing happened on this branch since the two split - the other version is the merge
+        if base_file_hash == file_hash:
+            self.render_pending_timeline(tab)
+            tab.timeline.switch_node_colors(other_file_hash)
+            return
+
+        self.commit_checkout(tab)
+        self.repository_worker_pool.submit(tab.file_path, merge_file_objects, tab.file_path,
+                                           base_file_hash, file_hash, other_file_hash,
+                                           callback=partial(self.handle_versions_merged, tab, file_hash,
+                                                            other_file_hash))
+
+    def handle_export_history_action(self):
+        """
+        Write the history of the file in session to a single pack file, e.g. to back it up or move it.
+
+        """
+        file_info = QFileDialog.getSaveFileName(self, 'Export History', self.file_path + self.PACK_FILE_EXTENSION,
+                                                self.PACK_FILE_FILTER)
+        pack_path = str(file_info[0])
+        if not pack_path:
+            return
+
+        self.commit_checkout(self.tab)
+        self.repository_worker_pool.submit(self.file_path, export_repo, self.file_path, pack_path,
+                                           callback=lambda _: self.status_bar.showMessage('History exported', 3000))
+
+    def handle_import_history_action(self):
+        """
+        Replace the history of the file in session with one from a pack file. Content in session is kept, and
+        adopted by the imported history if it is new to it.
+
+        """
+        file_info = QFileDialog.getOpenFileName(self, 'Import History', '', self.PACK_FILE_FILTER)
+        pack_path = str(file_info[0])
+        if not pack_path:
+            return
+
+        dialog = AlertDialog(self.file_path, text_to_display='Are you sure about replacing your file history?')
+        clicked_button = dialog.exec_()
+
+        if not clicked_button or clicked_button == QDialogButtonBox.Cancel:
+            return
+
+        tab = self.tab
+        self.commit_checkout(tab)
+        tab.index = None
+        self.repository_worker_pool.submit(tab.file_path, import_repo, pack_path, tab.file_path)
+        self.repository_worker_pool.submit(tab.file_path, reopen_repo, tab.file_path,
+                                           callback=partial(self.handle_index_loaded, tab))
+
+    def handle_pack_history_action(self):
+        """
+        Move every version of the file in session into a single pack file.
+
+        """
+        self.repository_worker_pool.submit(self.file_path, pack_repo, self.file_path,
+                                           callback=lambda _: self.status_bar.showMessage('History compacted', 3000))
+
+    def handle_verify_history_action(self):
+        """
+        Check the history of a particular file for damage and offer to repair it.
+
+        """
+        self.repository_worker_pool.submit(self.file_path, verify_repo, self.file_path,
+                                           callback=partial(self.handle_verify_history_report, self.tab))
+
+    def handle_project_history_action(self):
+        """
+        Browse the histories of every tracked file under a directory.
+
+        """
+        directory = QFileDialog.getExistingDirectory(self, 'Project History')
+        if not directory:
+            return
+
+        if not self.project_history_dialog:
+            self.project_history_dialog = ProjectHistoryDialog(self.repository_worker_pool, self)
+            self.project_history_dialog.request_to_open_version.connect(self.handle_request_to_open_version)
+
+        self.project_history_dialog.browse(directory)
+        self.project_history_dialog.show()
+        self.project_history_dialog.raise_()
+
+    # Slot Function
+    def handle_request_to_open_version(self, file_path, file_hash):
+        """
+        Open a file picked in the project history - at a version of it, unless file_hash is empty.
+
+        """
+        if not os.path.isfile(file_path):
+            self.status_bar.showMessage('Unable to open {}: file no longer exists'.format(file_path), 5000)
+            return
+
+        tab = self.open_file(file_path)
+        if not file_hash:
+            return
+
+        # Index is still being loaded - the load moves to the version once it is done
+        if tab.index is None:
+            tab.pending_version = file_hash
+            return
+
+        self.move_to_version(tab, file_hash)
+
+    def move_to_version(self, tab, file_hash):
+        """
+        Browse to a version of the file in session, as if it was picked on the timeline.
+
+        """
+        if file_hash not in tab.index:
+            self.status_bar.showMessage('Version {} is no longer in the history'.format(file_hash[:8]), 5000)
+            return
+
+        self.render_pending_timeline(tab)
+        self.handle_request_to_change_node(tab, file_hash)
+
+    def handle_watch_directory_action(self):
+        """
+        Record edits made outside the application to any tracked file in a directory.
+
+        """
+        directory = QFileDialog.getExistingDirectory(self, 'Watch Directory')
+        if not directory:
+            return
+
+        self.file_watcher.watch_directory(directory)
+        self.unwatch_directory_action.setEnabled(True)
+
+    def handle_unwatch_directory_action(self):
+        self.file_watcher.unwatch_directory()
+        self.unwatch_directory_action.setEnabled(False)
+
+    def handle_performance_hud_action(self, checked):
+        """
+        Show where time goes while using the application. Spans are only recorded while the overlay is on screen,
+        or from start-up if MAROON_LINES_PROFILE is set.
+
+        """
+        enable_profiling(checked or bool(PROFILE_TRACE_PATH))
+        self.performance_hud.set_shown(checked)
+
+    def handle_save_trace_action(self):
+        """
+        Write the spans recorded so far to a Chrome trace file, which loads in chrome://tracing and Perfetto.
+
+        """
+        file_info = QFileDialog.getSaveFileName(self, 'Save Performance Trace', 'maroon-lines-trace.json',
+                                                self.TRACE_FILE_FILTER)
+        trace_path = str(file_info[0])
+        if not trace_path:
+            return
+
+        try:
+            write_trace(trace_path)
+        except OSError as error:
+            self.status_bar.showMessage('Unable to save trace: {}'.format(error), 5000)
+            return
+
+        self.status_bar.showMessage('Performance trace saved', 3000)
+
     # Development code - comment out during production
     # def handle_insert_action(self):
     #     self.editor.set_text(str(random()))
     #     self.handle_save_action()
 
-    def render_timeline(self, edit_mode=False):
+    def render_timeline(self, tab=None, edit_mode=False):
         """
-        Draw network.
+        Mark network to be drawn. It is drawn once control returns to the event loop, so that any number of requests
+        made while handling one event cost a single render - and not at all while the timeline is off screen, until
+        it is back on it.
 
         """
-        if self.file_path:
-            index = repo_index(self.file_path)
-        else:
-            index = None
+        tab = tab or self.tab
+        tab.timeline_stale = True
+        tab.timeline_edit_mode = edit_mode
+        tab.render_timer.start()
+
+    # Slot Function
+    def handle_render_timer_timeout(self, tab):
+        if not self.tab_is_open(tab) or not tab.timeline.is_on_screen():
+            return
+
+        self.render_pending_timeline(tab)
+
+    def render_pending_timeline(self, tab):
+        """
+        Draw network right away if a render of it is pending, e.g. before the graph on display is read or moved.
+
+        """
+        if not tab.timeline_stale:
+            return
+
+        tab.render_timer.stop()
+        tab.timeline_stale = False
+        edit_mode = tab.timeline_edit_mode
+
+        # Index is still being loaded - the load will draw the network once it is done
+        if tab.file_path and tab.index is None:
+            return
+
+        index = self.tab_compact_index(tab) if tab.file_path else None
+
+        tab.timeline.render_graph(index, edit_mode=edit_mode)
+        tab.time_slider.set_index(tab.index if tab.file_path else None)
+
+    def set_timeline_edit_mode(self, tab, edit_mode):
+        """
+        Show or hide the unsaved node, without rendering the network again.
+
+        """
+        tab.timeline_edit_mode = edit_mode
 
-        if index and edit_mode:
-            head = index[INDEX_HEAD]
-            index[head].append(self.timeline.UNSAVED_NODE)
-            index[self.timeline.UNSAVED_NODE] = []
+        # A pending render draws the unsaved node along with the rest
+        if tab.timeline_stale:
+            return
 
-        self.timeline.render_graph(index, edit_mode=edit_mode)
+        tab.timeline.set_edit_mode(edit_mode)
 
     def content_is_saved(self, close_window=False):
         """
@@ -464,114 +913,572 @@ class MaroonLines(QMainWindow):
             return True
 
     def create_index(self, file_path):
-        if repo_exists(file_path):
-            remove_repo(file_path)
+        file_data = self.editor.get_text()
+        self.tab.index = build_index_dict(file_data)
+        self.repository_worker_pool.submit(file_path, rebuilt_repo, file_path, file_data,
+                                           callback=partial(self.handle_file_object_recorded, self.tab))
 
-        init_repo(file_path, self.editor.get_text())
+    def load_index(self, tab, file_path):
+        tab.index = None
+        self.repository_worker_pool.submit(file_path, open_repo, file_path, tab.editor.get_text(),
+                                           callback=partial(self.handle_index_loaded, tab))
 
-    def load_index(self, file_path):
-        file_data = self.editor.get_text()
+    def tab_index(self, tab=None):
+        """
+        Cached index of a tab. If the index is still being loaded, wait for it.
+
+        :return: 'index' object
+        """
+        tab = tab or self.tab
+
+        if tab.index is None:
+            self.repository_worker_pool.wait_for_repo(tab.file_path)
+            tab.index = repo_index(tab.file_path)
+
+        return tab.index
+
+    def tab_compact_index(self, tab=None):
+        """
+        Cached compact form of the index of a tab. Versions are only ever added to a cached index, or the index is
+        replaced as a whole - so it is rebuilt only if the index is not the one it was built from, or has more keys.
+
+        :return: CompactIndex object
+        """
+        tab = tab or self.tab
+        index = self.tab_index(tab)
+
+        built_from, num_keys = tab.compact_index_key or (None, 0)
+        if built_from is not index or num_keys != len(index):
+            tab.compact_index = CompactIndex.from_index_dict(index)
+            tab.compact_index_key = (index, len(index))
+        else:
+            # Metadata is shared with the index - only a change of head is left to catch up with
+            tab.compact_index.head = tab.compact_index.ids[index[INDEX_HEAD]]
+
+        return tab.compact_index
+
+    def find_tab(self, file_path):
+        for i in range(self.tabs.count()):
+            tab = self.tabs.widget(i)
+            if tab.file_path == file_path:
+                return tab
+
+        return None
+
+    def tab_is_open(self, tab):
+        return self.tabs.indexOf(tab) != -1
+
+    # Slot Function
+    def handle_index_loaded(self, tab, index):
+        # Index was already read in place by tab_index, and may have been changed since
+        if not self.tab_is_open(tab) or tab.index is not None:
+            return
+
+        tab.index = index
+        self.render_timeline(tab, edit_mode=self.file_in_edit_mode(tab))
+
+        if tab.pending_version and tab is self.tab:
+            self.move_to_version(tab, tab.pending_version)
+        tab.pending_version = None
+
+    # Slot Function
+    def handle_file_object_recorded(self, tab, result):
+        """
+        Metadata of a version is only known once its file object is written - copy it into the cached index.
+
+        """
+        if not self.tab_is_open(tab) or tab.index is None:
+            return
+
+        file_hash, file_meta = result
+        add_file_meta_to_index_dict(tab.index, file_hash, file_meta)
+        tab.time_slider.set_index(tab.index)
+
+    # Slot Function
+    def handle_versions_merged(self, tab, file_hash, other_file_hash, result):
+        """
+        Put the merged content in the editor as an edit of the version in session, and save it unless it has
+        conflicts left to resolve.
+
+        """
+        # The user may have moved on, or started typing, in the meantime
+        if not self.tab_is_open(tab) or tab.file_hash != file_hash or self.file_in_edit_mode(tab):
+            return
+
+        file_data, conflicts = result
+        tab.pending_merge = other_file_hash
+        tab.editor.replace_text(file_data)
+
+        if conflicts:
+            self.status_bar.showMessage('{} conflicts - resolve them and save to record the merge'.format(conflicts))
+        elif tab is self.tab:
+            self.handle_save_action()
+
+    # Slot Function
+    def handle_verify_history_report(self, tab, report):
+        if not self.tab_is_open(tab):
+            return
+
+        if repo_is_healthy(report):
+            self.status_bar.showMessage('History is intact', 3000)
+            return
+
+        text_to_display = 'History is damaged ({} corrupt, {} missing versions{}). Repair it?'.format(
+            len(report[REPORT_CORRUPT_OBJECTS]),
+            len(report[REPORT_MISSING_OBJECTS]),
+            ', damaged index' if report[REPORT_INDEX_DAMAGED] else '')
+        dialog = AlertDialog(tab.file_path, text_to_display=text_to_display)
+        clicked_button = dialog.exec_()
+
+        if not clicked_button or clicked_button == QDialogButtonBox.Cancel:
+            return
+
+        tab.index = None
+        self.repository_worker_pool.submit(tab.file_path, repair_repo, tab.file_path)
+        self.repository_worker_pool.submit(tab.file_path, repo_index, tab.file_path,
+                                           callback=partial(self.handle_index_loaded, tab))
+
+    # Slot Function
+    def handle_repository_job_failed(self, file_path, error):
+        """
+        The cached index of a tab is changed before the job that writes the change runs, so a failed job leaves it
+        ahead of the repo. It is read back from the repo once the jobs queued after the failed one are through.
+
+        """
+        self.status_bar.showMessage(error.strip().splitlines()[-1], 5000)
+
+        # Index is being read already
+        tab = self.find_tab(file_path)
+        if not tab or tab.index is None:
+            return
+
+        tab.index = None
+        self.repository_worker_pool.submit(file_path, repo_index, file_path,
+                                           callback=partial(self.handle_index_reloaded, tab))
+
+    # Slot Function
+    def handle_index_reloaded(self, tab, index):
+        """
+        Put back the index as it is in the repo. Content the repo did not take in, e.g. that of a failed save, is left
+        in the editor as an edit of head - to be saved again.
+
+        """
+        if not self.tab_is_open(tab) or tab.index is not None:
+            return
+
+        tab.index = index
+        tab.file_hash = index[INDEX_HEAD]
+        if self.index_head_differs_from_live_text(tab):
+            tab.editor.set_modified_flag()
+
+        self.render_timeline(tab, edit_mode=self.file_in_edit_mode(tab))
+
+    # Slot Function
+    def handle_open_file_changed(self, file_path, file_hash, file_data):
+        """
+        Adopt content written to an open file by a 3rd party. Unsaved changes in the tab are kept on top of it.
+
+        """
+        tab = self.find_tab(file_path)
+        if not tab or tab.index is None:
+            return
+
+        # Writes of the application itself
+        if file_hash == tab.working_file_hash:
+            return
+
+        # The 3rd party content wins over a version that was browsed to but not checked out yet
+        self.discard_checkout(tab)
+
+        index = tab.index
+        if file_hash in index:
+            update_index_dict_head(index, file_hash)
+            self.repository_worker_pool.submit(file_path, update_repo_index_head, file_path, file_hash)
+        else:
+            add_file_hash_to_index_dict(index, file_hash, adopted=True)
+            self.repository_worker_pool.submit(file_path, add_file_object_to_index, file_path, file_data, True,
+                                               callback=partial(self.handle_file_object_recorded, tab))
+
+        edit_mode = self.file_in_edit_mode(tab)
+        if not edit_mode:
+            self.save_editor_state(tab)
+
+        tab.file_hash = file_hash
+        tab.working_file_hash = file_hash
+
+        if not edit_mode:
+            tab.head_node_changed = True
+            tab.editor.set_text(file_data, file_hash)
+
+        self.render_timeline(tab, edit_mode=edit_mode)
+
+    # Slot Function
+    def handle_current_tab_changed(self, index):
+        tab = self.tab
+        if not tab:
+            return
+
+        self.update_status_bar_file_path()
+        self.update_status_bar_language(tab, tab.language)
+        self.update_status_bar_num_lines(tab)
+        self.update_status_bar_num_nodes(tab, tab.num_nodes)
+        self.update_repo_actions()
+
+        if tab.timeline_stale:
+            tab.render_timer.start()
 
-        if not repo_exists(file_path):
-            init_repo(file_path, file_data)
+    # Slot Function
+    def handle_tab_close_requested(self, index):
+        self.tabs.setCurrentIndex(index)
+        if not self.content_is_saved():
             return
 
-        if self.index_head_differs_from_live_text(file_path):
-            # Check if content is pre-existing in repo history.
-            if repo_file_object_exists(file_path, file_data):
-                update_repo_index_head(file_path, file_data)
-            else:
-                # This means file was somehow edited by 3rd party, which forces the current history to adopt it.
-                add_file_object_to_index(file_path, file_data, adopted=True)
+        tab = self.tabs.widget(index)
+        self.commit_checkout(tab)
+        self.save_editor_state(tab)
+        if tab.file_path:
+            self.file_watcher.unwatch_file(tab.file_path)
+        self.tabs.removeTab(index)
+        tab.close_timeline()
+        tab.deleteLater()
+
+        if not self.tabs.count():
+            self.create_tab()
 
     # Slot Function
-    def update_status_bar_num_lines(self):
-        self.status_bar_num_lines_label.setText('Lines: {}'.format(self.editor.get_lines()))
+    def update_status_bar_num_lines(self, tab):
+        if tab is self.tab:
+            self.status_bar_num_lines_label.setText('Lines: {}'.format(tab.editor.get_lines()))
 
     # Slot Function
-    def update_status_bar_num_nodes(self, num_nodes):
-        self.status_bar_num_nodes_label.setText('Versions: {}'.format(num_nodes))
+    def update_status_bar_num_nodes(self, tab, num_nodes):
+        tab.num_nodes = num_nodes
+        if tab is self.tab:
+            self.status_bar_num_nodes_label.setText('Versions: {}'.format(num_nodes))
 
     # Slot Function
     def update_status_bar_file_path(self):
         self.status_bar_file_path_label.setText(self.file_name)
 
     # Slot Function
-    def update_status_bar_language(self, language):
-        self.status_bar_curr_language_label.setText(language)
+    def update_status_bar_language(self, tab, language):
+        tab.language = language
+        if tab is self.tab:
+            self.status_bar_curr_language_label.setText(language)
 
     # Slot Function
-    def handle_request_to_change_node(self, node_to_change_to):
+    def handle_request_to_change_node(self, tab, node_to_change_to):
+        if node_to_change_to == tab.timeline.head_file_hash():
+            return
+
         if not self.content_is_saved():
+            tab.time_slider.set_head(tab.timeline.head_file_hash())
             return
 
-        self.timeline.switch_node_colors(node_to_change_to)
+        tab.timeline.switch_node_colors(node_to_change_to)
 
     # Slot Function
-    def display_graph_in_edit_mode(self, file_modified):
+    def handle_request_node_preview(self, tab, node):
+        """
+        Peek at a version without checking it out. Previews come from the tab's cache, or else from the small
+        sidecar stored next to the file object - never from the file object itself.
+
+        """
+        if not tab.file_path:
+            return
+
+        preview = tab.previews.get(node)
+        if preview:
+            tab.timeline.show_preview(node, self.format_preview(tab, node, preview))
+            return
+
+        self.repository_worker_pool.submit(self.PREVIEW_QUEUE.format(tab.file_path),
+                                           repo_file_preview, tab.file_path, node,
+                                           callback=partial(self.handle_preview_loaded, tab, node),
+                                           latest_only=True)
+
+    # Slot Function
+    def handle_preview_loaded(self, tab, node, preview):
+        if not self.tab_is_open(tab):
+            return
+
+        tab.previews.put(node, preview)
+        tab.timeline.show_preview(node, self.format_preview(tab, node, preview))
+
+    def format_preview(self, tab, node, preview):
+        """
+        :param tab: tab the preview belongs to
+        :param node: hash of the version previewed
+        :param preview: python dict object returned by repo_file_preview
+        :return: rich text of the label, save time and first lines of a version, and how its size compares to the
+        version on display
+        """
+        summary = '{} lines, {} bytes'.format(preview[PREVIEW_NUM_LINES], preview[PREVIEW_SIZE])
+        if not self.file_in_edit_mode(tab):
+            # A trailing newline leaves an empty last block, which previews do not count as a line
+            num_lines = tab.editor.blockCount() - (0 if tab.editor.document().lastBlock().text() else 1)
+            difference = preview[PREVIEW_NUM_LINES] - num_lines
+            if difference:
+                summary += ' ({:+d} lines)'.format(difference)
+
+        file_meta = index_dict_file_meta(tab.index, node) if tab.index else None
+        if file_meta:
+            summary += '<br>Saved {}'.format(time.strftime('%Y-%m-%d %H:%M', time.localtime(file_meta[META_CREATED])))
+            if file_meta[META_LABEL]:
+                summary = '{}<br>{}'.format(html.escape(file_meta[META_LABEL]), summary)
+
+        return '<b>{}</b><pre>{}</pre>'.format(summary, html.escape(preview[PREVIEW_PREFIX]))
+
+    # Slot Function
+    def display_graph_in_edit_mode(self, tab, file_modified):
         """
         Display a unorthodox node with a dotted edge to its parent, to demonstrate the unsaved nature of a file.
 
         """
-        if not self.file_path or not self.file_hash:
+        if not tab.file_path or not tab.file_hash:
             return
 
-        if self.undo_redo_key_pressed:
-            self.undo_redo_key_pressed = False
-            edit_mode = not self.file_content_did_not_change()
-            self.render_timeline(edit_mode=edit_mode)
+        # Undo and redo are handled once they are done
+        if tab.editor.applying_operations:
             return
 
+        # Editing a version that was browsed to checks it out
+        if file_modified:
+            self.commit_checkout(tab)
+
         if not file_modified:
             return
 
-        if self.head_node_changed:
-            self.head_node_changed = False
+        if tab.head_node_changed:
+            tab.head_node_changed = False
+            return
+
+        self.set_timeline_edit_mode(tab, True)
+
+    # Slot Function
+    def handle_operations_applied(self, tab):
+        """
+        Undo or redo moved the document onto, or away from, the version it was loaded or saved as.
+
+        """
+        if not tab.file_path or not tab.file_hash:
             return
 
-        self.render_timeline(edit_mode=True)
+        edit_mode = self.file_in_edit_mode(tab)
+
+        # Undoing the edits of a version that was browsed to checks it out, like any other edit
+        if edit_mode:
+            self.commit_checkout(tab)
+        else:
+            tab.pending_merge = None
+
+        self.set_timeline_edit_mode(tab, edit_mode)
 
     # Slot Function
-    def load_repo_file_object(self, file_hash):
-        self.file_hash = file_hash
-        self.head_node_changed = True
+    def load_repo_file_object(self, tab, file_hash):
+        """
+        Fetch the version the timeline moved to, along with its editor state. Versions browsed recently are served
+        from the tab's cache, and only the latest request is loaded into the editor - the load shares its queue with
+        checkouts and saves of the repo, so stale loads are told apart by the requested hash, not dropped by the pool.
+
+        """
+        tab.requested_file_hash = file_hash
+
+        file_data = tab.file_objects.get(file_hash)
+        if file_data is not None and file_hash in tab.editor_states:
+            self.handle_repo_file_object_loaded(tab, file_hash, (file_data, tab.editor_states.get(file_hash)))
+            return
+
+        self.repository_worker_pool.submit(tab.file_path, repo_file_object_and_editor_state, tab.file_path, file_hash,
+                                           callback=partial(self.handle_repo_file_object_loaded, tab, file_hash))
+
+    # Slot Function
+    def handle_repo_file_object_loaded(self, tab, file_hash, result):
+        """
+        Browse mode - only the editor buffer and the cached index head follow the timeline. The working file and
+        the head on disk are written once the user settles on a version, or starts editing it.
+
+        The undo log, cursor and scroll position of the version left behind are saved, and those of the version
+        moved to are restored.
+
+        """
+        if not self.tab_is_open(tab):
+            return
+
+        file_data, state = result
+        tab.file_objects.put(file_hash, file_data)
+        tab.editor_states.put(file_hash, state)
+        if file_hash != tab.requested_file_hash:
+            return
+
+        self.save_editor_state(tab)
+        tab.file_hash = file_hash
+        tab.pending_merge = None
+        tab.head_node_changed = True
 
         # Editor's set_text emits two signals (True and False) back to back (might be a bug)
         # This somewhat screws up the functionality of modificationChanged signal
         # Thus, I am checking if file was in edit mode before I execute set_text
-        file_was_in_edit_mode = self.file_in_edit_mode()
-        self.editor.set_text(repo_file_object(self.file_path, file_hash))
-        self.editor.store_file(self.file_path)
+        # The pending checkout is set aside too, so that those signals do not check it out
+        file_was_in_edit_mode = self.file_in_edit_mode(tab)
+        tab.pending_checkout = None
+        tab.editor.set_text(file_data, file_hash)
+        if state:
+            tab.editor.restore_editor_state(state)
 
-        update_repo_index_head(self.file_path, file_hash)
+        update_index_dict_head(self.tab_index(tab), file_hash)
+        tab.pending_checkout = (file_hash, file_data)
+        tab.checkout_timer.start()
 
         # This is to clear away the node with the dotted edge - which is displayed when file is in edit mode
         if file_was_in_edit_mode:
-            self.render_timeline()
+            self.set_timeline_edit_mode(tab, False)
+
+    def commit_checkout(self, tab):
+        """
+        Leave browse mode - write the version on display to the working file, and move head to it on disk.
+
+        :param tab: DocumentTab
+        :return: None
+        """
+        tab.checkout_timer.stop()
+        if not tab.pending_checkout:
+            return
+
+        file_hash, file_data = tab.pending_checkout
+        tab.pending_checkout = None
+        tab.working_file_hash = file_hash
+
+        atomic_write(tab.file_path, file_data)
+        self.repository_worker_pool.submit(tab.file_path, update_repo_index_head, tab.file_path, file_hash)
+
+    def discard_checkout(self, tab):
+        tab.checkout_timer.stop()
+        tab.pending_checkout = None
+
+    def save_editor_state(self, tab):
+        """
+        Keep the undo log, cursor and scroll position of the version on display - in the tab's cache and in its repo.
+        Nothing is kept for unsaved content, or for a version that was merely looked at.
+
+        :param tab: DocumentTab
+        :return: None
+        """
+        if not tab.file_path or not tab.file_hash or self.file_in_edit_mode(tab):
+            return
+
+        state = tab.editor.editor_state()
+        cached_state = tab.editor_states.get(tab.file_hash)
+        if state == cached_state or (not cached_state and tab.editor.state_is_blank(state)):
+            return
+
+        tab.editor_states.put(tab.file_hash, state)
+        self.repository_worker_pool.submit(tab.file_path, write_repo_editor_state, tab.file_path, tab.file_hash, state)
+
+    def load_editor_state(self, tab):
+        """
+        Restore the editor state saved along with the version a file was opened at.
+
+        :param tab: DocumentTab
+        :return: None
+        """
+        if not tab.file_path:
+            return
+
+        self.repository_worker_pool.submit(tab.file_path, repo_editor_state, tab.file_path, tab.file_hash,
+                                           callback=partial(self.handle_editor_state_loaded, tab, tab.file_hash))
+
+    # Slot Function
+    def handle_editor_state_loaded(self, tab, file_hash, state):
+        if not self.tab_is_open(tab):
+            return
+
+        tab.editor_states.put(file_hash, state)
+
+        # The user may have moved on, or started typing, in the meantime
+        if not state or tab.file_hash != file_hash or self.file_in_edit_mode(tab):
+            return
+        if tab.editor.operation_log.steps:
+            return
+
+        tab.editor.restore_editor_state(state)
 
     # Helper function
     def update_file_path_and_hash(self, file_path=None):
         self.file_path = file_path
         if self.file_path:
-            self.file_hash = get_hash(self.editor.get_text())
+            self.file_hash = self.editor.text_hash()
         else:
             self.file_hash = None
 
+        # Working file was just loaded into, or stored from, the editor
+        self.tab.working_file_hash = self.file_hash
+
+    # Helper function
+    def update_repo_actions(self):
+        # Enable repo actions only when there is a repo present.
+        has_repo = self.file_path != None
+        self.rename_move_action.setEnabled(has_repo)
+        self.clear_history_action.setEnabled(has_repo)
+        self.verify_history_action.setEnabled(has_repo)
+        self.label_version_action.setEnabled(has_repo)
+        self.merge_version_action.setEnabled(has_repo)
+        self.export_history_action.setEnabled(has_repo)
+        self.import_history_action.setEnabled(has_repo)
+        self.pack_history_action.setEnabled(has_repo)
+
+    # Helper function
+    def merge_candidates(self, index):
+        """
+        :param index: python dict object
+        :return: list of hashes of versions worth merging into head - tips of other branches and labelled versions,
+        newest first
+        """
+        head_file_hash = index[INDEX_HEAD]
+        created = dict(index_dict_meta_column(index, META_CREATED))
+        labels = index[INDEX_META][META_LABELS] if INDEX_META in index else {}
+
+        candidates = [file_hash for file_hash in index_dict_nodes(index)
+                      if file_hash != head_file_hash and (not index[file_hash] or file_hash in labels)]
+        candidates.sort(key=lambda file_hash: created.get(file_hash, 0), reverse=True)
+        return candidates
+
+    # Helper function
+    def describe_version(self, index, file_hash):
+        """
+        :param index: python dict object
+        :param file_hash: hash of version
+        :return: one line description of a version - its label, short hash and save time
+        """
+        file_meta = index_dict_file_meta(index, file_hash)
+        if not file_meta:
+            return file_hash[:8]
+
+        description = '{} ({})'.format(file_hash[:8],
+                                       time.strftime('%Y-%m-%d %H:%M', time.localtime(file_meta[META_CREATED])))
+        if file_meta[META_LABEL]:
+            description = '{} - {}'.format(file_meta[META_LABEL], description)
+        return description
+
     # Helper function
-    def index_head_differs_from_live_text(self, file_path):
-        return repo_index_head(file_path) != get_hash(self.editor.get_text())
+    def index_head_differs_from_live_text(self, tab=None):
+        tab = tab or self.tab
+        return tab.editor.text_differs_from(self.tab_index(tab)[INDEX_HEAD])
 
     # Helper function
-    def file_content_did_not_change(self):
-        return self.file_path and not self.index_head_differs_from_live_text(self.file_path)
+    def file_content_did_not_change(self, tab=None):
+        tab = tab or self.tab
+        return tab.file_path and not self.index_head_differs_from_live_text(tab)
 
     # Helper function
-    def file_is_virgin(self):
-        return not self.file_path and not self.editor.get_text()
+    def file_is_virgin(self, tab=None):
+        tab = tab or self.tab
+        return not tab.file_path and not tab.editor.get_text()
 
     # Helper function
-    def file_in_edit_mode(self):
-        return self.editor.document().isModified()
+    def file_in_edit_mode(self, tab=None):
+        tab = tab or self.tab
+        return tab.editor.document().isModified()
 
     # Helper function
     @staticmethod
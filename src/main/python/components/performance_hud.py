@@ -0,0 +1,71 @@
+import html
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import Qt, QTimer
+
+from utils.profiler import span_statistics, STAT_COUNT, STAT_TOTAL, STAT_LAST, STAT_MAX
+
+
+class PerformanceHud(QLabel):
+    """
+    Overlay in the top right corner of a window that shows where time goes - the spans recorded by the profiler
+    that took the most time in total, with their latest, mean and worst durations.
+
+    """
+
+    # Constants
+    REFRESH_INTERVAL = 500
+    MAX_ROWS = 12
+    MARGIN = 8
+    TEXT_COLOR = '#cdd7d3'
+    BACKGROUND_COLOR = 'rgba(51, 51, 61, 220)'
+
+    def __init__(self, parent):
+        super().__init__(parent)
+
+        # Widget-related properties
+        self.refresh_timer = QTimer(self)
+
+        # Instantiate relevant components
+        self.configure_label()
+        self.configure_refresh_timer()
+
+    def configure_label(self):
+        self.setTextFormat(Qt.RichText)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet('color: {}; background-color: {}; font-family: monospace; font-size: 11px; '
+                           'padding: 6px;'.format(self.TEXT_COLOR, self.BACKGROUND_COLOR))
+        self.hide()
+
+    def configure_refresh_timer(self):
+        self.refresh_timer.setInterval(self.REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def set_shown(self, shown):
+        """
+        :param shown: Boolean representing if the overlay is on screen - it only refreshes while it is
+        :return: None
+        """
+        if shown:
+            self.refresh()
+            self.show()
+            self.raise_()
+            self.refresh_timer.start()
+        else:
+            self.refresh_timer.stop()
+            self.hide()
+
+    # Slot Function
+    def refresh(self):
+        rows = ['<tr><th align="left">span</th><th>n</th><th>last</th><th>mean</th><th>max</th></tr>']
+        for name, stats in span_statistics()[:self.MAX_ROWS]:
+            rows.append('<tr><td>{}</td><td align="right">{}</td><td align="right">{:.1f}</td>'
+                        '<td align="right">{:.1f}</td><td align="right">{:.1f}</td></tr>'
+                        .format(html.escape(name), stats[STAT_COUNT], stats[STAT_LAST],
+                                stats[STAT_TOTAL] / stats[STAT_COUNT], stats[STAT_MAX]))
+
+        if len(rows) == 1:
+            rows.append('<tr><td colspan="5">Nothing recorded yet</td></tr>')
+
+        self.setText('<table cellspacing="4">{}</table>ms'.format(''.join(rows)))
+        self.adjustSize()
+        self.move(self.parent().width() - self.width() - self.MARGIN, self.parent().menuBar().height() + self.MARGIN)
@@ -0,0 +1,397 @@
+import os
+import time
+from functools import partial
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtGui import QFont
+
+from utils.project_history import SUMMARY_COLUMNS, SUMMARY_FILE_PATHS, SUMMARY_VERSIONS, SUMMARY_LAST_CHANGE, \
+    SUMMARY_SIZE, SUMMARY_FINGERPRINT, build_project_summary, read_project_summary, \
+    write_project_summary, tracked_files_under_directory, summarize_repos, repo_versions
+
+
+class ProjectHistoryModel(QAbstractTableModel):
+    """
+    Table of the tracked files under a directory - a row per file, with its number of versions, last change and
+    history size.
+
+    Rows are kept in columns, the way the summary is cached. Rows that match the filter are handed to the view a page
+    at a time as it scrolls, so tens of thousands of them cost no more to show than one page.
+
+    """
+
+    # Constants
+    FETCH_SIZE = 500
+    HEADERS = ('File', 'Versions', 'Last Change', 'History Size')
+    TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+    def __init__(self):
+        super().__init__()
+
+        self.directory = None
+        self.summary = build_project_summary()
+        self.rows = {}
+
+        # Rows that match the filter, and how many of them the view was handed so far
+        self.filter_text = ''
+        self.visible_rows = []
+        self.num_fetched = 0
+
+    def reset(self, directory, summary):
+        """
+        :param directory: location of directory
+        :param summary: python dict object with a list per column
+        :return: None
+        """
+        self.beginResetModel()
+        self.directory = directory
+        self.summary = summary
+        self.rows = {file_path: row for row, file_path in enumerate(summary[SUMMARY_FILE_PATHS])}
+        self.filter_rows()
+        self.endResetModel()
+
+    def set_filter(self, text):
+        self.beginResetModel()
+        self.filter_text = text.lower()
+        self.filter_rows()
+        self.endResetModel()
+
+    # Helper function
+    def filter_rows(self):
+        file_paths = self.summary[SUMMARY_FILE_PATHS]
+        self.visible_rows = [row for row in range(len(file_paths)) if self.matches_filter(file_paths[row])]
+        self.num_fetched = min(self.FETCH_SIZE, len(self.visible_rows))
+
+    # Helper function
+    def matches_filter(self, file_path):
+        return self.filter_text in file_path.lower()
+
+    def update_rows(self, rows):
+        """
+        Add or refresh the rows of files that were summarized.
+
+        :param rows: list of summary rows, a tuple of values in the order of SUMMARY_COLUMNS each
+        :return: None
+        """
+        position = {visible_row: i for i, visible_row in enumerate(self.visible_rows[:self.num_fetched])}
+
+        for values in rows:
+            file_path = values[0]
+            row = self.rows.get(file_path)
+            if row is None:
+                row = self.rows[file_path] = len(self.summary[SUMMARY_FILE_PATHS])
+                for column, value in zip(SUMMARY_COLUMNS, values):
+                    self.summary[column].append(value)
+                if self.matches_filter(file_path):
+                    self.visible_rows.append(row)
+                continue
+
+            for column, value in zip(SUMMARY_COLUMNS, values):
+                self.summary[column][row] = value
+            if row in position:
+                self.dataChanged.emit(self.index(position[row], 0), self.index(position[row], len(self.HEADERS) - 1))
+
+        # Top up a page that is not full yet - further rows come in as the view scrolls
+        if self.num_fetched < self.FETCH_SIZE and self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def retain_rows(self, file_paths):
+        """
+        Drop the rows of files that are no longer tracked.
+
+        :param file_paths: set of full file locations of tracked files
+        :return: None
+        """
+        if all(file_path in file_paths for file_path in self.summary[SUMMARY_FILE_PATHS]):
+            return
+
+        summary = build_project_summary()
+        for row, file_path in enumerate(self.summary[SUMMARY_FILE_PATHS]):
+            if file_path in file_paths:
+                for column in SUMMARY_COLUMNS:
+                    summary[column].append(self.summary[column][row])
+
+        self.reset(self.directory, summary)
+
+    def fingerprints(self):
+        """
+        :return: python dict object of full file location to fingerprint of its summary
+        """
+        return dict(zip(self.summary[SUMMARY_FILE_PATHS], self.summary[SUMMARY_FINGERPRINT]))
+
+    def file_path(self, index):
+        return self.summary[SUMMARY_FILE_PATHS][self.visible_rows[index.row()]]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.num_fetched
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.num_fetched < len(self.visible_rows)
+
+    def fetchMore(self, parent):
+        num_fetched = min(self.num_fetched + self.FETCH_SIZE, len(self.visible_rows))
+        self.beginInsertRows(QModelIndex(), self.num_fetched, num_fetched - 1)
+        self.num_fetched = num_fetched
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = self.visible_rows[index.row()]
+        column = index.column()
+
+        if role == Qt.TextAlignmentRole and column:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+
+        if role == Qt.ToolTipRole and not column:
+            return self.summary[SUMMARY_FILE_PATHS][row]
+
+        if role != Qt.DisplayRole:
+            return None
+
+        if column == 0:
+            return os.path.relpath(self.summary[SUMMARY_FILE_PATHS][row], self.directory)
+        if column == 1:
+            return str(self.summary[SUMMARY_VERSIONS][row])
+        if column == 2:
+            last_change = self.summary[SUMMARY_LAST_CHANGE][row]
+            return time.strftime(self.TIME_FORMAT, time.localtime(last_change)) if last_change else ''
+        return format_size(self.summary[SUMMARY_SIZE][row])
+
+
+class ProjectHistoryDialog(QDialog):
+    """
+    Browser of the histories of every tracked file under a directory. Picking a file lists its versions, and any of
+    them can be opened in a tab. A file is requested with an empty hash to open it as it is on disk.
+
+    The cached summary of the directory is shown first. The directory is then walked and its repos summarized in
+    batches in the repo worker pool - only a few batches are queued at a time, so the pool stays free for open
+    documents, and a walk is dropped as soon as another directory is picked.
+
+    """
+
+    # Signals
+    request_to_open_version = pyqtSignal(str, str)
+
+    # Constants
+    BATCH_SIZE = 200
+    MAX_PENDING_BATCHES = 2
+    SUMMARY_QUEUE = '{}:summary'
+    BATCH_QUEUE = '{}:summary:{}'
+    VERSION_QUEUE = '{}:versions'
+
+    def __init__(self, repository_worker_pool, parent=None):
+        super().__init__(parent)
+
+        # Repo-related properties
+        self.repository_worker_pool = repository_worker_pool
+
+        # Indexing related properties - every walk gets a new generation, and results of older ones are dropped
+        self.generation = 0
+        self.file_paths = []
+        self.next_batch = 0
+        self.num_pending_batches = 0
+        self.num_summarized = 0
+
+        # Widget-related properties
+        self.model = ProjectHistoryModel()
+        self.filter_line_edit = QLineEdit()
+        self.files_view = QTableView()
+        self.versions_list = QListWidget()
+        self.open_button = QPushButton('Open')
+        self.status_label = QLabel()
+
+        # Instantiate relevant components
+        self.configure_dialog()
+        self.configure_files_view()
+        self.configure_layout()
+
+    def configure_dialog(self):
+        self.setWindowTitle('Project History')
+        self.setMinimumSize(900, 500)
+        self.setFont(QFont('Calibri', 12))
+
+        self.filter_line_edit.setPlaceholderText('Filter files')
+        self.filter_line_edit.textChanged.connect(self.model.set_filter)
+
+        self.versions_list.itemDoubleClicked.connect(self.handle_open_action)
+        self.open_button.clicked.connect(self.handle_open_action)
+        self.open_button.setEnabled(False)
+
+    def configure_files_view(self):
+        self.files_view.setModel(self.model)
+        self.files_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.files_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.files_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.files_view.verticalHeader().setVisible(False)
+        self.files_view.verticalHeader().setDefaultSectionSize(22)
+        self.files_view.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.files_view.selectionModel().currentRowChanged.connect(self.handle_file_selected)
+        self.files_view.doubleClicked.connect(self.handle_file_double_clicked)
+
+    def configure_layout(self):
+        splitter = QSplitter(Qt.Horizontal)
+        splitter.addWidget(self.files_view)
+        splitter.addWidget(self.versions_list)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 1)
+
+        bottom_layout = QHBoxLayout()
+        bottom_layout.addWidget(self.status_label, 1)
+        bottom_layout.addWidget(self.open_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.filter_line_edit)
+        layout.addWidget(splitter, 1)
+        layout.addLayout(bottom_layout)
+        self.setLayout(layout)
+
+    def browse(self, directory):
+        """
+        Show the histories under a directory - the cached summary right away, then a fresh one as it is indexed.
+
+        :param directory: location of directory
+        :return: None
+        """
+        self.generation += 1
+        self.file_paths = []
+        self.next_batch = 0
+        self.num_pending_batches = 0
+        self.num_summarized = 0
+
+        self.model.reset(directory, build_project_summary())
+        self.versions_list.clear()
+        self.open_button.setEnabled(False)
+        self.status_label.setText('Indexing {}...'.format(directory))
+        self.setWindowTitle('Project History - {}'.format(directory))
+
+        self.repository_worker_pool.submit(self.SUMMARY_QUEUE.format(directory), read_project_summary, directory,
+                                           callback=partial(self.handle_summary_read, self.generation))
+        self.repository_worker_pool.submit(self.SUMMARY_QUEUE.format(directory), tracked_files_under_directory,
+                                           directory, callback=partial(self.handle_directory_walked, self.generation))
+
+    # Slot Function
+    def handle_summary_read(self, generation, summary):
+        if generation != self.generation:
+            return
+
+        self.model.reset(self.model.directory, summary)
+
+    # Slot Function
+    def handle_directory_walked(self, generation, file_paths):
+        if generation != self.generation:
+            return
+
+        self.file_paths = file_paths
+        self.model.retain_rows(set(file_paths))
+        self.submit_batches()
+
+    def submit_batches(self):
+        """
+        Queue the next batches of files to summarize - or, once every file is summarized, cache the summary.
+
+        :return: None
+        """
+        fingerprints = self.model.fingerprints()
+        directory = self.model.directory
+
+        while self.num_pending_batches < self.MAX_PENDING_BATCHES and self.next_batch < len(self.file_paths):
+            batch = self.file_paths[self.next_batch:self.next_batch + self.BATCH_SIZE]
+            queue = self.BATCH_QUEUE.format(directory, self.next_batch // self.BATCH_SIZE % self.MAX_PENDING_BATCHES)
+            self.repository_worker_pool.submit(queue, summarize_repos, batch,
+                                               {file_path: fingerprints.get(file_path) for file_path in batch},
+                                               callback=partial(self.handle_batch_summarized, self.generation,
+                                                                len(batch)))
+            self.next_batch += len(batch)
+            self.num_pending_batches += 1
+
+        if self.num_pending_batches:
+            self.status_label.setText('Indexed {} of {} files'.format(self.num_summarized, len(self.file_paths)))
+            return
+
+        self.status_label.setText('{} tracked files'.format(len(self.file_paths)))
+        summary = {column: list(values) for column, values in self.model.summary.items()}
+        self.repository_worker_pool.submit(self.SUMMARY_QUEUE.format(directory), write_project_summary, directory,
+                                           summary)
+
+    # Slot Function
+    def handle_batch_summarized(self, generation, batch_size, rows):
+        if generation != self.generation:
+            return
+
+        self.num_pending_batches -= 1
+        self.num_summarized += batch_size
+        self.model.update_rows(rows)
+        self.submit_batches()
+
+    # Slot Function
+    def handle_file_selected(self, current, previous):
+        self.versions_list.clear()
+        self.open_button.setEnabled(current.isValid())
+        if not current.isValid():
+            return
+
+        file_path = self.model.file_path(current)
+        self.repository_worker_pool.submit(self.VERSION_QUEUE.format(file_path), repo_versions, file_path,
+                                           callback=partial(self.handle_versions_loaded, file_path),
+                                           latest_only=True)
+
+    # Slot Function
+    def handle_versions_loaded(self, file_path, result):
+        current = self.files_view.currentIndex()
+        if not current.isValid() or self.model.file_path(current) != file_path:
+            return
+
+        head_file_hash, versions = result
+        for file_hash, created, label in versions:
+            description = file_hash[:8]
+            if created:
+                description = '{} ({})'.format(description,
+                                               time.strftime(self.model.TIME_FORMAT, time.localtime(created)))
+            if label:
+                description = '{} - {}'.format(label, description)
+            if file_hash == head_file_hash:
+                description = '{} [head]'.format(description)
+
+            item = QListWidgetItem(description)
+            item.setData(Qt.UserRole, file_hash)
+            self.versions_list.addItem(item)
+
+    # Slot Function
+    def handle_file_double_clicked(self, index):
+        self.request_to_open_version.emit(self.model.file_path(index), '')
+
+    # Slot Function
+    def handle_open_action(self):
+        """
+        Open the version picked in the list of versions - or the file as it is on disk, if none is picked.
+
+        """
+        current = self.files_view.currentIndex()
+        if not current.isValid():
+            return
+
+        item = self.versions_list.currentItem()
+        file_hash = item.data(Qt.UserRole) if item else ''
+        self.request_to_open_version.emit(self.model.file_path(current), file_hash)
+
+
+def format_size(size):
+    """
+    :param size: size in bytes
+    :return: size in a human readable format, e.g. '12.5 KB'
+    """
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} GB'.format(size)
@@ -0,0 +1,132 @@
+import time
+from bisect import bisect_right
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+
+from utils.repository_control import INDEX_HEAD, META_CREATED, index_dict_meta_column
+
+
+class TimeSlider(QWidget):
+    """
+    Slider that sits under the timeline and seeks to the version that was current at a given moment.
+
+    Versions are kept sorted by creation time, so a seek is a binary search. Dragging only updates the label -
+    the version is requested once the slider settles.
+
+    """
+
+    # Signals
+    request_to_change_node = pyqtSignal(str)
+
+    # Constants
+    SETTLE_DELAY = 300
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    LABEL_COLOR = '#33333d'
+    BACKGROUND_COLOR = '#fff0f0'
+
+    def __init__(self):
+        super().__init__()
+
+        # Sorted timestamp index - creation times in ascending order, and the versions created at those times
+        self.timestamps = []
+        self.file_hashes = []
+        self.created_times = {}
+        self.start_time = 0
+
+        # Widget-related properties
+        self.slider = QSlider(Qt.Horizontal)
+        self.time_label = QLabel()
+        self.settle_timer = QTimer()
+
+        # Instantiate relevant components
+        self.configure_slider()
+        self.configure_layout()
+
+    def configure_slider(self):
+        self.slider.setEnabled(False)
+        self.slider.valueChanged.connect(self.handle_slider_moved)
+
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(self.SETTLE_DELAY)
+        self.settle_timer.timeout.connect(self.handle_slider_settled)
+
+    def configure_layout(self):
+        self.time_label.setAlignment(Qt.AlignCenter)
+        self.time_label.setStyleSheet('color: {}; font-size: 11px;'.format(self.LABEL_COLOR))
+        self.setStyleSheet('background-color: {};'.format(self.BACKGROUND_COLOR))
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(4, 2, 4, 2)
+        layout.setSpacing(0)
+        layout.addWidget(self.slider)
+        layout.addWidget(self.time_label)
+        self.setLayout(layout)
+
+    def set_index(self, index):
+        """
+        Rebuild the sorted timestamp index from the metadata table of a repo index.
+
+        :param index: python dict object, None if the document has no repo
+        :return: None
+        """
+        self.settle_timer.stop()
+
+        rows = [row for row in index_dict_meta_column(index, META_CREATED) if row[0] in index] if index else []
+
+        # Sort is stable - versions created within the same second keep the order they were recorded in
+        rows.sort(key=lambda row: row[1])
+        self.file_hashes = [file_hash for file_hash, _ in rows]
+        self.timestamps = [created for _, created in rows]
+        self.created_times = dict(rows)
+        self.start_time = self.timestamps[0] if self.timestamps else 0
+
+        self.slider.blockSignals(True)
+        self.slider.setRange(0, self.timestamps[-1] - self.start_time if self.timestamps else 0)
+        self.slider.blockSignals(False)
+        self.slider.setEnabled(len(self.timestamps) > 1)
+
+        self.set_head(index[INDEX_HEAD] if index else None)
+
+    def find_version(self, timestamp):
+        """
+        :param timestamp: time in seconds since the epoch
+        :return: hash of the latest version created at or before timestamp, the oldest version if there is none
+        """
+        if not self.timestamps:
+            return None
+
+        i = bisect_right(self.timestamps, timestamp) - 1
+        return self.file_hashes[max(i, 0)]
+
+    # Slot Function
+    def set_head(self, file_hash):
+        """
+        Move the slider to the creation time of a version, without seeking.
+
+        :param file_hash: hash of version in session
+        :return: None
+        """
+        self.settle_timer.stop()
+        if file_hash not in self.created_times:
+            self.time_label.setText('')
+            return
+
+        self.slider.blockSignals(True)
+        self.slider.setValue(self.created_times[file_hash] - self.start_time)
+        self.slider.blockSignals(False)
+        self.update_time_label()
+
+    def update_time_label(self):
+        timestamp = self.start_time + self.slider.value()
+        self.time_label.setText(time.strftime(self.TIME_FORMAT, time.localtime(timestamp)))
+
+    # Slot Function
+    def handle_slider_moved(self, value):
+        self.update_time_label()
+        self.settle_timer.start()
+
+    # Slot Function
+    def handle_slider_settled(self):
+        file_hash = self.find_version(self.start_time + self.slider.value())
+        if file_hash:
+            self.request_to_change_node.emit(file_hash)
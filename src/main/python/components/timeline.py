@@ -1,13 +1,20 @@
+from array import array
+from bisect import bisect_left, bisect_right
 from PyQt5.QtWidgets import *
+from PyQt5.QtGui import QCursor
 from PyQt5 import QtCore
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backend_bases import MouseButton
-from grave import plot_network
-from grave.style import use_attributes
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.markers import MarkerStyle
 import matplotlib.pyplot as plt
-import networkx as nx
+import numpy as np
 from IPython import embed
 
+from utils.timeline_graph import TimelineGraph
+from utils.profiler import profiled, CATEGORY_TIMELINE
+
 
 class Timeline(QMainWindow):
     """
@@ -19,6 +26,8 @@ class Timeline(QMainWindow):
     request_to_change_node = QtCore.pyqtSignal(str)
     head_node_changed = QtCore.pyqtSignal(str)
     num_nodes_changed = QtCore.pyqtSignal(int)
+    request_node_preview = QtCore.pyqtSignal(str)
+    became_visible = QtCore.pyqtSignal()
 
     # Constants
     ROOT_NODE_COLOR = '#006400'
@@ -26,12 +35,38 @@ class Timeline(QMainWindow):
     UNSAVED_NODE_COLOR = '#FF7F7F'
     DEFAULT_NODE_SIZE = 200
     DEFAULT_NODE_COLOR = '#25B0B0'
+    NODE_BORDER_COLOR = 'white'
+    EDGE_COLOR = '#292929'
+    EDGE_WIDTH = 1.5
     FIGURE_BACKGROUND_COLOR = '#fff0f0'
-    UNSAVED_NODE = 'unsaved_node'
 
-    INDEX_HEAD = 'head'
-    INDEX_ROOT = 'root'
-    INDEX_ADOPTS = 'adopts'
+    # Level of detail - past LOD_THRESHOLD versions, linear runs of at least min_run_length versions are collapsed
+    # into a single segment node, except for the versions within LOD_HEAD_RADIUS steps of head
+    LOD_THRESHOLD = 200
+    LOD_MIN_RUN_LENGTH = 8
+    LOD_MAX_RUN_LENGTH = 4096
+    LOD_HEAD_RADIUS = 5
+    SEGMENT_NODE_COLOR = '#a0a0a0'
+    SEGMENT_LABEL_COLOR = '#33333d'
+
+    # Kinds of nodes and edges - each one picks a colour or a line style out of the lists below
+    KIND_DEFAULT, KIND_ROOT, KIND_HEAD, KIND_UNSAVED, KIND_SEGMENT = range(5)
+    NODE_COLORS = to_rgba_array([DEFAULT_NODE_COLOR, ROOT_NODE_COLOR, HEAD_NODE_COLOR, UNSAVED_NODE_COLOR,
+                                 SEGMENT_NODE_COLOR])
+    EDGE_NATURAL, EDGE_ADOPTED, EDGE_UNSAVED = range(3)
+    EDGE_STYLES = ['solid', 'dashed', 'dotted']
+
+    # Viewport - the rows and columns on display. Larger graphs scroll
+    VIEWPORT_ROWS = 13
+    VIEWPORT_COLUMNS = 6
+    VIEWPORT_MARGIN = 2
+    SCROLL_STEP = 1
+
+    # Hover - how close to the centre of a node the cursor has to be, in grid units
+    HOVER_RADIUS = 0.3
+
+    # Position of a node that is not drawn
+    NOT_DRAWN = -1
 
     def __init__(self):
         super(Timeline, self).__init__()
@@ -40,189 +75,769 @@ class Timeline(QMainWindow):
         self.figure = None
         self.canvas = None
         self.plot = None
+        self.unsaved_plot = None
+        self.unsaved_edge = None
+        self.horizontal_scroll_bar = None
+        self.vertical_scroll_bar = None
 
-        self.index = None
+        self.full_index = None
         self.edit_mode = None
 
+        # Level of detail related properties - segments are numbered after the versions of full_index, and the
+        # segments that were expanded are remembered by the hash of their first version
+        self.segments = None
+        self.expanded_segments = set()
+        self.min_run_length = self.LOD_MIN_RUN_LENGTH
+
+        # Viewport related properties - the left-most column and bottom-most row on display
+        self.viewport_x = 0
+        self.viewport_y = 0
+
+        # Node under the cursor
+        self.hovered_node = None
+
+        # Drawn graph as columns - a row per node and per edge, in the order of index
+        self.node_ids = None
+        self.node_rows = None
+        self.node_xy = None
+        self.node_kinds = None
+        self.edge_rows = None
+        self.edge_kinds = None
+        self.plot_rows = None
+
         # Graph plot related properties
         self.graph = None
-        self.graph_matrix = None
+        self.graph_columns = None
+        self.graph_rows = None
         self.pos_x = None
         self.pos_y = None
+        self.num_graph_columns = None
+        self.num_graph_rows = None
         self.root = None
         self.head = None
         self.adopts = None
         self.num_nodes = None
 
+        # Unsaved node - drawn over the graph rather than in it, at a free cell on the row above head
+        self.unsaved_cell = None
+
         # Instantiate relevant components
         self.configure_figure_and_canvas()
         self.configure_layout_and_show()
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.became_visible.emit()
+
+    def resizeEvent(self, event):
+        """
+        A timeline squeezed to nothing is not drawn - let it be drawn once it has room again.
+
+        """
+        super().resizeEvent(event)
+        if event.oldSize().isEmpty() and not event.size().isEmpty():
+            self.became_visible.emit()
+
+    def is_on_screen(self):
+        """
+        :return: Boolean representing if any part of the timeline can be seen - it is not in a hidden tab, squeezed to
+        nothing or in a minimized window
+        """
+        return self.isVisible() and not self.size().isEmpty() and not self.window().isMinimized()
+
     def configure_figure_and_canvas(self):
         self.figure = plt.figure()
         self.figure.set_facecolor(self.FIGURE_BACKGROUND_COLOR)
         self.canvas = FigureCanvas(self.figure)
+
+        # Painting happens later, once draw_idle gets to it - it is timed as a span of its own
+        self.canvas.draw = profiled(CATEGORY_TIMELINE, 'Timeline.draw')(self.canvas.draw)
         self.canvas.mpl_connect('pick_event', self.pick_event)
+        self.canvas.mpl_connect('scroll_event', self.scroll_event)
+        self.canvas.mpl_connect('motion_notify_event', self.motion_notify_event)
+        self.canvas.mpl_connect('figure_leave_event', self.figure_leave_event)
 
     def configure_layout_and_show(self):
-        self.setCentralWidget(self.canvas)
+        self.horizontal_scroll_bar = QScrollBar(QtCore.Qt.Horizontal)
+        self.horizontal_scroll_bar.valueChanged.connect(self.handle_horizontal_scroll)
+        self.horizontal_scroll_bar.setVisible(False)
+
+        # Root sits at the bottom, so the vertical scroll bar starts at the bottom too
+        self.vertical_scroll_bar = QScrollBar(QtCore.Qt.Vertical)
+        self.vertical_scroll_bar.setInvertedAppearance(True)
+        self.vertical_scroll_bar.valueChanged.connect(self.handle_vertical_scroll)
+        self.vertical_scroll_bar.setVisible(False)
+
+        self.configure_scroll_bar_aesthetics()
+
+        layout = QGridLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        layout.addWidget(self.canvas, 0, 0)
+        layout.addWidget(self.vertical_scroll_bar, 0, 1)
+        layout.addWidget(self.horizontal_scroll_bar, 1, 0)
+
+        central_widget = QWidget()
+        central_widget.setLayout(layout)
+        self.setCentralWidget(central_widget)
         self.show()
 
+    def configure_scroll_bar_aesthetics(self):
+        for scroll_bar in (self.horizontal_scroll_bar, self.vertical_scroll_bar):
+            scroll_bar.setStyleSheet(
+                """QScrollBar {{
+                        width: 8px;
+                        height: 8px;
+                        margin: 0;
+                        background: {};
+                      }}
+
+                      QScrollBar::handle {{
+                        background: #33333d;
+                        min-height: 10px;
+                        min-width: 10px;
+                      }}
+
+                      QScrollBar::add-line, QScrollBar::sub-line {{
+                        width: 0px;
+                        height: 0px;
+                      }}
+                """.format(self.FIGURE_BACKGROUND_COLOR))
+
+    def close_figure(self):
+        plt.close(self.figure)
+
     def reset_graph_properties(self):
         self.graph = None
-        self.graph_matrix = None
+        self.graph_columns = None
+        self.graph_rows = None
         self.pos_x = None
         self.pos_y = None
-        self.root = None
-        self.head = None
-        self.adopts = None
+        self.num_graph_columns = None
+        self.num_graph_rows = None
+        self.node_ids = None
+        self.node_rows = None
+        self.node_xy = None
+        self.node_kinds = None
+        self.edge_rows = None
+        self.edge_kinds = None
+        self.plot_rows = None
+        self.segments = None
         self.num_nodes = None
+        self.hide_preview()
 
     def render_graph(self, index, edit_mode):
-        self.index = index
+        """
+        Nodes of the graph are the ids of versions in index, and hashes only cross the boundary of the timeline in
+        its signals and in switch_node_colors.
+
+        :param index: CompactIndex object, None if the document has no repo
+        :param edit_mode: Boolean representing if the document has unsaved content
+        :return: None
+        """
+        self.full_index = index
         self.edit_mode = edit_mode
+        self.root = None
+        self.head = None
+        self.adopts = None
+
+        if self.full_index:
+            self.extract_critical_nodes()
+
         self.build_graph()
 
+    @profiled(CATEGORY_TIMELINE)
     def build_graph(self):
+        """
+        Lay out and draw the versions in full_index. Also used to redraw the same versions at another level of detail.
+
+        """
         self.reset_graph_properties()
-        self.figure.clf()
-        self.graph = nx.DiGraph()
 
-        if self.index:
-            self.extract_critical_nodes()
-            self.add_nodes_and_edges()
+        if self.full_index:
+            self.collapse_linear_runs()
             self.assign_node_positions()
+            self.build_spatial_index()
+            self.build_node_and_edge_arrays()
+            self.num_nodes = len(self.full_index)
         else:
-            self.add_temp_node()
+            # A document without a repo is drawn as a lone unsaved node
+            self.num_nodes = 1
+
+        self.place_unsaved_node()
+        self.configure_scroll_bars()
+        self.scroll_to_node(self.head)
 
-        self.num_nodes = len(self.graph.nodes())
-        self.num_nodes_changed.emit(self.num_nodes if not self.edit_mode else self.num_nodes - 1)
+        self.num_nodes_changed.emit(self.num_nodes)
         self.configure_node_and_edge_aesthetics()
         self.plot_graph()
 
+    def set_edit_mode(self, edit_mode):
+        """
+        Show or hide the unsaved node. The graph itself does not change - only the overlay, and the colour of root
+        when it is head.
+
+        :param edit_mode: Boolean representing if the document has unsaved content
+        :return: None
+        """
+        if edit_mode == self.edit_mode:
+            return
+
+        self.edit_mode = edit_mode
+        if not self.graph:
+            return
+
+        self.node_kinds[self.node_rows[self.head]] = self.head_kind()
+        self.place_unsaved_node()
+        self.configure_scroll_bars()
+
+        # Keep the unsaved node in view
+        if self.unsaved_cell and self.scroll_to_cell(*self.unsaved_cell):
+            self.plot_graph()
+            return
+
+        self.plot.set_facecolors(self.NODE_COLORS[self.node_kinds[self.plot_rows]])
+        self.update_unsaved_overlay()
+        self.canvas.draw_idle()
+
+    def place_unsaved_node(self):
+        """
+        Find a cell for the unsaved node - a child of head, so on the row above it. It takes the first free column at
+        or to the right of head's, or else the nearest free one to the left of it.
+
+        :return: None
+        """
+        if not self.edit_mode or not self.graph:
+            self.unsaved_cell = None
+            return
+
+        x = self.pos_x[self.head]
+        y = self.pos_y[self.head] + 1
+        positions = self.graph_rows.get(y, ((), ()))[0]
+
+        right = x
+        i = bisect_left(positions, right)
+        while i < len(positions) and positions[i] == right:
+            right += 1
+            i += 1
+
+        left = x - 1
+        i = bisect_left(positions, x) - 1
+        while i >= 0 and positions[i] == left:
+            left -= 1
+            i -= 1
+
+        x = left if right >= self.num_graph_columns and left >= 0 else right
+        self.unsaved_cell = (x, y)
+
+    def update_unsaved_overlay(self):
+        """
+        Move the unsaved node and its dotted edge to head, or hide them when there is nothing unsaved.
+
+        :return: None
+        """
+        shown = self.unsaved_cell is not None
+        self.unsaved_plot.set_visible(shown)
+        self.unsaved_edge.set_visible(shown)
+        if not shown:
+            return
+
+        x, y = self.unsaved_cell
+        x += self.get_x_bias()
+        y += self.get_y_bias()
+        head_x, head_y = self.node_xy[self.node_rows[self.head]]
+        self.unsaved_plot.set_offsets([[x, y]])
+        self.unsaved_edge.set_data([head_x, x], [head_y, y])
+
+    @profiled(CATEGORY_TIMELINE)
     def plot_graph(self):
-        layout = self.sequential_layout if self.index else 'spring'
-        self.plot = plot_network(self.graph,
-                                 layout=layout,
-                                 node_style=use_attributes(),
-                                 edge_style=use_attributes())
-        self.plot.set_picker(1)
-        self.plot.axes.set_position([0.02, 0, 0.96, 1])
-
-        # Set optimum x and y scale for sequential layout
-        if layout == self.sequential_layout:
-            max_y = len(set(self.pos_y.values()))
-            if max_y < 12:
-                self.plot.axes.set_ylim(-0.5, 12.5)
-
-            max_x = len(set(self.pos_x.values()))
-            if max_x < 6:
-                self.plot.axes.set_xlim(-0.5, 5.5)
+        """
+        Draw the part of the graph that falls within the viewport, plus a margin.
+
+        Nodes are drawn by a single scatter and edges by a single line collection, sliced out of the node and edge
+        arrays - paint time and memory stay flat however large the history is.
+
+        :return: None
+        """
+        self.figure.clf()
+        axes = self.figure.add_subplot(111)
+        axes.set_axis_off()
+        axes.set_position([0.02, 0, 0.96, 1])
+
+        if not self.graph:
+            self.plot = axes.scatter([0], [0], s=self.DEFAULT_NODE_SIZE, c=self.NODE_COLORS[[self.KIND_DEFAULT]],
+                                     edgecolors=self.NODE_BORDER_COLOR, zorder=2)
+            axes.set_xlim(-1, 1)
+            axes.set_ylim(-1, 1)
+            self.canvas.draw_idle()
+            return
+
+        visible = np.zeros(len(self.node_ids), dtype=bool)
+        visible[self.node_rows[list(self.find_nodes_in_viewport())]] = True
+        self.plot_rows = np.flatnonzero(visible)
+
+        edges = visible[self.edge_rows[:, 0]] & visible[self.edge_rows[:, 1]]
+        axes.add_collection(LineCollection(self.node_xy[self.edge_rows[edges]],
+                                           colors=self.EDGE_COLOR,
+                                           linewidths=self.EDGE_WIDTH,
+                                           linestyles=[self.EDGE_STYLES[kind] for kind in self.edge_kinds[edges]],
+                                           zorder=1))
+
+        self.plot = axes.scatter(self.node_xy[self.plot_rows, 0], self.node_xy[self.plot_rows, 1],
+                                 s=self.DEFAULT_NODE_SIZE,
+                                 c=self.NODE_COLORS[self.node_kinds[self.plot_rows]],
+                                 edgecolors=self.NODE_BORDER_COLOR,
+                                 picker=True,
+                                 zorder=2)
+        self.shape_segments()
+        self.label_segments()
+
+        # Unsaved node and its dotted edge are an overlay, shown and hidden without redrawing the graph
+        self.unsaved_edge, = axes.plot([], [],
+                                       color=self.EDGE_COLOR,
+                                       linewidth=self.EDGE_WIDTH,
+                                       linestyle=self.EDGE_STYLES[self.EDGE_UNSAVED],
+                                       zorder=1)
+        self.unsaved_plot = axes.scatter([0], [0],
+                                         s=self.DEFAULT_NODE_SIZE,
+                                         c=self.NODE_COLORS[[self.KIND_UNSAVED]],
+                                         edgecolors=self.NODE_BORDER_COLOR,
+                                         zorder=2)
+        self.update_unsaved_overlay()
+
+        axes.set_xlim(self.viewport_x - 0.5, self.viewport_x + self.VIEWPORT_COLUMNS - 0.5)
+        axes.set_ylim(self.viewport_y - 0.5, self.viewport_y + self.VIEWPORT_ROWS - 0.5)
 
         self.canvas.draw_idle()
 
+    def find_nodes_in_viewport(self):
+        """
+        :return: set of nodes within the viewport plus a margin, and their neighbours so that edges are drawn across
+        the border of the viewport
+        """
+        min_x = self.viewport_x - self.VIEWPORT_MARGIN
+        max_x = self.viewport_x + self.VIEWPORT_COLUMNS + self.VIEWPORT_MARGIN
+        min_y = self.viewport_y - self.VIEWPORT_MARGIN
+        max_y = self.viewport_y + self.VIEWPORT_ROWS + self.VIEWPORT_MARGIN
+
+        nodes = set()
+        for x in range(max(min_x, 0), max_x + 1):
+            if x not in self.graph_columns:
+                continue
+            positions, column_nodes = self.graph_columns[x]
+            nodes.update(column_nodes[bisect_left(positions, min_y):bisect_right(positions, max_y)])
+
+        return nodes | self.graph.neighbours(nodes)
+
+    def configure_scroll_bars(self):
+        """
+        Scroll ranges follow the size of the laid out graph. Scroll bars are hidden when everything fits.
+
+        """
+        max_viewport_x = max(0, self.num_columns() - self.VIEWPORT_COLUMNS)
+        max_viewport_y = max(0, self.num_rows() - self.VIEWPORT_ROWS)
+
+        for scroll_bar, maximum in ((self.horizontal_scroll_bar, max_viewport_x),
+                                    (self.vertical_scroll_bar, max_viewport_y)):
+            scroll_bar.blockSignals(True)
+            scroll_bar.setRange(0, maximum)
+            scroll_bar.setVisible(maximum > 0)
+            scroll_bar.blockSignals(False)
+
+        self.viewport_x = min(self.viewport_x, max_viewport_x)
+        self.viewport_y = min(self.viewport_y, max_viewport_y)
+        self.sync_scroll_bars()
+
+    def sync_scroll_bars(self):
+        for scroll_bar, value in ((self.horizontal_scroll_bar, self.viewport_x),
+                                  (self.vertical_scroll_bar, self.viewport_y)):
+            scroll_bar.blockSignals(True)
+            scroll_bar.setValue(value)
+            scroll_bar.blockSignals(False)
+
+    def scroll_to_node(self, node):
+        """
+        Move the viewport by as little as possible to bring a node into view.
+
+        :param node: node
+        :return: Boolean representing if the viewport moved
+        """
+        if not self.graph or node is None or self.pos_x[node] == self.NOT_DRAWN:
+            return False
+
+        return self.scroll_to_cell(self.pos_x[node], self.pos_y[node])
+
+    def scroll_to_cell(self, x, y):
+        """
+        :param x: column
+        :param y: row
+        :return: Boolean representing if the viewport moved
+        """
+        viewport = (self.viewport_x, self.viewport_y)
+
+        if x < self.viewport_x:
+            self.viewport_x = x
+        elif x > self.viewport_x + self.VIEWPORT_COLUMNS - 1:
+            self.viewport_x = x - self.VIEWPORT_COLUMNS + 1
+
+        if y < self.viewport_y:
+            self.viewport_y = y
+        elif y > self.viewport_y + self.VIEWPORT_ROWS - 1:
+            self.viewport_y = y - self.VIEWPORT_ROWS + 1
+
+        self.sync_scroll_bars()
+        return viewport != (self.viewport_x, self.viewport_y)
+
+    def scroll_by(self, dx, dy):
+        viewport_x = min(max(self.viewport_x + dx, 0), self.horizontal_scroll_bar.maximum())
+        viewport_y = min(max(self.viewport_y + dy, 0), self.vertical_scroll_bar.maximum())
+        if (viewport_x, viewport_y) == (self.viewport_x, self.viewport_y):
+            return
+
+        self.viewport_x = viewport_x
+        self.viewport_y = viewport_y
+        self.sync_scroll_bars()
+        self.plot_graph()
+
+    def num_columns(self):
+        if not self.pos_x:
+            return 1
+        if self.unsaved_cell:
+            return max(self.num_graph_columns, self.unsaved_cell[0] + 1)
+        return self.num_graph_columns
+
+    def num_rows(self):
+        if not self.pos_y:
+            return 1
+        if self.unsaved_cell:
+            return max(self.num_graph_rows, self.unsaved_cell[1] + 1)
+        return self.num_graph_rows
+
+    def segment_rows(self):
+        """
+        :return: array of the rows of plot_rows that are segments
+        """
+        return np.flatnonzero(self.node_kinds[self.plot_rows] == self.KIND_SEGMENT)
+
+    def shape_segments(self):
+        """
+        Segments are squares - the scatter takes a marker path per node once there is one on display.
+
+        :return: None
+        """
+        segment_rows = self.segment_rows()
+        if not len(segment_rows):
+            return
+
+        paths = np.empty(len(self.plot_rows), dtype=object)
+        paths[:] = [marker_path('o')]
+        paths[segment_rows] = [marker_path('s')] * len(segment_rows)
+        self.plot.set_paths(list(paths))
+
+    def label_segments(self):
+        for row in self.plot_rows[self.segment_rows()]:
+            x, y = self.node_xy[row]
+            self.plot.axes.text(x + 0.25,
+                                y,
+                                '{} versions'.format(len(self.segments[self.node_ids[row]])),
+                                fontsize=8,
+                                color=self.SEGMENT_LABEL_COLOR,
+                                verticalalignment='center',
+                                clip_on=True)
+
     def refresh_graph(self):
         """
         Use function when there is no need to re-instantiate graph related attributes.
 
         :return: None
         """
-
-        # Marking stale as True informs the plot that it has to be redrawn, but I have no idea why I have to write it
-        self.plot.stale = True
+        if self.plot and self.graph:
+            self.plot.set_facecolors(self.NODE_COLORS[self.node_kinds[self.plot_rows]])
+            self.update_unsaved_overlay()
         self.canvas.draw_idle()
-        self.head_node_changed.emit(self.head)
+        self.head_node_changed.emit(self.head_file_hash())
 
     def extract_critical_nodes(self):
-        self.root = self.index[self.INDEX_ROOT]
-        self.head = self.index[self.INDEX_HEAD]
-        self.adopts = self.index[self.INDEX_ADOPTS]
-        self.index.pop(self.INDEX_ROOT)
-        self.index.pop(self.INDEX_HEAD)
-        self.index.pop(self.INDEX_ADOPTS)
-
-    def add_temp_node(self):
-        self.graph.add_node(self.UNSAVED_NODE)
-
-    def add_nodes_and_edges(self):
-        for key, values in self.index.items():
-            self.graph.add_node(key)
-            for val in values:
-                self.graph.add_edge(key, val)
+        self.root = self.full_index.root
+        self.head = self.full_index.head
+        self.adopts = set(self.full_index.adopts)
 
-    def configure_node_and_edge_aesthetics(self):
-        if not self.index:
-            for _, node_attrs in self.graph.nodes(data=True):
-                node_attrs['color'] = self.DEFAULT_NODE_COLOR
-                node_attrs['size'] = self.get_node_size()
+    def head_file_hash(self):
+        """
+        :return: hash of head, None if the document has no repo
+        """
+        return self.node_file_hash(self.head)
+
+    def node_file_hash(self, node):
+        """
+        :param node: node
+        :return: hash of the version a node stands for, None for a segment
+        """
+        if node is None or node >= self.full_index.num_nodes:
+            return None
+        return self.full_index.hashes[node]
+
+    def collapse_linear_runs(self):
+        """
+        Build the graph that is actually drawn. In a large history, every maximal run of versions that have one parent
+        and one child is replaced by a segment node - unless the run is short, expanded or close to head.
+        Root, head, branch points and the tips of branches are always drawn in full.
+
+        :return: None
+        """
+        self.segments = {}
+        full_index = self.full_index
+
+        if len(full_index) < self.LOD_THRESHOLD:
+            self.graph = TimelineGraph.from_compact_index(full_index)
             return
 
-        for node, node_attrs in self.graph.nodes(data=True):
+        pinned = self.find_nodes_near_head()
 
-            if node == self.root and node == self.head:
-                if len(self.graph.nodes) == 1 or self.edit_mode:
-                    node_attrs['color'] = self.ROOT_NODE_COLOR
-                else:
-                    node_attrs['color'] = self.HEAD_NODE_COLOR
+        def collapsible(node):
+            return (full_index.num_children(node) == 1 and full_index.num_parents(node) == 1
+                    and node != self.root and node not in pinned)
 
-            elif node == self.root:
-                node_attrs['color'] = self.ROOT_NODE_COLOR
+        index = {}
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node in index:
+                continue
 
-            elif node == self.head:
-                node_attrs['color'] = self.HEAD_NODE_COLOR
+            children = []
+            for child in full_index.children(node):
+                # Only the first version of a maximal run can start a segment
+                if (collapsible(child) and not collapsible(node)
+                        and full_index.hashes[child] not in self.expanded_segments):
+                    run = [child]
+                    while collapsible(full_index.first_child(run[-1])):
+                        run.append(full_index.first_child(run[-1]))
 
-            elif node == self.UNSAVED_NODE:
-                node_attrs['color'] = self.UNSAVED_NODE_COLOR
+                    if len(run) >= self.min_run_length:
+                        segment = full_index.num_nodes + len(self.segments)
+                        self.segments[segment] = run
+                        index[segment] = [full_index.first_child(run[-1])]
+                        children.append(segment)
+                        stack.append(index[segment][0])
+                        continue
 
-            else:
-                node_attrs['color'] = self.DEFAULT_NODE_COLOR
+                children.append(child)
+                stack.append(child)
+
+            index[node] = children
+
+        self.graph = TimelineGraph.from_children(full_index.num_nodes + len(self.segments), index)
+
+    def find_nodes_near_head(self):
+        """
+        :return: set of nodes within LOD_HEAD_RADIUS steps of head, up or down
+        """
+        nodes = {self.head}
 
-            node_attrs['size'] = self.get_node_size()
+        node = self.head
+        for _ in range(self.LOD_HEAD_RADIUS):
+            if not self.full_index.num_parents(node):
+                break
+            node = self.full_index.parents(node)[0]
+            nodes.add(node)
+
+        frontier = [self.head]
+        for _ in range(self.LOD_HEAD_RADIUS):
+            frontier = [child for node in frontier for child in self.full_index.children(node)]
+            nodes.update(frontier)
+
+        return nodes
+
+    def resolve_segment(self, node, last=False):
+        """
+        Version to move to when navigation lands on a node, which may be a segment.
+
+        :param node: node
+        :param last: pick the last version of a segment instead of the first
+        :return: version
+        """
+        if node not in self.segments:
+            return node
 
-        for u, v, attrs in self.graph.edges.data():
-            attrs['width'] = 1.5
-            if u == self.head and v == self.UNSAVED_NODE:
-                attrs['style'] = 'dotted'
+        run = self.segments[node]
+        return run[-1] if last else run[0]
 
-        for edge in self.adopts:
-            edge_attr = self.graph.edges[edge[0], edge[1]]
-            edge_attr['style'] = 'dashed'
+    def build_node_and_edge_arrays(self):
+        """
+        Put the drawn graph in NumPy arrays - node ids and their positions on the canvas, a row per node, and the
+        rows of both ends of every edge - so that styling, culling and drawing work on whole columns at once.
 
-    def get_node_size(self):
-        if not self.pos_x and not self.pos_y:
-            return self.DEFAULT_NODE_SIZE
+        :return: None
+        """
+        self.node_ids = self.graph.nodes
+        self.node_rows = np.full(len(self.pos_x), -1, dtype=np.intp)
+        self.node_rows[self.node_ids] = np.arange(len(self.node_ids))
 
-        x_capacity = 10
-        y_capacity = 20
-        max_x = len(set(self.pos_x.values()))
-        max_y = len(set(self.pos_y.values()))
-        if max_y < y_capacity and max_x < x_capacity:
-            return self.DEFAULT_NODE_SIZE
+        pos_x = np.array(self.pos_x)[self.node_ids] + self.get_x_bias()
+        pos_y = np.array(self.pos_y)[self.node_ids] + self.get_y_bias()
+        self.node_xy = np.column_stack((pos_x, pos_y)).astype(float)
+
+        sources, targets = self.graph.edges()
+        self.edge_rows = np.column_stack((self.node_rows[sources], self.node_rows[targets])).reshape(-1, 2)
+
+    def configure_node_and_edge_aesthetics(self):
+        """
+        Pick the kind - and so the colour or line style - of every node and edge, a column at a time.
 
-        adjusted_node_x_size = (1 - ((max_x - x_capacity) * 0.03)) * self.DEFAULT_NODE_SIZE
-        adjusted_node_y_size = (1 - ((max_y - y_capacity) * 0.01)) * self.DEFAULT_NODE_SIZE
+        :return: None
+        """
+        if not self.graph:
+            return
 
-        return max(30.0, min(adjusted_node_x_size, adjusted_node_y_size))
+        kinds = np.full(len(self.node_ids), self.KIND_DEFAULT, dtype=np.int8)
+        kinds[self.node_ids >= self.full_index.num_nodes] = self.KIND_SEGMENT
+        kinds[self.node_rows[self.root]] = self.KIND_ROOT
+        kinds[self.node_rows[self.head]] = self.head_kind()
+        self.node_kinds = kinds
+
+        sources = self.node_ids[self.edge_rows[:, 0]]
+        targets = self.node_ids[self.edge_rows[:, 1]]
+        edge_kinds = np.full(len(self.edge_rows), self.EDGE_NATURAL, dtype=np.int8)
+
+        # Adopted edges within a collapsed run are not drawn
+        if self.adopts:
+            adopts = np.array(list(self.adopts), dtype=np.intp)
+            num_nodes = len(self.node_rows)
+            edge_kinds[np.isin(sources * num_nodes + targets,
+                               adopts[:, 0] * num_nodes + adopts[:, 1])] = self.EDGE_ADOPTED
+        self.edge_kinds = edge_kinds
+
+    def head_kind(self):
+        """
+        :return: kind of head - a root that is head stays green while it is the only version, or has unsaved content
+        """
+        if self.head == self.root and (len(self.node_ids) == 1 or self.edit_mode):
+            return self.KIND_ROOT
+        return self.KIND_HEAD
 
     # Slot
     def pick_event(self, event):
         if event.mouseevent.button != MouseButton.LEFT:
             return
 
-        if hasattr(event, 'nodes') and event.nodes and event.nodes[0] != self.head:
-            self.request_to_change_node.emit(event.nodes[0])
+        if not self.graph or event.artist is not self.plot or not len(event.ind):
+            return
+
+        node = int(self.node_ids[self.plot_rows[event.ind[0]]])
+        if node in self.segments:
+            self.expand_segment(node)
+        elif node != self.head:
+            self.request_to_change_node.emit(self.node_file_hash(node))
+
+    # Slot
+    def motion_notify_event(self, event):
+        node = self.node_at_point(event.xdata, event.ydata)
+        if node == self.hovered_node:
+            return
+
+        self.hide_preview()
+        self.hovered_node = node
+
+        # Segments already carry a label
+        if node is not None and node not in self.segments:
+            self.request_node_preview.emit(self.node_file_hash(node))
+
+    # Slot
+    def figure_leave_event(self, event):
+        self.hide_preview()
+
+    def show_preview(self, file_hash, text):
+        """
+        Show the preview of a version in a tooltip - as long as the cursor is still on it.
+
+        :param file_hash: hash of version
+        :param text: rich text of the preview
+        :return: None
+        """
+        if self.hovered_node is None or file_hash != self.node_file_hash(self.hovered_node):
+            return
+
+        QToolTip.showText(QCursor.pos(), text, self.canvas)
+
+    def hide_preview(self):
+        self.hovered_node = None
+        QToolTip.hideText()
+
+    # Slot
+    def handle_horizontal_scroll(self, value):
+        self.viewport_x = value
+        self.plot_graph()
+
+    # Slot
+    def handle_vertical_scroll(self, value):
+        self.viewport_y = value
+        self.plot_graph()
+
+    # Slot
+    def scroll_event(self, event):
+        """
+        Scroll moves the viewport up and down, Shift + scroll moves it sideways.
+        Ctrl + scroll changes the level of detail - zooming in expands runs, zooming out collapses them.
+
+        """
+        if not self.full_index:
+            return
+
+        if event.key != 'control':
+            step = self.SCROLL_STEP if event.button == 'up' else -self.SCROLL_STEP
+            if event.key == 'shift':
+                self.scroll_by(-step, 0)
+            else:
+                self.scroll_by(0, step)
+            return
 
-    def sequential_layout(self, graph):
-        seq_layout = {}
+        if event.button == 'up':
+            self.min_run_length = min(self.min_run_length * 2, self.LOD_MAX_RUN_LENGTH)
+        else:
+            self.min_run_length = max(self.min_run_length // 2, 2)
 
-        # Build graph representation in 2D matrix form
-        self.graph_matrix = [[None for _ in set(self.pos_y.values())] for _ in set(self.pos_x.values())]
+        self.build_graph()
+
+    def expand_segment(self, segment):
+        self.expanded_segments.add(self.full_index.hashes[self.segments[segment][0]])
+        self.build_graph()
 
-        for key in graph.nodes.keys():
-            seq_layout[key] = [self.get_pos_x_with_bias(key), self.get_pos_y_with_bias(key)]
-            self.graph_matrix[self.pos_x[key]][self.pos_y[key]] = key if key != self.UNSAVED_NODE else None
+    def build_spatial_index(self):
+        """
+        Index the laid out nodes by column and by row. Each column maps to a sorted list of rows and the nodes on
+        those rows, and each row to a sorted list of columns and their nodes - memory stays proportional to the
+        number of nodes, and lookups are binary searches.
 
-        return seq_layout
+        :return: None
+        """
+        columns = {}
+        rows = {}
+        for key in self.graph.nodes.tolist():
+            x = self.pos_x[key]
+            y = self.pos_y[key]
+            columns.setdefault(x, []).append((y, key))
+            rows.setdefault(y, []).append((x, key))
+
+        self.graph_columns = {x: self.split_positions(cells) for x, cells in columns.items()}
+        self.graph_rows = {y: self.split_positions(cells) for y, cells in rows.items()}
+
+    # Helper function
+    def split_positions(self, cells):
+        cells.sort()
+        return [position for position, _ in cells], [key for _, key in cells]
+
+    def node_at(self, col, row):
+        """
+        :param col: column
+        :param row: row
+        :return: node at the given column and row, None if there is none
+        """
+        positions, nodes = self.graph_columns.get(col, ((), ()))
+        i = bisect_left(positions, row)
+        if i < len(positions) and positions[i] == row:
+            return nodes[i]
+        return None
 
     def get_pos_y_with_bias(self, key):
         """
@@ -231,11 +846,7 @@ class Timeline(QMainWindow):
         :param key: node
         :return: positional value
         """
-        max_y = len(set(self.pos_y.values()))
-        if max_y > 13:
-            return self.pos_y[key]
-        else:
-            return self.pos_y[key] + (6 - ((max_y - 1) * 0.5))
+        return self.pos_y[key] + self.get_y_bias()
 
     def get_pos_x_with_bias(self, key):
         """
@@ -244,106 +855,183 @@ class Timeline(QMainWindow):
         :param key: node
         :return: positional value
         """
-        max_x = len(set(self.pos_x.values()))
+        return self.pos_x[key] + self.get_x_bias()
+
+    def get_y_bias(self):
+        # A row is left free above the graph for the unsaved node
+        max_y = self.num_graph_rows + 1
+        if max_y > 13:
+            return 0
+        else:
+            return 6 - ((max_y - 1) * 0.5)
+
+    def get_x_bias(self):
+        max_x = self.num_graph_columns
         if max_x > 5:
-            return self.pos_x[key]
+            return 0
         else:
-            x = self.pos_x[key] + (2.5 - ((max_x - 1) * 0.5))
-            return x
+            return 2.5 - ((max_x - 1) * 0.5)
 
-    def assign_node_positions(self):
-        starting_pos_x = 0
-        starting_pos_y = 0
-        self.pos_x = {self.root: starting_pos_x}
-        self.pos_y = {self.root: starting_pos_y}
+    def node_at_point(self, x, y):
+        """
+        :param x: x coordinate in data space
+        :param y: y coordinate in data space
+        :return: node drawn at the point, None if there is none
+        """
+        if not self.graph or x is None or y is None:
+            return None
+
+        x -= self.get_x_bias()
+        y -= self.get_y_bias()
+        col = round(x)
+        row = round(y)
+        if abs(x - col) > self.HOVER_RADIUS or abs(y - row) > self.HOVER_RADIUS:
+            return None
 
-        for parent, children in self.index.items():
-            self.fill_pos_x(children, counter=starting_pos_x)
-            self.fill_pos_y(parent, children)
+        return self.node_at(col, row)
+
+    def assign_node_positions(self):
+        """
+        Each branch gets a column and each generation a row. A node shares the column of its first child's branch,
+        and every tip of a branch moves the column counter one step to the right. A merged version has more than one
+        parent - it is placed once the last of them is, a row above the highest of them.
 
-    def fill_pos_x(self, children, counter):
-        for child in children:
-            if child not in self.pos_x:
-                self.pos_x[child] = counter
-                counter = self.fill_pos_x(self.index[child], counter)
+        Walks the index depth first with an explicit stack, so that deep histories do not hit the recursion limit.
+        Positions are kept in arrays indexed by node - NOT_DRAWN for versions within a collapsed segment.
 
-        return counter if children else counter + 1
+        :return: None
+        """
+        starting_pos_x = 0
+        starting_pos_y = 0
+        num_nodes = self.full_index.num_nodes + len(self.segments)
+        self.pos_x = array('l', [self.NOT_DRAWN]) * num_nodes
+        self.pos_y = array('l', [self.NOT_DRAWN]) * num_nodes
+        self.pos_x[self.root] = starting_pos_x
+        self.pos_y[self.root] = starting_pos_y
+
+        graph = self.graph
+        parents_left = np.bincount(graph.edges()[1], minlength=graph.size).tolist()
+
+        counter = starting_pos_x
+        stack = [(self.root, iter(graph.children(self.root)), [])]
+        while stack:
+            parent, children, placed_children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+
+                # A tip of a branch - or a parent whose children are placed along with another parent
+                if not placed_children:
+                    counter += 1
+                continue
+
+            parents_left[child] -= 1
+            if parents_left[child] or self.pos_x[child] != self.NOT_DRAWN:
+                continue
+
+            placed_children.append(child)
+            self.pos_x[child] = counter
+            self.pos_y[child] = max(self.pos_y[node] for node in graph.parents(child)) + 1
+            stack.append((child, iter(graph.children(child)), []))
+
+        self.num_graph_columns = len(np.unique(np.array(self.pos_x)[graph.nodes]))
+        self.num_graph_rows = len(np.unique(np.array(self.pos_y)[graph.nodes]))
+
+    def switch_node_colors(self, file_hash):
+        """
+        Move head to a version, e.g. one picked outside of the timeline.
 
-    def fill_pos_y(self, parent, children):
-        for child in children:
-            self.pos_y[child] = self.pos_y[parent] + 1
+        :param file_hash: hash of version
+        :return: None
+        """
+        self.switch_head(self.full_index.ids[file_hash])
+
+    def switch_head(self, new_head):
+        # Head moved into a collapsed run - redraw so that the run opens up around it
+        if self.pos_x[new_head] == self.NOT_DRAWN:
+            self.head = new_head
+            self.build_graph()
+            self.head_node_changed.emit(self.head_file_hash())
+            return
 
-    def switch_node_colors(self, new_head):
-        self.graph.nodes[new_head]['color'] = self.HEAD_NODE_COLOR
         if self.head == self.root:
-            self.graph.nodes[self.head]['color'] = self.ROOT_NODE_COLOR
+            self.node_kinds[self.node_rows[self.head]] = self.KIND_ROOT
         else:
-            self.graph.nodes[self.head]['color'] = self.DEFAULT_NODE_COLOR
+            self.node_kinds[self.node_rows[self.head]] = self.KIND_DEFAULT
         self.head = new_head
+        self.node_kinds[self.node_rows[self.head]] = self.head_kind()
+        self.place_unsaved_node()
+
+        # Keep head in view
+        if self.scroll_to_node(self.head):
+            self.plot_graph()
+
         self.refresh_graph()
 
     def move_up(self):
-        curr_pos_x = self.pos_x[self.head]
-        curr_pos_y = self.pos_y[self.head]
-        if curr_pos_y + 1 < len(self.graph_matrix[0]):
-            node = self.graph_matrix[curr_pos_x][curr_pos_y + 1]
-            if node:
-                self.switch_node_colors(node)
+        node = self.node_at(self.pos_x[self.head], self.pos_y[self.head] + 1)
+        if node is not None:
+            self.switch_head(self.resolve_segment(node))
 
     def move_down(self):
         if self.head == self.root:
             return
 
-        curr_pos_x = self.pos_x[self.head]
-        curr_pos_y = self.pos_y[self.head]
-        curr_pos_y -= 1
-
-        node = self.graph_matrix[curr_pos_x][curr_pos_y]
-        while not node:
-            curr_pos_x -= 1
-            node = self.graph_matrix[curr_pos_x][curr_pos_y]
+        # Closest node on the row below, at or to the left of head's column
+        positions, nodes = self.graph_rows[self.pos_y[self.head] - 1]
+        i = bisect_right(positions, self.pos_x[self.head]) - 1
+        if i < 0:
+            return
 
-        self.switch_node_colors(node)
+        self.switch_head(self.resolve_segment(nodes[i], last=True))
 
     def move_right(self):
         col = self.pos_x[self.head]
         row = self.pos_y[self.head]
+        num_columns = self.num_columns()
 
         node = None
-        while col + 1 < len(self.graph_matrix) and not node:
+        while col + 1 < num_columns and node is None:
             col += 1
             node = self.find_nearest_node_in_col(col, row)
 
-        if node:
-            self.switch_node_colors(node)
+        if node is not None:
+            self.switch_head(self.resolve_segment(node))
 
     def move_left(self):
         col = self.pos_x[self.head]
         row = self.pos_y[self.head]
 
         node = None
-        while col - 1 >= 0 and not node:
+        while col - 1 >= 0 and node is None:
             col -= 1
             node = self.find_nearest_node_in_col(col, row)
 
-        if node:
-            self.switch_node_colors(node)
+        if node is not None:
+            self.switch_head(self.resolve_segment(node))
 
-    def find_nearest_node_in_col(self, row, col):
-        node = self.graph_matrix[row][col]
-        if node:
-            return node
-        p1 = p2 = col
-        while True:
-            if p1 == len(self.graph_matrix[0]) - 1 and p2 == 0:
-                break
-            if p1 < len(self.graph_matrix[0]) - 1:
-                p1 += 1
-            if p2 > 0:
-                p2 -= 1
-            if self.graph_matrix[row][p1]:
-                return self.graph_matrix[row][p1]
-            if self.graph_matrix[row][p2]:
-                return self.graph_matrix[row][p2]
+    def find_nearest_node_in_col(self, col, row):
+        """
+        :param col: column
+        :param row: row
+        :return: node of the column closest to the given row - the one above wins a tie, None if column is empty
+        """
+        positions, nodes = self.graph_columns.get(col, ((), ()))
+        if not positions:
+            return None
 
-        return None
+        i = bisect_left(positions, row)
+        if i == len(positions):
+            return nodes[i - 1]
+        if i == 0 or positions[i] - row <= row - positions[i - 1]:
+            return nodes[i]
+        return nodes[i - 1]
+
+
+def marker_path(marker):
+    """
+    :param marker: matplotlib marker, e.g. 'o'
+    :return: path of the marker, scaled the way scatter scales its own
+    """
+    marker_style = MarkerStyle(marker)
+    return marker_style.get_path().transformed(marker_style.get_transform())
@@ -0,0 +1,93 @@
+"""
+Move repos from one storage backend to another - by default, from the loose-file layout (a directory tree per
+tracked file) into the single SQLite database.
+
+Each repo is copied in one transaction, checked against the original and only then, if asked to, removed from
+the source. Repos already in the destination are skipped, so an interrupted run can simply be restarted.
+Run from src/main/python, then start Maroon Lines with MAROON_LINES_STORAGE set to the destination:
+
+    python migrate_storage.py
+    python migrate_storage.py --remove-source
+    python migrate_storage.py --source sqlite --destination loose
+
+"""
+import sys
+import argparse
+
+from utils.repository_control import *
+
+
+def migrate_repo(source, destination, repo):
+    """
+    Copy a repo - key, index, file objects, chunks, previews and editor states - from one storage backend to another.
+
+    :param source: StorageBackend to copy from
+    :param destination: StorageBackend to copy into
+    :param repo: id of repo
+    :return: Boolean representing if the repo was copied, False if the destination already had it
+    """
+    if destination.repo_exists(repo):
+        return False
+
+    file_hashes = source.object_hashes(repo)
+    with destination.transaction():
+        destination.create_repo(repo)
+        destination.write_key(repo, source.read_key(repo))
+        destination.write_index(repo, source.read_index(repo))
+
+        for chunk_hash in source.chunk_hashes(repo):
+            destination.write_chunk(repo, chunk_hash, source.read_chunk(repo, chunk_hash))
+
+        for file_hash in file_hashes:
+            _, written = source.object_stat(repo, file_hash)
+            destination.write_object(repo, file_hash, source.read_object(repo, file_hash), written)
+
+            preview_data = source.read_preview(repo, file_hash)
+            if preview_data is not None:
+                destination.write_preview(repo, file_hash, preview_data)
+
+            state_data = source.read_editor_state(repo, file_hash)
+            if state_data is not None:
+                destination.write_editor_state(repo, file_hash, state_data)
+
+    if set(destination.object_hashes(repo)) != set(file_hashes):
+        destination.remove_repo(repo)
+        raise Exception('Unable to migrate repo: File objects did not match after copying')
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move Maroon Lines repos from one storage backend to another.')
+    parser.add_argument('--source', choices=[STORAGE_LOOSE, STORAGE_SQLITE], default=STORAGE_LOOSE)
+    parser.add_argument('--destination', choices=[STORAGE_LOOSE, STORAGE_SQLITE], default=STORAGE_SQLITE)
+    parser.add_argument('--remove-source', action='store_true', help='remove each repo from the source once copied')
+    args = parser.parse_args()
+
+    if args.source == args.destination:
+        parser.error('source and destination are the same')
+
+    locations = {STORAGE_LOOSE: repos_path(), STORAGE_SQLITE: repo_database_path()}
+    source = open_storage_backend(args.source, locations[args.source])
+    destination = open_storage_backend(args.destination, locations[args.destination])
+
+    failures = 0
+    repos = source.repos()
+    for i, repo in enumerate(repos, 1):
+        try:
+            copied = migrate_repo(source, destination, repo)
+        except Exception as e:
+            failures += 1
+            print('[{}/{}] FAIL {}: {}'.format(i, len(repos), repo, e))
+            continue
+
+        print('[{}/{}] {} {}'.format(i, len(repos), 'copied' if copied else 'skipped', source.read_key(repo)))
+        if args.remove_source:
+            source.remove_repo(repo)
+
+    print('Migrated {} of {} repos into {}'.format(len(repos) - failures, len(repos), locations[args.destination]))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from utils.atomic_write import atomic_write, batched_fsync, is_temp_file, NEW_FILE_MODE
+from utils.storage_backend import LooseBackend
+from utils.repository_control import set_repo_backend, init_repo, add_file_object_to_index, repo_index, \
+    index_dict_nodes
+
+
+class BatchedFsyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_of_another_thread_is_not_deferred(self):
+        path = os.path.join(self.directory, 'other')
+        batch_started = threading.Event()
+        write_done = threading.Event()
+
+        def batch():
+            with batched_fsync():
+                batch_started.set()
+                write_done.wait()
+
+        thread = threading.Thread(target=batch)
+        thread.start()
+        batch_started.wait()
+
+        try:
+            atomic_write(path, 'content')
+            self.assertTrue(os.path.exists(path))
+        finally:
+            write_done.set()
+            thread.join()
+
+    def test_batch_commits_only_its_own_writes(self):
+        path = os.path.join(self.directory, 'batched')
+        with batched_fsync():
+            atomic_write(path, 'content')
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(path))
+
+    def test_new_file_gets_default_permissions(self):
+        path = os.path.join(self.directory, 'new')
+        atomic_write(path, 'content')
+        self.assertEqual(os.stat(path).st_mode & 0o777, NEW_FILE_MODE)
+
+    def test_existing_file_keeps_its_permissions(self):
+        path = os.path.join(self.directory, 'existing')
+        atomic_write(path, 'content')
+        os.chmod(path, 0o640)
+        atomic_write(path, 'new content')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+
+class ConcurrentReposTest(unittest.TestCase):
+
+    NUM_VERSIONS = 50
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        set_repo_backend(LooseBackend(os.path.join(self.directory, 'repos')))
+
+    def tearDown(self):
+        set_repo_backend(None)
+        shutil.rmtree(self.directory)
+
+    def test_add_file_object_to_index_on_two_repos_at_once(self):
+        file_paths = [os.path.join(self.directory, name) for name in ('a.py', 'b.py')]
+        for file_path in file_paths:
+            with open(file_path, 'w') as f:
+                f.write('root of {}\n'.format(file_path))
+            init_repo(file_path, 'root of {}\n'.format(file_path))
+
+        barrier = threading.Barrier(len(file_paths))
+        errors = []
+
+        def save_versions(file_path):
+            try:
+                barrier.wait()
+                for i in range(self.NUM_VERSIONS):
+                    add_file_object_to_index(file_path, '{} version {}\n'.format(file_path, i))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=save_versions, args=(file_path,)) for file_path in file_paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for file_path in file_paths:
+            self.assertEqual(len(index_dict_nodes(repo_index(file_path))), self.NUM_VERSIONS + 1)
+
+        for root, _, file_names in os.walk(self.directory):
+            self.assertEqual([name for name in file_names if is_temp_file(name)], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
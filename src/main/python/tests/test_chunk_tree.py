@@ -0,0 +1,49 @@
+import random
+import unittest
+
+from utils.chunk_tree import ChunkTree
+
+
+class ChunkTreeTest(unittest.TestCase):
+
+    def assertSameTree(self, tree, blocks):
+        expected = ChunkTree(blocks)
+        self.assertEqual(tree.levels, expected.levels)
+        self.assertEqual(tree.ends, expected.ends)
+
+    def test_edits_make_the_tree_of_the_new_text(self):
+        rng = random.Random(41)
+        blocks = ['line {}'.format(i) for i in range(3000)] + [''] * 500 + ['tail {}'.format(i) for i in range(500)]
+        tree = ChunkTree(blocks)
+        self.assertGreater(len(tree.levels), 3)
+
+        for i in range(300):
+            first = rng.randrange(len(blocks) + 1)
+            num_removed = min(rng.choice((0, 1, 1, 2, 40, 300)), len(blocks) - first)
+            new_blocks = [rng.choice(('', 'edit {}'.format(i))) for _ in range(rng.choice((0, 1, 2, 5, 200)))]
+            blocks[first:first + num_removed] = new_blocks
+            tree.replace(first, num_removed, new_blocks)
+            self.assertSameTree(tree, blocks or [''])
+
+    def test_insert_and_remove_restore_the_root(self):
+        blocks = ['line {}'.format(i) for i in range(5000)]
+        tree = ChunkTree(blocks)
+        root = tree.root
+
+        tree.replace(10, 1, ['line 1', '0'])
+        self.assertNotEqual(tree.root, root)
+        tree.replace(10, 2, ['line 10'])
+        self.assertEqual(tree.root, root)
+
+    def test_remove_and_refill_every_block(self):
+        blocks = ['line {}'.format(i) for i in range(2000)]
+        tree = ChunkTree(blocks)
+
+        tree.replace(0, len(blocks), [])
+        self.assertSameTree(tree, [''])
+        tree.replace(0, 1, blocks)
+        self.assertSameTree(tree, blocks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from utils.compact_index import CompactIndex
+from utils.repository_control import build_index_dict_from_file_hashes
+
+
+def build_index(root, edges):
+    """
+    :param root: hash of root
+    :param edges: list of (parent hash, child hash) tuples
+    :return: python dict object
+    """
+    index = build_index_dict_from_file_hashes([root])
+    for parent, child in edges:
+        index.setdefault(parent, []).append(child)
+        index.setdefault(child, [])
+    return index
+
+
+def common_ancestor(compact_index, file_hash, other_file_hash):
+    ids = compact_index.ids
+    return compact_index.hashes[compact_index.common_ancestor(ids[file_hash], ids[other_file_hash])]
+
+
+class CommonAncestorTest(unittest.TestCase):
+
+    def test_long_path_to_lower_ancestor(self):
+        # D -> C -> c1 -> c2 -> c3 -> M, D -> E -> M and C -> A - C is reached late from M, but is below D
+        index = CompactIndex.from_index_dict(build_index('D', [('D', 'C'), ('D', 'E'), ('C', 'A'), ('C', 'c1'),
+                                                               ('c1', 'c2'), ('c2', 'c3'), ('c3', 'M'), ('E', 'M')]))
+        self.assertEqual(common_ancestor(index, 'A', 'M'), 'C')
+        self.assertEqual(common_ancestor(index, 'M', 'A'), 'C')
+
+    def test_version_descends_from_the_other(self):
+        index = CompactIndex.from_index_dict(build_index('R', [('R', 'A'), ('A', 'B'), ('R', 'C')]))
+        self.assertEqual(common_ancestor(index, 'A', 'B'), 'A')
+        self.assertEqual(common_ancestor(index, 'B', 'B'), 'B')
+        self.assertEqual(common_ancestor(index, 'B', 'C'), 'R')
+
+    def test_criss_cross_merge_picks_one_lowest_ancestor(self):
+        # X and Y are both merged into P and Q - both are lowest, and the one recorded last wins
+        index = CompactIndex.from_index_dict(build_index('R', [('R', 'X'), ('R', 'Y'), ('X', 'P'), ('Y', 'P'),
+                                                               ('X', 'Q'), ('Y', 'Q')]))
+        self.assertEqual(common_ancestor(index, 'P', 'Q'), 'Y')
+
+    def test_versions_recorded_before_their_parents(self):
+        # Same history as test_long_path_to_lower_ancestor, with versions recorded from the tips down
+        edges = [('D', 'C'), ('D', 'E'), ('C', 'A'), ('C', 'c1'), ('c1', 'c2'), ('c2', 'c3'), ('c3', 'M'), ('E', 'M')]
+        index = build_index_dict_from_file_hashes(['D'])
+        for parent, child in reversed(edges):
+            index.setdefault(child, [])
+        for parent, child in edges:
+            index.setdefault(parent, []).append(child)
+        compact_index = CompactIndex.from_index_dict(index)
+        self.assertEqual(common_ancestor(compact_index, 'A', 'M'), 'C')
+        self.assertIsNotNone(compact_index.ranks)
+
+    def test_deep_history_is_not_ranked(self):
+        # Branches off the tip of a long history only walk back to where they split
+        edges = [(str(version), str(version + 1)) for version in range(9999)]
+        edges += [('9990', 'x'), ('x', 'y')]
+        index = CompactIndex.from_index_dict(build_index('0', edges))
+        self.assertEqual(common_ancestor(index, 'y', '9999'), '9990')
+        self.assertIsNone(index.ranks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils.pack_file import write_pack, open_pack_reader, forget_pack_reader
+from utils.storage_backend import LooseBackend
+
+
+def object_hash(i):
+    return '{:040x}'.format(i)
+
+
+class SharedPackReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pack_path = os.path.join(self.directory, 'pack')
+        write_pack(self.pack_path, b'index', [object_hash(1)], lambda file_hash: b'one')
+
+    def tearDown(self):
+        forget_pack_reader(self.pack_path)
+        shutil.rmtree(self.directory)
+
+    def test_reader_is_shared(self):
+        with open_pack_reader(self.pack_path) as reader, open_pack_reader(self.pack_path) as other_reader:
+            self.assertIs(reader, other_reader)
+        self.assertFalse(reader.map.closed)
+
+    def test_dropped_reader_is_closed_once_let_go_of(self):
+        with open_pack_reader(self.pack_path) as reader:
+            forget_pack_reader(self.pack_path)
+            self.assertEqual(reader.object_data(object_hash(1)), b'one')
+        self.assertTrue(reader.map.closed)
+
+    def test_reader_of_replaced_pack_is_closed_before_the_replace(self):
+        with open_pack_reader(self.pack_path) as reader:
+            pass
+
+        def object_data(file_hash):
+            with open_pack_reader(self.pack_path) as pack_reader:
+                return pack_reader.object_data(file_hash) or b'two'
+
+        write_pack(self.pack_path, b'index', [object_hash(1), object_hash(2)], object_data)
+        self.assertTrue(reader.map.closed)
+
+        with open_pack_reader(self.pack_path) as new_reader:
+            self.assertEqual(new_reader.object_data(object_hash(1)), b'one')
+            self.assertEqual(new_reader.object_data(object_hash(2)), b'two')
+
+
+class LoosePackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = LooseBackend(self.directory)
+        self.backend.create_repo('repo')
+        self.backend.write_index('repo', b'index')
+        for i in range(3):
+            self.backend.write_object('repo', object_hash(i), str(i).encode())
+        self.backend.compact_repo('repo')
+
+    def tearDown(self):
+        forget_pack_reader(self.backend.pack_path('repo'))
+        shutil.rmtree(self.directory)
+
+    def test_remove_packed_object(self):
+        self.backend.remove_object('repo', object_hash(1))
+        self.assertEqual(self.backend.object_hashes('repo'), [object_hash(0), object_hash(2)])
+        self.assertEqual(self.backend.read_object('repo', object_hash(2)), b'2')
+        self.assertEqual(self.backend.temp_files('repo'), [])
+
+    def test_rewritten_object_keeps_its_place(self):
+        for i in range(3, 6):
+            self.backend.write_object('repo', object_hash(i), str(i).encode())
+            os.utime(self.backend.object_path('repo', object_hash(i)), (i, i))
+        file_hashes = self.backend.object_hashes('repo')
+
+        self.backend.write_object('repo', object_hash(3), b'3')
+        self.assertEqual(self.backend.object_hashes('repo'), file_hashes)
+
+
+if __name__ == '__main__':
+    unittest.main()
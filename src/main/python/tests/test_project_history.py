@@ -0,0 +1,52 @@
+import os
+import json
+import zlib
+import shutil
+import tempfile
+import unittest
+
+from utils.project_history import summarize_repos
+from utils.storage_backend import MemoryBackend
+from utils.repository_control import set_repo_backend, repo_backend, repo_id, init_repo, get_hash
+
+
+class SummarizeReposTest(unittest.TestCase):
+
+    DAMAGED_INDEXES = ({}, [], {'root': 'a', 'head': 'a', 'adopts': [], 'a': ['b']})
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        set_repo_backend(MemoryBackend())
+
+    def tearDown(self):
+        set_repo_backend(None)
+        shutil.rmtree(self.directory)
+
+    def create_repo(self, name):
+        file_path = os.path.join(self.directory, name)
+        with open(file_path, 'w') as f:
+            f.write(name)
+        init_repo(file_path, name)
+        return file_path
+
+    def test_damaged_legacy_indexes_are_left_out(self):
+        file_paths = []
+        for i, index in enumerate(self.DAMAGED_INDEXES):
+            file_path = self.create_repo('damaged-{}'.format(i))
+            repo_backend().write_index(repo_id(file_path), zlib.compress(json.dumps(index).encode()))
+            file_paths.append(file_path)
+        file_path = self.create_repo('intact')
+        file_paths.append(file_path)
+
+        rows = summarize_repos(file_paths, {})
+        self.assertEqual([row[0] for row in rows], [file_path])
+        self.assertEqual(rows[0][4], get_hash('intact'))
+
+    def test_unchanged_repo_is_left_out(self):
+        file_path = self.create_repo('intact')
+        fingerprint = summarize_repos([file_path], {})[0][-1]
+        self.assertEqual(summarize_repos([file_path], {file_path: fingerprint}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
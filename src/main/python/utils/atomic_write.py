@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+TEMP_FILE_PREFIX = '.tmp-'
+
+# mkstemp creates files readable by the owner alone. New files get the permissions open() would have given them -
+# the umask can only be read by setting it, so it is read once, before any worker thread starts.
+_umask = os.umask(0)
+os.umask(_umask)
+NEW_FILE_MODE = 0o666 & ~_umask
+
+# Batches are per thread, as jobs of different repos run at the same time. Pending writes of the thread's active
+# batch are a list of (temp path, target path) tuples - None when no batch is active.
+_batch = threading.local()
+
+
+def pending_writes():
+    return getattr(_batch, 'pending_writes', None)
+
+
+def atomic_write(path, data, modified=None):
+    """
+    Write data to path such that a crash mid-way leaves either the old or the new content - never a mix of both.
+
+    Data is written to a temporary file in the same directory, flushed to disk and renamed over the target.
+    Inside a batched_fsync block, the flush and rename are deferred to the end of the block.
+
+    :param path: full location of the file to write
+    :param data: str (written in text mode) or bytes (written in binary mode)
+    :param modified: time to record as the file's modification time, instead of the time it is written
+    :return: None
+    """
+    with atomic_open(path, 'wb' if isinstance(data, bytes) else 'w', modified) as f:
+        f.write(data)
+
+
+@contextmanager
+def atomic_open(path, mode='wb', modified=None):
+    """
+    Stream content into a file with the same guarantees as atomic_write. Nothing replaces the target unless
+    the block exits without an error.
+
+    :param path: full location of the file to write
+    :param mode: 'wb' or 'w'
+    :param modified: time to record as the file's modification time, instead of the time it is written
+    :return: file object of the temporary file
+    """
+    directory = os.path.dirname(path) or os.curdir
+    fd, temp_path = tempfile.mkstemp(prefix=TEMP_FILE_PREFIX, dir=directory)
+    batch = pending_writes()
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            if batch is None:
+                f.flush()
+                os.fsync(f.fileno())
+
+        if modified is not None:
+            os.utime(temp_path, (modified, modified))
+
+        # Preserve permissions of the file being replaced
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            os.chmod(temp_path, NEW_FILE_MODE)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    if batch is not None:
+        batch.append((temp_path, path))
+        return
+
+    os.replace(temp_path, path)
+    fsync_directory(directory)
+
+
+@contextmanager
+def batched_fsync():
+    """
+    Defer the flush and rename of every atomic_write within the block, so that all files are
+    flushed together and renamed in the order they were written once the block exits.
+
+    Reads of the targets inside the block still see the old content. Only writes of the calling thread join the
+    batch - writes of other threads go through their own.
+
+    :return: None
+    """
+    # Nested batches are folded into the outermost one
+    if pending_writes() is not None:
+        yield
+        return
+
+    batch = _batch.pending_writes = []
+    try:
+        yield
+    except BaseException:
+        for temp_path, _ in batch:
+            os.remove(temp_path)
+        raise
+    else:
+        commit_pending_writes(batch)
+    finally:
+        _batch.pending_writes = None
+
+
+def commit_pending_writes(pending_writes):
+    """
+    Flush temp files to disk, rename them over their targets and flush the affected directories.
+
+    :param pending_writes: list of (temp path, target path) tuples
+    :return: None
+    """
+    for temp_path, _ in pending_writes:
+        fsync_file(temp_path)
+
+    directories = []
+    for temp_path, path in pending_writes:
+        os.replace(temp_path, path)
+        directory = os.path.dirname(path) or os.curdir
+        if directory not in directories:
+            directories.append(directory)
+
+    for directory in directories:
+        fsync_directory(directory)
+
+
+def fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(directory):
+    """
+    Flush a directory entry so that a rename within it survives a crash. Not supported on Windows.
+
+    :param directory: location of directory
+    :return: None
+    """
+    if os.name == 'nt':
+        return
+
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def is_temp_file(file_name):
+    """
+    Check if a file is a leftover of an interrupted atomic_write.
+
+    :param file_name: name of file
+    :return: Boolean
+    """
+    return file_name.startswith(TEMP_FILE_PREFIX)
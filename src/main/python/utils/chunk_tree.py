@@ -0,0 +1,180 @@
+import hashlib
+from bisect import bisect_right
+
+# Prefixes that keep the hash of a block apart from the hash of a node over blocks
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def hash_block(text):
+    return hashlib.sha1(LEAF_PREFIX + text.encode()).digest()
+
+
+def hash_node(children):
+    return hashlib.sha1(NODE_PREFIX + b''.join(children)).digest()
+
+
+class ChunkTree:
+    """
+    A class to represent a hash tree over the blocks (lines) of a document. Leaves are the hashes of the blocks,
+    every node above is the hash of a run of nodes under it - so the root identifies the whole text.
+
+    Runs are bounded by content rather than position: a run ends after a node whose hash picks it as a boundary,
+    once the run has MIN_RUN nodes, or else after MAX_RUN nodes - FANOUT nodes on average. The same text always
+    makes the same tree, and blocks inserted or removed only move the boundaries of the runs around them - only those
+    runs and the nodes on their way to the root are rehashed, however far into the document the change is. Runs of
+    identical blocks, e.g. blank lines, bound their runs by MAX_RUN alone, so a change within one rehashes a node
+    per MAX_RUN blocks after it, up to its end.
+
+    levels - list of the nodes of every level, leaves first and the root last
+    ends - list of the ends of the runs of every level but the root's - run i of level l is the nodes
+    levels[l][ends[l][i - 1]:ends[l][i]], and levels[l + 1][i] is its hash
+
+    """
+
+    FANOUT = 32
+    MIN_RUN = 2
+    MAX_RUN = 4 * FANOUT
+
+    def __init__(self, blocks=('',)):
+        """
+        :param blocks: iterable of the text of each block, without the separators
+        """
+        self.levels = [[hash_block(block) for block in blocks] or [hash_block('')]]
+        self.ends = []
+        self.build_levels(0)
+
+    @property
+    def leaves(self):
+        return self.levels[0]
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def block_hashes(self):
+        """
+        :return: list of hashes of the blocks, in document order - chunks of the text bounded by its content
+        """
+        return list(self.leaves)
+
+    def replace(self, first, num_removed, blocks):
+        """
+        Replace a run of blocks.
+
+        :param first: number of the first block replaced
+        :param num_removed: number of blocks replaced
+        :param blocks: list of the text of each block put in their place
+        :return: None
+        """
+        if first < 0 or num_removed < 0 or first + num_removed > len(self.leaves):
+            raise Exception('Unable to replace blocks: {} blocks from {} are out of range'.format(num_removed, first))
+
+        num_blocks = len(self.leaves)
+        self.leaves[first:first + num_removed] = [hash_block(block) for block in blocks]
+        if not self.leaves:
+            self.leaves.append(hash_block(''))
+
+        self.update_nodes(first, first + len(blocks), len(self.leaves) - num_blocks)
+
+    def run_ends(self, nodes, start):
+        """
+        :param nodes: list of the nodes of a level
+        :param start: position of the first node of a run
+        :return: generator of the end of every run from start on - the last one ends with the level
+        """
+        fanout = self.FANOUT
+        run_start = start
+        for i in range(start, len(nodes)):
+            num_run_nodes = i + 1 - run_start
+            if num_run_nodes == self.MAX_RUN or (num_run_nodes >= self.MIN_RUN and not nodes[i][-1] % fanout):
+                yield i + 1
+                run_start = i + 1
+
+        if run_start < len(nodes):
+            yield len(nodes)
+
+    def build_levels(self, level):
+        """
+        Hash the levels above a level from scratch, up to the root.
+
+        :param level: number of the highest level that is up to date
+        :return: None
+        """
+        del self.levels[level + 1:]
+        del self.ends[level:]
+        while level == 0 or len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            ends = list(self.run_ends(nodes, 0))
+            self.ends.append(ends)
+            self.levels.append([hash_node(nodes[start:end]) for start, end in zip([0] + ends, ends)])
+            level += 1
+
+    def update_nodes(self, start, end, num_added):
+        """
+        Rehash the nodes above a run of changed nodes, level by level up to the root.
+
+        :param start: position of the first changed node on the lowest level
+        :param end: position after the last changed node on the lowest level
+        :param num_added: number of nodes the lowest level grew by - negative if it shrank
+        :return: None
+        """
+        level = 0
+        while True:
+            # A level that was the root's, and holds more than one node now
+            if level == len(self.ends):
+                self.build_levels(level)
+                return
+
+            start, end, num_added = self.update_runs(level, start, end, num_added)
+            level += 1
+
+            # A level that holds a single node is the root's
+            if len(self.levels[level]) == 1:
+                del self.levels[level + 1:]
+                del self.ends[level:]
+                return
+
+    def update_runs(self, level, start, end, num_added):
+        """
+        Re-cut the runs of a level around a run of changed nodes, and rehash them. Runs are re-cut from the start of
+        the one the change is in, until a run ends where one ended before - the runs after it are the same as before.
+
+        :param level: number of level
+        :param start: position of the first changed node
+        :param end: position after the last changed node
+        :param num_added: number of nodes the level grew by - negative if it shrank
+        :return: tuple of the start, the end and the number of nodes added of the change to the level above
+        """
+        nodes = self.levels[level]
+        ends = self.ends[level]
+        parents = self.levels[level + 1]
+
+        # Ends are still where they were before the change, and a run that ends at its start is left as is
+        first = min(bisect_right(ends, start), len(ends) - 1)
+        run_start = ends[first - 1] if first else 0
+
+        new_ends = []
+        last = len(ends) - 1
+        old = first
+        for run_end in self.run_ends(nodes, run_start):
+            new_ends.append(run_end)
+            if run_end < end:
+                continue
+
+            while old < len(ends) and ends[old] + num_added < run_end:
+                old += 1
+            if old < len(ends) and ends[old] + num_added == run_end:
+                last = old
+                break
+
+        if num_added:
+            ends[last + 1:] = [run_end + num_added for run_end in ends[last + 1:]]
+        ends[first:last + 1] = new_ends
+        parents[first:last + 1] = [hash_node(nodes[run_start:run_end])
+                                   for run_start, run_end in zip([run_start] + new_ends, new_ends)]
+
+        return first, first + len(new_ends), len(new_ends) - (last + 1 - first)
@@ -0,0 +1,159 @@
+import zlib
+import struct
+import hashlib
+import binascii
+
+# Layout of a chunked file object
+#
+#   header   - magic, number of chunks
+#   entries  - an entry per chunk - hash and length of its content - in the order the chunks make up the file
+#
+# Chunks are stored apart from file objects, compressed one by one and named by the hash of their content,
+# so versions that share most of their content share most of their chunks.
+#
+CHUNKED_MAGIC = b'MLCHUNK1'
+CHUNKED_HEADER = struct.Struct('>8sI')
+CHUNKED_ENTRY = struct.Struct('>20sI')
+
+# Files smaller than this are stored whole - chunks only pay off for large files
+CHUNKING_THRESHOLD = 1024 * 1024
+
+# Bounds and target of the size of a chunk
+MIN_CHUNK_SIZE = 8 * 1024
+AVERAGE_CHUNK_SIZE = 32 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+# Number of bytes at the end of a line that decide if a chunk ends with it
+CUT_WINDOW = 32
+
+
+def is_chunked_object(object_data):
+    """
+    :param object_data: file object, as it is stored
+    :return: Boolean representing if file object lists chunks, rather than holding the compressed file content
+    """
+    return object_data[:len(CHUNKED_MAGIC)] == CHUNKED_MAGIC
+
+
+def build_chunked_object(chunks):
+    """
+    :param chunks: list of (hash, length) tuples, hashes in hex
+    :return: file object that lists chunks
+    """
+    entries = [CHUNKED_ENTRY.pack(binascii.unhexlify(chunk_hash), length) for chunk_hash, length in chunks]
+    return CHUNKED_HEADER.pack(CHUNKED_MAGIC, len(chunks)) + b''.join(entries)
+
+
+def parse_chunked_object(object_data):
+    """
+    :param object_data: file object that lists chunks
+    :return: list of (hash, length) tuples, hashes in hex
+    """
+    if len(object_data) < CHUNKED_HEADER.size:
+        raise ValueError('Chunked file object is damaged')
+
+    magic, num_chunks = CHUNKED_HEADER.unpack_from(object_data)
+    if magic != CHUNKED_MAGIC or len(object_data) != CHUNKED_HEADER.size + num_chunks * CHUNKED_ENTRY.size:
+        raise ValueError('Chunked file object is damaged')
+
+    chunks = []
+    for i in range(num_chunks):
+        chunk_hash, length = CHUNKED_ENTRY.unpack_from(object_data, CHUNKED_HEADER.size + i * CHUNKED_ENTRY.size)
+        chunks.append((binascii.hexlify(chunk_hash).decode(), length))
+    return chunks
+
+
+def compress_chunk(chunk_data):
+    return zlib.compress(chunk_data)
+
+
+def decompress_chunk(chunk_data):
+    return zlib.decompress(chunk_data)
+
+
+def hash_chunk(chunk_data):
+    return hashlib.sha1(chunk_data).hexdigest()
+
+
+def split_into_chunks(data, base_chunks=()):
+    """
+    Split content into chunks whose bounds are set by the content itself, so an edit moves the bounds around it only.
+
+    Chunks of a base version - the one the content was edited from - are reused where they still match at the start
+    and at the end of the content. Only the region in between is searched for bounds and hashed chunk by chunk,
+    so a small edit to a large file costs little more than checking the unchanged chunks.
+
+    :param data: encoded file content
+    :param base_chunks: list of (hash, length) tuples of the base version
+    :return: list of (hash, start, end) tuples, hashes in hex
+    """
+    view = memoryview(data)
+
+    head = []
+    start = 0
+    for chunk_hash, length in base_chunks:
+        if start + length > len(data) or hash_chunk(view[start:start + length]) != chunk_hash:
+            break
+        head.append((chunk_hash, start, start + length))
+        start += length
+
+    tail = []
+    end = len(data)
+    for chunk_hash, length in reversed(base_chunks[len(head):]):
+        if end - length < start or hash_chunk(view[end - length:end]) != chunk_hash:
+            break
+        tail.append((chunk_hash, end - length, end))
+        end -= length
+    tail.reverse()
+
+    middle = []
+    for cut in chunk_cuts(data, start, end):
+        middle.append((hash_chunk(view[start:cut]), start, cut))
+        start = cut
+
+    return head + middle + tail
+
+
+def chunk_cuts(data, start, end):
+    """
+    :param data: encoded file content
+    :param start: position to start from
+    :param end: position to stop at
+    :return: list of positions where chunks between start and end end, the last one being end
+    """
+    cuts = []
+    while start < end:
+        start = next_chunk_cut(data, start, end)
+        cuts.append(start)
+    return cuts
+
+
+def next_chunk_cut(data, start, end):
+    """
+    Find where a chunk that starts at start ends. Chunks end with a line - one that is picked with a chance
+    proportional to its length, by a hash of its last bytes - so the average chunk size holds however long
+    lines are. Content without line breaks is cut at the maximum chunk size.
+
+    :param data: encoded file content
+    :param start: position the chunk starts at
+    :param end: position the content ends at
+    :return: position the chunk ends at
+    """
+    if end - start <= MIN_CHUNK_SIZE:
+        return end
+
+    limit = min(end, start + MAX_CHUNK_SIZE)
+    position = start + MIN_CHUNK_SIZE
+    line_start = max(start, data.rfind(b'\n', start, position) + 1)
+
+    while True:
+        newline = data.find(b'\n', position, limit)
+        if newline < 0:
+            return limit
+
+        line_end = newline + 1
+        line_hash = zlib.crc32(data[max(line_start, line_end - CUT_WINDOW):line_end])
+        if line_hash % AVERAGE_CHUNK_SIZE < line_end - line_start:
+            return line_end
+
+        line_start = position = line_end
@@ -0,0 +1,345 @@
+import sys
+import json
+import struct
+import heapq
+import binascii
+from array import array
+
+# Layout of a compact index - every integer little-endian
+#
+#   header    - magic, flags, number of versions, number of hashes, number of edges, number of adopted edges,
+#               root id, head id, number of metadata rows, length of labels
+#   hashes    - 20 bytes per hash - versions first, then hashes only metadata refers to
+#   offsets   - an offset per version plus one - children of version i are edges offsets[i] to offsets[i + 1]
+#   edges     - id of the child at the end of each edge
+#   adopts    - a pair of ids per adopted edge
+#   meta      - id per row, then a column of 64 bit integers per metadata column
+#   labels    - JSON list of [id, label] pairs
+#
+COMPACT_MAGIC = b'MLINDEX1'
+COMPACT_HEADER = struct.Struct('<8sIIIIIIIII')
+COMPACT_HAS_META = 1
+
+HASH_SIZE = 20
+
+INDEX_HEAD = 'head'
+INDEX_ROOT = 'root'
+INDEX_ADOPTS = 'adopts'
+INDEX_META = 'meta'
+
+META_HASHES = 'hashes'
+META_LABELS = 'labels'
+META_COLUMNS = ('created', 'size', 'lines', 'compressed')
+
+# Marks of versions in the walk for a common ancestor - the sides a version was reached from, and if a common
+# ancestor was found below it
+WALK_FROM_NODE = 1
+WALK_FROM_OTHER_NODE = 2
+WALK_FROM_BOTH = WALK_FROM_NODE | WALK_FROM_OTHER_NODE
+WALK_STALE = 4
+
+
+def is_compact_index(index_data):
+    """
+    :param index_data: decompressed index, as it is stored
+    :return: Boolean representing if index is a compact index, rather than JSON
+    """
+    return index_data[:len(COMPACT_MAGIC)] == COMPACT_MAGIC
+
+
+class CompactIndex:
+    """
+    An index with every version interned to a dense integer id. Children and parents are kept in flat arrays of ids,
+    so a history takes a few bytes per version instead of a dict entry and a list of 40 character strings, and
+    reading one from disk takes no parsing beyond copying arrays.
+
+    hashes - list of hashes, a version's id is its position
+    ids - python dict object of hash to id
+    child_offsets, child_ids - children of version i are child_ids[child_offsets[i]:child_offsets[i + 1]]
+    parent_offsets, parent_ids - same for parents, built on first use
+    ranks - rank of every version, above the versions it descends from - built on first use, if ids are not in order
+    adopts - list of (parent id, child id) tuples of edges that are not natural
+    root, head - ids of root and head
+    meta - metadata table as it is in the python dict object, None if index has none
+
+    """
+
+    def __init__(self, hashes, child_offsets, child_ids, root, head, adopts=(), meta=None):
+        self.hashes = hashes
+        self.ids = {file_hash: node for node, file_hash in enumerate(hashes)}
+        self.num_nodes = len(child_offsets) - 1
+        self.child_offsets = child_offsets
+        self.child_ids = child_ids
+        self.parent_offsets = None
+        self.parent_ids = None
+        self.ranks = None
+        self.adopts = list(adopts)
+        self.root = root
+        self.head = head
+        self.meta = meta
+
+    @classmethod
+    def from_index_dict(cls, index):
+        """
+        :param index: python dict object
+        :return: compact index with the versions of index, numbered in the order they are in index
+        """
+        hashes = [key for key in index if key not in (INDEX_ROOT, INDEX_HEAD, INDEX_ADOPTS, INDEX_META)]
+        ids = {file_hash: node for node, file_hash in enumerate(hashes)}
+
+        child_offsets = array('I', [0])
+        child_ids = array('I')
+        for file_hash in hashes:
+            child_ids.extend(ids[child_file_hash] for child_file_hash in index[file_hash])
+            child_offsets.append(len(child_ids))
+
+        adopts = [(ids[parent_file_hash], ids[file_hash]) for parent_file_hash, file_hash in index[INDEX_ADOPTS]
+                  if parent_file_hash in ids and file_hash in ids]
+        return cls(hashes, child_offsets, child_ids, ids[index[INDEX_ROOT]], ids[index[INDEX_HEAD]], adopts,
+                   index.get(INDEX_META))
+
+    def to_index_dict(self):
+        """
+        :return: python dict object with the versions of index, in the order of their ids
+        """
+        hashes = self.hashes
+        index = {
+            INDEX_ROOT: hashes[self.root],
+            INDEX_HEAD: hashes[self.head],
+            INDEX_ADOPTS: [[hashes[parent], hashes[child]] for parent, child in self.adopts]
+        }
+        for node in range(self.num_nodes):
+            index[hashes[node]] = [hashes[child] for child in self.children(node)]
+        if self.meta is not None:
+            index[INDEX_META] = self.meta
+
+        return index
+
+    def __len__(self):
+        return self.num_nodes
+
+    def children(self, node):
+        """
+        :param node: id of version
+        :return: array of ids of children of version
+        """
+        return self.child_ids[self.child_offsets[node]:self.child_offsets[node + 1]]
+
+    def num_children(self, node):
+        return self.child_offsets[node + 1] - self.child_offsets[node]
+
+    def first_child(self, node):
+        return self.child_ids[self.child_offsets[node]]
+
+    def parents(self, node):
+        """
+        :param node: id of version
+        :return: array of ids of parents of version - two for a merge
+        """
+        if self.parent_offsets is None:
+            self.build_parents()
+        return self.parent_ids[self.parent_offsets[node]:self.parent_offsets[node + 1]]
+
+    def num_parents(self, node):
+        if self.parent_offsets is None:
+            self.build_parents()
+        return self.parent_offsets[node + 1] - self.parent_offsets[node]
+
+    def build_parents(self):
+        """
+        Invert the children arrays with a counting sort - parents of each version end up in the order of their ids.
+
+        :return: None
+        """
+        counts = array('I', bytes(4 * (self.num_nodes + 1)))
+        for child in self.child_ids:
+            counts[child + 1] += 1
+        for node in range(self.num_nodes):
+            counts[node + 1] += counts[node]
+
+        parent_offsets = array('I', counts)
+        parent_ids = array('I', bytes(4 * len(self.child_ids)))
+        for node in range(self.num_nodes):
+            for child in self.children(node):
+                parent_ids[counts[child]] = node
+                counts[child] += 1
+
+        self.parent_offsets = parent_offsets
+        self.parent_ids = parent_ids
+
+    def build_ranks(self):
+        """
+        Rank versions so that every version ranks above the versions it descends from - needed only where ids are not
+        in that order already, e.g. in an index that was rebuilt or repaired.
+
+        :return: None
+        """
+        num_children_left = array('I', bytes(4 * self.num_nodes))
+        for node in range(self.num_nodes):
+            num_children_left[node] = self.num_children(node)
+
+        # Versions are ranked from the tips down, and a version once every child of it is ranked
+        ranks = array('I', bytes(4 * self.num_nodes))
+        stack = [node for node in range(self.num_nodes) if not num_children_left[node]]
+        rank = self.num_nodes
+        while stack:
+            node = stack.pop()
+            rank -= 1
+            ranks[node] = rank
+            for parent in self.parents(node):
+                num_children_left[parent] -= 1
+                if not num_children_left[parent]:
+                    stack.append(parent)
+
+        self.ranks = ranks
+
+    def common_ancestor(self, node, other_node):
+        """
+        Find the lowest common ancestor of two versions - the version to merge them against.
+
+        Both versions are walked back towards the root at once, highest ranked version first, so a version is only
+        taken off the queue once every version the walk reached it from was. A version reached from both sides is a
+        lowest common ancestor, unless it was reached from one found before - the versions above one that is found are
+        marked stale, and the walk stops once only stale versions are queued. Only the versions between the two and
+        their common ancestors are visited, however deep the history is.
+
+        Ids serve as ranks, as long as every version the walk reaches has a lower id than the version it was reached
+        from - in an index whose versions were added one at a time, they all do.
+
+        :param node: id of version
+        :param other_node: id of another version
+        :return: id of the common ancestor - one of the two versions if it descends from the other, and the one
+        recorded last if several are lowest, e.g. after criss-cross merges
+        """
+        ranks = self.ranks if self.ranks is not None else range(self.num_nodes)
+
+        marks = {node: WALK_FROM_NODE}
+        marks[other_node] = marks.get(other_node, 0) | WALK_FROM_OTHER_NODE
+        queue = [(-ranks[start], start) for start in marks]
+        heapq.heapify(queue)
+
+        found = []
+        while any(not marks[queued] & WALK_STALE for _, queued in queue):
+            _, current = heapq.heappop(queue)
+            mark = marks[current]
+            if mark & WALK_FROM_BOTH == WALK_FROM_BOTH and not mark & WALK_STALE:
+                found.append(current)
+                mark |= WALK_STALE
+
+            for parent in self.parents(current):
+                if self.ranks is None and parent >= current:
+                    self.build_ranks()
+                    return self.common_ancestor(node, other_node)
+
+                if parent in marks:
+                    marks[parent] |= mark
+                else:
+                    marks[parent] = mark
+                    heapq.heappush(queue, (-ranks[parent], parent))
+
+        return max(found, default=self.root)
+
+    def to_bytes(self):
+        """
+        :return: compact index in its stored form, uncompressed
+        """
+        hashes = list(self.hashes)
+        ids = dict(self.ids)
+
+        def intern(file_hash):
+            if file_hash not in ids:
+                ids[file_hash] = len(hashes)
+                hashes.append(file_hash)
+            return ids[file_hash]
+
+        flags = 0
+        meta_ids = array('I')
+        meta_columns = []
+        labels = []
+        if self.meta is not None:
+            flags |= COMPACT_HAS_META
+            meta_ids.extend(intern(file_hash) for file_hash in self.meta[META_HASHES])
+            meta_columns = [array('q', self.meta[column]) for column in META_COLUMNS]
+            labels = [[intern(file_hash), label] for file_hash, label in self.meta[META_LABELS].items()]
+        labels_data = json.dumps(labels, separators=(',', ':')).encode()
+
+        adopts = array('I')
+        for parent, child in self.adopts:
+            adopts.extend((parent, child))
+
+        header = COMPACT_HEADER.pack(COMPACT_MAGIC, flags, self.num_nodes, len(hashes), len(self.child_ids),
+                                     len(self.adopts), self.root, self.head, len(meta_ids), len(labels_data))
+        parts = [header, b''.join(binascii.unhexlify(file_hash) for file_hash in hashes)]
+        for column in [self.child_offsets, self.child_ids, adopts, meta_ids] + meta_columns:
+            parts.append(little_endian(column).tobytes())
+        parts.append(labels_data)
+
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, index_data):
+        """
+        :param index_data: compact index in its stored form, uncompressed
+        :return: compact index - raises ValueError if index_data is damaged
+        """
+        if len(index_data) < COMPACT_HEADER.size:
+            raise ValueError('Compact index is damaged')
+
+        (magic, flags, num_nodes, num_hashes, num_edges, num_adopts,
+         root, head, num_meta_rows, labels_length) = COMPACT_HEADER.unpack_from(index_data)
+
+        columns = len(META_COLUMNS) if flags & COMPACT_HAS_META else 0
+        expected_length = (COMPACT_HEADER.size + num_hashes * HASH_SIZE + 4 * (num_nodes + 1 + num_edges)
+                           + 8 * num_adopts + 4 * num_meta_rows + 8 * columns * num_meta_rows + labels_length)
+        if magic != COMPACT_MAGIC or len(index_data) != expected_length or num_nodes > num_hashes:
+            raise ValueError('Compact index is damaged')
+
+        view = memoryview(index_data)
+        position = COMPACT_HEADER.size
+
+        def read(typecode, count, item_size):
+            nonlocal position
+            column = array(typecode)
+            column.frombytes(view[position:position + count * item_size])
+            position += count * item_size
+            return little_endian(column)
+
+        hashes_data = binascii.hexlify(view[position:position + num_hashes * HASH_SIZE]).decode()
+        hashes = [hashes_data[i:i + 2 * HASH_SIZE] for i in range(0, len(hashes_data), 2 * HASH_SIZE)]
+        position += num_hashes * HASH_SIZE
+
+        child_offsets = read('I', num_nodes + 1, 4)
+        child_ids = read('I', num_edges, 4)
+        adopts = read('I', 2 * num_adopts, 4)
+        meta_ids = read('I', num_meta_rows, 4)
+        meta_columns = [read('q', num_meta_rows, 8) for _ in range(columns)]
+        labels = json.loads(bytes(view[position:position + labels_length]).decode())
+
+        # Every reference has to land on a version, or on a hash for metadata
+        if (child_offsets[0] != 0 or child_offsets[-1] != num_edges
+                or any(child_offsets[i] > child_offsets[i + 1] for i in range(num_nodes))
+                or any(node >= num_nodes for node in child_ids) or any(node >= num_nodes for node in adopts)
+                or any(node >= num_hashes for node in meta_ids) or any(node >= num_hashes for node, _ in labels)
+                or root >= num_nodes or head >= num_nodes):
+            raise ValueError('Compact index is damaged')
+
+        meta = None
+        if flags & COMPACT_HAS_META:
+            meta = {META_HASHES: [hashes[node] for node in meta_ids]}
+            for column, values in zip(META_COLUMNS, meta_columns):
+                meta[column] = values.tolist()
+            meta[META_LABELS] = {hashes[node]: label for node, label in labels}
+
+        return cls(hashes[:num_nodes], child_offsets, child_ids, root, head, zip(adopts[::2], adopts[1::2]), meta)
+
+
+def little_endian(column):
+    """
+    :param column: array object
+    :return: column, or a copy of it with its bytes swapped on big-endian machines - the stored form is always
+    little-endian
+    """
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
@@ -0,0 +1,197 @@
+import os
+import time
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal
+
+from utils.repository_control import get_hash, repo_exists, open_repo
+
+
+class FileWatcher(QObject):
+    """
+    A class to represent a watcher that picks up edits made to tracked files outside of the application.
+
+    Change notifications of a file are debounced, so that a burst of writes (say, from a build tool) is folded
+    into a single version. Files are read and hashed in the repo worker pool.
+
+    Open files are reported back through the open_file_changed signal, as their tab decides what to do with
+    the new content. Other tracked files in a watched directory are recorded in their repo right away.
+
+    """
+
+    # Signals
+    open_file_changed = pyqtSignal(str, str, str)
+
+    # Constants
+    DEBOUNCE_INTERVAL = 500
+    MAX_DEBOUNCE_DELAY = 3000
+
+    # Open files are read in a queue of their own, so that a read never cancels the callback of a job on the repo
+    READ_QUEUE = '{}:reads'
+
+    def __init__(self, repository_worker_pool):
+        super().__init__()
+
+        self.repository_worker_pool = repository_worker_pool
+        self.watcher = QFileSystemWatcher()
+
+        self.open_files = set()
+        self.directory = None
+        self.directory_files = set()
+
+        # Debounce timers of files with pending changes, and the time their first pending change came in
+        self.timers = {}
+        self.first_change_times = {}
+
+        self.watcher.fileChanged.connect(self.handle_file_changed)
+        self.watcher.directoryChanged.connect(self.handle_directory_changed)
+
+    def watch_file(self, file_path):
+        """
+        Watch a file that is open in a tab.
+
+        :param file_path: full file location (inclusive of name and extension)
+        :return: None
+        """
+        self.open_files.add(file_path)
+        self.add_path(file_path)
+
+    def unwatch_file(self, file_path):
+        self.open_files.discard(file_path)
+        if file_path not in self.directory_files:
+            self.remove_path(file_path)
+
+    def watch_directory(self, directory):
+        """
+        Watch every tracked file in a directory. Files are checked for repos in the worker pool.
+
+        :param directory: location of directory
+        :return: None
+        """
+        self.unwatch_directory()
+        self.directory = directory
+        self.add_path(directory)
+        self.repository_worker_pool.submit(directory, tracked_files_in_directory, directory,
+                                           callback=self.handle_directory_scanned, latest_only=True)
+
+    def unwatch_directory(self):
+        if not self.directory:
+            return
+
+        self.remove_path(self.directory)
+        for file_path in self.directory_files - self.open_files:
+            self.remove_path(file_path)
+
+        self.directory = None
+        self.directory_files = set()
+
+    def add_path(self, path):
+        if os.path.exists(path) and path not in self.watcher.files() + self.watcher.directories():
+            self.watcher.addPath(path)
+
+    def remove_path(self, path):
+        if path in self.watcher.files() + self.watcher.directories():
+            self.watcher.removePath(path)
+
+    def schedule_ingest(self, file_path):
+        """
+        (Re)start the debounce timer of a file - unless its changes have been pending for too long already.
+
+        :param file_path: full file location (inclusive of name and extension)
+        :return: None
+        """
+        now = time.monotonic()
+        first_change_time = self.first_change_times.setdefault(file_path, now)
+
+        timer = self.timers.get(file_path)
+        if not timer:
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda: self.ingest(file_path))
+            self.timers[file_path] = timer
+        elif timer.isActive() and (now - first_change_time) * 1000 > self.MAX_DEBOUNCE_DELAY:
+            return
+
+        timer.start(self.DEBOUNCE_INTERVAL)
+
+    def ingest(self, file_path):
+        self.first_change_times.pop(file_path, None)
+        self.timers.pop(file_path).deleteLater()
+
+        if not os.path.exists(file_path):
+            return
+
+        if file_path in self.open_files:
+            self.repository_worker_pool.submit(self.READ_QUEUE.format(file_path), read_file_and_hash, file_path,
+                                               callback=self.handle_open_file_read, latest_only=True)
+        elif file_path in self.directory_files:
+            self.repository_worker_pool.submit(file_path, ingest_tracked_file, file_path)
+
+    # Slot Function
+    def handle_file_changed(self, file_path):
+        # Files replaced by a rename (which is how most editors save) drop out of the watch list
+        self.add_path(file_path)
+        self.schedule_ingest(file_path)
+
+    # Slot Function
+    def handle_directory_changed(self, directory):
+        if directory != self.directory:
+            return
+
+        self.repository_worker_pool.submit(directory, tracked_files_in_directory, directory,
+                                           callback=self.handle_directory_scanned, latest_only=True)
+
+    # Slot Function
+    def handle_directory_scanned(self, file_paths):
+        if not self.directory:
+            return
+
+        for file_path in file_paths - self.directory_files:
+            self.add_path(file_path)
+            # Files new to the watch list may carry content their repo has not seen yet
+            self.schedule_ingest(file_path)
+
+        for file_path in self.directory_files - file_paths - self.open_files:
+            self.remove_path(file_path)
+
+        self.directory_files = file_paths
+
+    # Slot Function
+    def handle_open_file_read(self, result):
+        file_path, file_hash, file_data = result
+        if file_path in self.open_files:
+            self.open_file_changed.emit(file_path, file_hash, file_data)
+
+
+def read_file_and_hash(file_path):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :return: tuple of file path, hash of file content and file content
+    """
+    with open(file_path, 'r') as f:
+        file_data = f.read()
+    return file_path, get_hash(file_data), file_data
+
+
+def ingest_tracked_file(file_path):
+    """
+    Record the content of a tracked file in its repo.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: None
+    """
+    if not repo_exists(file_path):
+        return
+
+    _, _, file_data = read_file_and_hash(file_path)
+    open_repo(file_path, file_data)
+
+
+def tracked_files_in_directory(directory):
+    """
+    :param directory: location of directory
+    :return: set of full file locations of files in directory that have a repo
+    """
+    file_paths = set()
+    for entry in os.scandir(directory):
+        if entry.is_file() and repo_exists(entry.path):
+            file_paths.add(entry.path)
+    return file_paths
@@ -0,0 +1,42 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A class to represent a bounded mapping that evicts the least recently used entry once it is full.
+
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """
+        :param key: key
+        :param default: value returned when key is not cached
+        :return: cached value, marked as the most recently used
+        """
+        if key not in self.entries:
+            return default
+
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key, default)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,114 @@
+from difflib import SequenceMatcher
+
+# Markers around the two sides of a conflict, as diff3 writes them
+CONFLICT_START = '<<<<<<< {}\n'
+CONFLICT_BASE = '||||||| base\n'
+CONFLICT_SEPARATOR = '=======\n'
+CONFLICT_END = '>>>>>>> {}\n'
+
+
+def merge_text(base, ours, theirs, ours_name='ours', theirs_name='theirs'):
+    """
+    Line-based three-way merge. Lines changed on one side only are taken from that side, lines changed the same
+    way on both sides are taken once, and lines changed differently on both sides are kept as a conflict -
+    both sides and the base in between markers.
+
+    :param base: file content of the common ancestor
+    :param ours: file content of one side
+    :param theirs: file content of the other side
+    :param ours_name: name of one side in conflict markers
+    :param theirs_name: name of the other side in conflict markers
+    :return: tuple of merged file content and number of conflicts
+    """
+    base_lines = base.splitlines(True)
+    our_lines = ours.splitlines(True)
+    their_lines = theirs.splitlines(True)
+
+    merged = []
+    conflicts = 0
+    for base_region, our_region, their_region in merge_regions(base_lines, our_lines, their_lines):
+        if our_region == their_region or their_region == base_region:
+            merged.extend(our_region)
+        elif our_region == base_region:
+            merged.extend(their_region)
+        else:
+            conflicts += 1
+            merged.append(CONFLICT_START.format(ours_name))
+            merged.extend(ensure_newline(our_region))
+            merged.append(CONFLICT_BASE)
+            merged.extend(ensure_newline(base_region))
+            merged.append(CONFLICT_SEPARATOR)
+            merged.extend(ensure_newline(their_region))
+            merged.append(CONFLICT_END.format(theirs_name))
+
+    return ''.join(merged), conflicts
+
+
+def merge_regions(base, ours, theirs):
+    """
+    Split three versions into aligned regions - alternately ones that are unchanged on both sides, and ones that
+    changed on at least one side.
+
+    :param base: list of lines of the common ancestor
+    :param ours: list of lines of one side
+    :param theirs: list of lines of the other side
+    :return: list of (base lines, our lines, their lines) tuples, in order
+    """
+    regions = []
+    base_start = our_start = their_start = 0
+    for base_match, our_match, their_match, length in stable_regions(base, ours, theirs):
+        if base_match > base_start or our_match > our_start or their_match > their_start:
+            regions.append((base[base_start:base_match], ours[our_start:our_match], theirs[their_start:their_match]))
+        if length:
+            regions.append((base[base_match:base_match + length], ) * 3)
+
+        base_start = base_match + length
+        our_start = our_match + length
+        their_start = their_match + length
+
+    return regions
+
+
+def stable_regions(base, ours, theirs):
+    """
+    Find the runs of base lines that both sides kept, where they are in each version.
+
+    :param base: list of lines of the common ancestor
+    :param ours: list of lines of one side
+    :param theirs: list of lines of the other side
+    :return: list of (base position, our position, their position, length) tuples, ending with an empty run at the
+    end of every version
+    """
+    our_blocks = SequenceMatcher(None, base, ours, autojunk=False).get_matching_blocks()
+    their_blocks = SequenceMatcher(None, base, theirs, autojunk=False).get_matching_blocks()
+
+    regions = []
+    i = j = 0
+    while i < len(our_blocks) and j < len(their_blocks):
+        our_base, our_match, our_length = our_blocks[i]
+        their_base, their_match, their_length = their_blocks[j]
+
+        # Overlap of the two runs within base
+        start = max(our_base, their_base)
+        end = min(our_base + our_length, their_base + their_length)
+        if start < end:
+            regions.append((start, our_match + start - our_base, their_match + start - their_base, end - start))
+
+        # Move on from whichever run ends first
+        if our_base + our_length < their_base + their_length:
+            i += 1
+        else:
+            j += 1
+
+    regions.append((len(base), len(ours), len(theirs), 0))
+    return regions
+
+
+def ensure_newline(lines):
+    """
+    :param lines: list of lines
+    :return: list of lines, the last one ending with a newline so that a marker after it starts a line of its own
+    """
+    if lines and not lines[-1].endswith('\n'):
+        return lines[:-1] + [lines[-1] + '\n']
+    return lines
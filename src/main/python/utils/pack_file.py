@@ -0,0 +1,245 @@
+import os
+import mmap
+import struct
+import threading
+import binascii
+from contextlib import contextmanager
+
+from utils.atomic_write import atomic_open
+
+# Layout of a pack file
+#
+#   header   - magic, length of index, number of objects
+#   index    - repo index, as it is stored in a repo
+#   objects  - file objects, as they are stored in a repo, back to back in the order they were added
+#   table    - an entry per object - hash, offset and length - sorted by hash
+#   footer   - offset of table, number of objects, magic
+#
+PACK_MAGIC = b'MLPACK01'
+PACK_HEADER = struct.Struct('>8sQI')
+PACK_ENTRY = struct.Struct('>20sQQ')
+PACK_FOOTER = struct.Struct('>QI8s')
+
+# Readers of packs in use, by location - a pack is mapped once and shared by every thread that reads from it.
+# A reader that is dropped, e.g. as its pack is replaced, is closed once the last thread reading from it is done.
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+class PackWriter:
+    """
+    A class to represent a pack that is being streamed out. Objects are written as they are added, and the offset
+    table once the pack is closed - so a pack never has to fit in memory.
+
+    """
+
+    def __init__(self, stream, index_data, num_objects):
+        """
+        :param stream: binary file object to write to
+        :param index_data: repo index, as it is stored in a repo
+        :param num_objects: number of objects that will be added
+        """
+        self.stream = stream
+        self.num_objects = num_objects
+        self.entries = []
+
+        self.stream.write(PACK_HEADER.pack(PACK_MAGIC, len(index_data), num_objects))
+        self.stream.write(index_data)
+        self.offset = PACK_HEADER.size + len(index_data)
+
+    def add_object(self, file_hash, object_data):
+        """
+        :param file_hash: hash of file content
+        :param object_data: file object, as it is stored in a repo
+        :return: None
+        """
+        self.stream.write(object_data)
+        self.entries.append((binascii.unhexlify(file_hash), self.offset, len(object_data)))
+        self.offset += len(object_data)
+
+    def close(self):
+        if len(self.entries) != self.num_objects:
+            raise Exception('Unable to write pack: Expected {} objects, got {}'.format(self.num_objects,
+                                                                                       len(self.entries)))
+
+        table_offset = self.offset
+        for entry in sorted(self.entries):
+            self.stream.write(PACK_ENTRY.pack(*entry))
+        self.stream.write(PACK_FOOTER.pack(table_offset, self.num_objects, PACK_MAGIC))
+
+
+def write_pack(pack_path, index_data, file_hashes, object_data):
+    """
+    Write a pack file in one go. Objects may be read from the pack being replaced - its shared reader is dropped
+    once they are all written, before the new pack takes its place.
+
+    :param pack_path: location of pack file to write
+    :param index_data: repo index, as it is stored in a repo
+    :param file_hashes: hashes of file objects to write, oldest first
+    :param object_data: function that returns a file object, as it is stored in a repo, given its hash
+    :return: None
+    """
+    with atomic_open(pack_path) as f:
+        pack_writer = PackWriter(f, index_data, len(file_hashes))
+        for file_hash in file_hashes:
+            pack_writer.add_object(file_hash, object_data(file_hash))
+        pack_writer.close()
+        forget_pack_reader(pack_path)
+
+
+class PackReader:
+    """
+    A class to represent a pack that is read through a memory map. Objects are found by binary search over the
+    offset table, so only the pages that are actually read get loaded.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Bookkeeping of the shared reader of a pack - threads reading from it, and if it was dropped
+        self.num_users = 0
+        self.dropped = False
+
+        self.file = open(path, 'rb')
+
+        try:
+            size = os.fstat(self.file.fileno()).st_size
+            if size < PACK_HEADER.size + PACK_FOOTER.size:
+                raise Exception('Unable to read pack: File is too short')
+
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            magic, self.index_length, self.num_objects = PACK_HEADER.unpack_from(self.map, 0)
+            self.table_offset, num_objects, footer_magic = PACK_FOOTER.unpack_from(self.map, size - PACK_FOOTER.size)
+            if magic != PACK_MAGIC or footer_magic != PACK_MAGIC or num_objects != self.num_objects:
+                raise Exception('Unable to read pack: Not a pack file or truncated')
+            if self.table_offset + self.num_objects * PACK_ENTRY.size + PACK_FOOTER.size != size:
+                raise Exception('Unable to read pack: Offset table is damaged')
+        except BaseException:
+            self.close()
+            raise
+
+    def __contains__(self, file_hash):
+        return self.find(file_hash) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'map', None):
+            self.map.close()
+        self.file.close()
+
+    def index_data(self):
+        return self.map[PACK_HEADER.size:PACK_HEADER.size + self.index_length]
+
+    def entry(self, i):
+        return PACK_ENTRY.unpack_from(self.map, self.table_offset + i * PACK_ENTRY.size)
+
+    def find(self, file_hash):
+        """
+        :param file_hash: hash of file content
+        :return: tuple of offset and length of object, None if pack does not have it
+        """
+        try:
+            key = binascii.unhexlify(file_hash)
+        except (binascii.Error, ValueError):
+            return None
+
+        low, high = 0, self.num_objects
+        while low < high:
+            mid = (low + high) // 2
+            entry_key, offset, length = self.entry(mid)
+            if entry_key < key:
+                low = mid + 1
+            elif entry_key > key:
+                high = mid
+            else:
+                return offset, length
+
+        return None
+
+    def object_data(self, file_hash):
+        """
+        :param file_hash: hash of file content
+        :return: file object, as it is stored in a repo - None if pack does not have it
+        """
+        location = self.find(file_hash)
+        if location is None:
+            return None
+
+        offset, length = location
+        return self.map[offset:offset + length]
+
+    def object_length(self, file_hash):
+        location = self.find(file_hash)
+        return location[1] if location else None
+
+    def file_hashes(self):
+        """
+        :return: list of hashes of all objects, in the order they were added to the pack
+        """
+        entries = sorted((self.entry(i) for i in range(self.num_objects)), key=lambda entry: entry[1])
+        return [binascii.hexlify(entry_key).decode() for entry_key, _, _ in entries]
+
+
+@contextmanager
+def open_pack_reader(path):
+    """
+    Lend out the shared reader of a pack for the duration of a block. A pack that was replaced on disk since it was
+    last read is mapped anew.
+
+    :param path: location of pack file
+    :return: PackReader
+    """
+    stat = os.stat(path)
+    identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    with _readers_lock:
+        cached = _readers.get(path)
+        if cached and cached[0] == identity:
+            reader = cached[1]
+        else:
+            reader = PackReader(path)
+            _readers[path] = (identity, reader)
+            if cached:
+                drop_pack_reader(cached[1])
+        reader.num_users += 1
+
+    try:
+        yield reader
+    finally:
+        with _readers_lock:
+            reader.num_users -= 1
+            if reader.dropped and not reader.num_users:
+                reader.close()
+
+
+def forget_pack_reader(path):
+    """
+    Drop the shared reader of a pack, e.g. before the pack is replaced or removed.
+
+    :param path: location of pack file
+    :return: None
+    """
+    with _readers_lock:
+        cached = _readers.pop(path, None)
+        if cached:
+            drop_pack_reader(cached[1])
+
+
+def drop_pack_reader(reader):
+    """
+    Close a shared reader that is no longer handed out - right away, or once the last thread reading from it is
+    done. Called with _readers_lock held.
+
+    :param reader: PackReader
+    :return: None
+    """
+    reader.dropped = True
+    if not reader.num_users:
+        reader.close()
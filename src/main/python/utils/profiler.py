@@ -0,0 +1,171 @@
+import os
+import json
+import threading
+from time import perf_counter
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from utils.atomic_write import atomic_write
+
+# Set to a file location to profile from start-up - a trace is written there when the application closes
+PROFILE_TRACE_PATH = os.environ.get('MAROON_LINES_PROFILE')
+
+PROFILING_ENABLED = bool(PROFILE_TRACE_PATH)
+
+# Categories of spans
+CATEGORY_REPO = 'repo'
+CATEGORY_TIMELINE = 'timeline'
+CATEGORY_HASH = 'hash'
+CATEGORY_EDITOR = 'editor'
+
+# Spans kept for the trace - older ones are dropped, statistics keep counting them
+MAX_TRACE_EVENTS = 100000
+
+# Statistics columns of a span
+STAT_COUNT = 'count'
+STAT_TOTAL = 'total_ms'
+STAT_LAST = 'last_ms'
+STAT_MAX = 'max_ms'
+
+lock = threading.Lock()
+origin = perf_counter()
+events = deque(maxlen=MAX_TRACE_EVENTS)
+statistics = {}
+thread_names = {}
+
+
+def enable_profiling(enabled):
+    """
+    Start or stop recording spans. Spans recorded so far are kept.
+
+    :param enabled: Boolean representing if spans are recorded
+    :return: None
+    """
+    global PROFILING_ENABLED
+    PROFILING_ENABLED = enabled
+
+
+def profiling_enabled():
+    return PROFILING_ENABLED
+
+
+def record_span(name, category, start, end):
+    """
+    :param name: name of the span, e.g. the function it times
+    :param category: one of the CATEGORY constants
+    :param start: perf_counter reading at the start of the span
+    :param end: perf_counter reading at the end of the span
+    :return: None
+    """
+    duration = (end - start) * 1000
+    thread = threading.current_thread()
+
+    with lock:
+        events.append((name, category, start, end, thread.ident))
+        thread_names[thread.ident] = thread.name
+
+        stats = statistics.get(name)
+        if stats is None:
+            stats = statistics[name] = {STAT_COUNT: 0, STAT_TOTAL: 0.0, STAT_LAST: 0.0, STAT_MAX: 0.0}
+        stats[STAT_COUNT] += 1
+        stats[STAT_TOTAL] += duration
+        stats[STAT_LAST] = duration
+        stats[STAT_MAX] = max(stats[STAT_MAX], duration)
+
+
+@contextmanager
+def profile_span(name, category):
+    """
+    Time a block of code, e.g.
+
+        with profile_span('render', CATEGORY_TIMELINE):
+            ...
+
+    """
+    if not PROFILING_ENABLED:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, category, start, perf_counter())
+
+
+def profiled(category, name=None):
+    """
+    Time every call of a function. Costs a flag check per call while profiling is off.
+
+    :param category: one of the CATEGORY constants
+    :param name: name of the span - qualified name of the function if not given
+    :return: decorator
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILING_ENABLED:
+                return function(*args, **kwargs)
+
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_span(span_name, category, start, perf_counter())
+
+        return wrapper
+
+    return decorator
+
+
+def span_statistics():
+    """
+    :return: list of (name, python dict object of statistics) tuples, most total time first
+    """
+    with lock:
+        rows = [(name, dict(stats)) for name, stats in statistics.items()]
+
+    rows.sort(key=lambda row: row[1][STAT_TOTAL], reverse=True)
+    return rows
+
+
+def reset_profile():
+    with lock:
+        events.clear()
+        statistics.clear()
+
+
+def build_trace():
+    """
+    :return: python dict object of the spans recorded, in Chrome trace format - loads in chrome://tracing and Perfetto
+    """
+    pid = os.getpid()
+    with lock:
+        spans = list(events)
+        names = dict(thread_names)
+
+    trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+                    for tid, thread_name in names.items()]
+    for name, category, start, end, tid in spans:
+        trace_events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - origin) * 1000000, 1),
+            'dur': round((end - start) * 1000000, 1),
+            'pid': pid,
+            'tid': tid
+        })
+
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def write_trace(trace_path):
+    """
+    :param trace_path: location of the JSON trace file to write
+    :return: None
+    """
+    atomic_write(trace_path, json.dumps(build_trace()))
@@ -0,0 +1,176 @@
+import os
+import json
+import zlib
+
+from utils.atomic_write import atomic_write
+from utils import repository_control
+from utils.profiler import profiled, CATEGORY_REPO
+from utils.repository_control import APP_DATA_LOCATION, APP_NAME, META_HASHES, META_CREATED, META_COMPRESSED, \
+    META_LABELS, get_hash, repo_id, repo_backend, repo_index_data, decode_compact_index_data
+
+# Summaries of the tracked files under a directory are cached a file per directory, named by the hash of its path
+SUMMARIES = 'summaries'
+SUMMARY_FORMAT = 1
+
+# Columns of a summary - a list per column, a row per tracked file
+SUMMARY_FILE_PATHS = 'file_paths'
+SUMMARY_VERSIONS = 'versions'
+SUMMARY_LAST_CHANGE = 'last_change'
+SUMMARY_SIZE = 'size'
+SUMMARY_HEAD = 'head'
+SUMMARY_FINGERPRINT = 'fingerprint'
+SUMMARY_COLUMNS = (SUMMARY_FILE_PATHS, SUMMARY_VERSIONS, SUMMARY_LAST_CHANGE, SUMMARY_SIZE, SUMMARY_HEAD,
+                   SUMMARY_FINGERPRINT)
+
+
+def project_summaries_path():
+    """
+    :return: Location of the folder that holds the cached summaries of directories - in string format
+    """
+    # Read at call time, as the setting can be switched off after import, e.g. by the benchmark
+    if repository_control.USE_APP_DATA_LOCATION:
+        return os.path.join(APP_DATA_LOCATION, APP_NAME, SUMMARIES)
+    else:
+        return SUMMARIES
+
+
+def project_summary_path(directory):
+    """
+    :param directory: location of directory
+    :return: location of the cached summary of directory
+    """
+    return os.path.join(project_summaries_path(), get_hash(os.path.abspath(directory)))
+
+
+def build_project_summary():
+    """
+    Create an empty summary.
+
+    :return: python dict object with a list per column
+    """
+    return {column: [] for column in SUMMARY_COLUMNS}
+
+
+@profiled(CATEGORY_REPO)
+def read_project_summary(directory):
+    """
+    Return the cached summary of a directory, as it was when the directory was last indexed.
+
+    :param directory: location of directory
+    :return: python dict object - empty if directory was never indexed, or its summary cannot be read
+    """
+    try:
+        with open(project_summary_path(directory), 'rb') as f:
+            summary = json.loads(zlib.decompress(f.read()).decode())
+    except (OSError, ValueError, zlib.error):
+        return build_project_summary()
+
+    if summary.get('format') != SUMMARY_FORMAT:
+        return build_project_summary()
+
+    return {column: summary[column] for column in SUMMARY_COLUMNS}
+
+
+@profiled(CATEGORY_REPO)
+def write_project_summary(directory, summary):
+    """
+    :param directory: location of directory
+    :param summary: python dict object with a list per column
+    :return: None
+    """
+    os.makedirs(project_summaries_path(), exist_ok=True)
+
+    summary_data = dict(summary, format=SUMMARY_FORMAT)
+    atomic_write(project_summary_path(directory), zlib.compress(json.dumps(summary_data).encode()))
+
+
+@profiled(CATEGORY_REPO)
+def tracked_files_under_directory(directory):
+    """
+    Walk a directory and its sub-directories for files that have a repo. Repos are listed once up front, so that
+    checking a file costs a hash of its path rather than a lookup in storage.
+
+    :param directory: location of directory
+    :return: list of full file locations, sorted
+    """
+    repos = set(repo_backend().repos())
+
+    file_paths = []
+    for root, directories, file_names in os.walk(directory):
+        # Hidden directories - e.g. .git - hold no files worth browsing
+        directories[:] = [name for name in directories if not name.startswith('.')]
+        for file_name in file_names:
+            file_path = os.path.join(root, file_name)
+            if repo_id(file_path) in repos:
+                file_paths.append(file_path)
+
+    file_paths.sort()
+    return file_paths
+
+
+@profiled(CATEGORY_REPO)
+def summarize_repos(file_paths, fingerprints):
+    """
+    Summarize the repos of a batch of files. A repo whose index did not change since it was last summarized is
+    left out - its index is read, but not decompressed or parsed.
+
+    :param file_paths: list of full file locations
+    :param fingerprints: python dict object of file location to fingerprint of its last summary
+    :return: list of summary rows, a tuple of values in the order of SUMMARY_COLUMNS each
+    """
+    rows = []
+    for file_path in file_paths:
+        # A repo that cannot be summarized is left out - it must not cost the rest of the batch its summary
+        try:
+            row = summarize_repo(file_path, fingerprints.get(file_path))
+        except (OSError, ValueError, zlib.error):
+            continue
+
+        if row:
+            rows.append(row)
+
+    return rows
+
+
+def summarize_repo(file_path, fingerprint):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :param fingerprint: fingerprint of the last summary of repo, None if it was never summarized
+    :return: summary row, a tuple of values in the order of SUMMARY_COLUMNS - None if index did not change
+    """
+    index_data = repo_index_data(file_path)
+    last_fingerprint, fingerprint = fingerprint, zlib.crc32(index_data)
+    if fingerprint == last_fingerprint:
+        return None
+
+    index = decode_compact_index_data(index_data)
+
+    last_change = 0
+    size = 0
+    if index.meta is not None:
+        last_change = max(index.meta[META_CREATED], default=0)
+        size = sum(index.meta[META_COMPRESSED])
+
+    return file_path, len(index), last_change, size, index.hashes[index.head], fingerprint
+
+
+@profiled(CATEGORY_REPO)
+def repo_versions(file_path):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :return: tuple of the hash of head and a list of (hash, time saved, label) tuples of every version, newest first
+    """
+    index = decode_compact_index_data(repo_index_data(file_path))
+
+    created = {}
+    labels = {}
+    if index.meta is not None:
+        created = dict(zip(index.meta[META_HASHES], index.meta[META_CREATED]))
+        labels = index.meta[META_LABELS]
+
+    versions = [(file_hash, created.get(file_hash, 0), labels.get(file_hash)) for file_hash in index.hashes]
+
+    # Newest first - versions saved within the same second end up latest recorded first
+    versions.sort(key=lambda version: version[1])
+    versions.reverse()
+    return index.hashes[index.head], versions
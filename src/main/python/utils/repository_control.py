@@ -2,32 +2,79 @@ import hashlib
 import os
 import zlib
 import json
-import shutil
+import time
+import errno
 from PyQt5.QtCore import QStandardPaths
 from IPython import embed
 
+from utils.pack_file import PackReader, write_pack
+from utils.merge import merge_text
+from utils.compact_index import CompactIndex, is_compact_index
+from utils.profiler import profiled, CATEGORY_REPO, CATEGORY_HASH
+from utils.chunked_object import CHUNKING_THRESHOLD, is_chunked_object, build_chunked_object, \
+    parse_chunked_object, split_into_chunks, compress_chunk, decompress_chunk
+from utils.storage_backend import LooseBackend, MemoryBackend
+from utils.sqlite_backend import SQLiteBackend
+
 USE_APP_DATA_LOCATION = True
 
+# Where repos are kept - a directory tree per repo ('loose'), one SQLite database for all of them ('sqlite'),
+# or nowhere but in memory ('memory')
+STORAGE_LOOSE = 'loose'
+STORAGE_SQLITE = 'sqlite'
+STORAGE_MEMORY = 'memory'
+STORAGE_BACKEND = os.environ.get('MAROON_LINES_STORAGE', STORAGE_LOOSE)
+
 APP_NAME = 'Maroon Lines'
 APP_DATA_LOCATION = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
 
 REPOS = 'repos'
-KEY = 'key'
-INDEX = 'index'
-OBJECTS = 'objects'
+DATABASE = 'repos.sqlite3'
 
 INDEX_HEAD = 'head'
 INDEX_ROOT = 'root'
 INDEX_ADOPTS = 'adopts'
-
-
+INDEX_META = 'meta'
+
+# Metadata table - one column per attribute, and a row per version in the order versions were recorded.
+# Labels are few and far between, so they are kept by hash instead.
+META_HASHES = 'hashes'
+META_CREATED = 'created'
+META_SIZE = 'size'
+META_LINES = 'lines'
+META_COMPRESSED = 'compressed'
+META_LABELS = 'labels'
+META_LABEL = 'label'
+META_COLUMNS = (META_CREATED, META_SIZE, META_LINES, META_COMPRESSED)
+
+# Row of every version in the metadata table, keyed by hash - derived from the hashes column, and never stored
+META_ROWS = 'rows'
+
+REPORT_CORRUPT_OBJECTS = 'corrupt_objects'
+REPORT_MISSING_OBJECTS = 'missing_objects'
+REPORT_TEMP_FILES = 'temp_files'
+REPORT_INDEX_DAMAGED = 'index_damaged'
+
+# Previews - a small sidecar per file object holding the start of the file and its size, for hover-peeks
+PREVIEW_LINES = 15
+PREVIEW_LINE_LENGTH = 100
+PREVIEW_PREFIX = 'prefix'
+PREVIEW_NUM_LINES = 'lines'
+PREVIEW_SIZE = 'size'
+
+# Storage backends in use, by kind and location - and the one that overrides configuration, if any
+_storage_backends = {}
+_repo_backend = None
+
+
+@profiled(CATEGORY_REPO)
 def init_repo(file_path, file_data):
     """
     Create a new repo to kickstart tracking for a new file.
 
     :param file_path: full file location (inclusive of name and extension)
     :param file_data: file content
-    :return: None
+    :return: tuple of hash and metadata of the first version
     """
     if not os.path.exists(file_path):
         raise Exception('Unable to initialise repo: Invalid path given')
@@ -35,12 +82,18 @@ def init_repo(file_path, file_data):
     if repo_exists(file_path):
         raise Exception('Unable to initialise repo: Repo already exists')
 
-    os.makedirs(repo_file_objects_path(file_path))
+    file_hash = get_hash(file_data)
+    index = build_index_dict(file_data)
 
     # Three ingredients needed for a new repo directory
-    write_repo_key(file_path)
-    write_repo_file_object(file_path, file_data)
-    write_repo_index(file_path, build_index_dict(file_data))
+    with repo_transaction():
+        make_repo(file_path)
+        write_repo_key(file_path)
+        file_meta = write_repo_file_object(file_path, file_data)
+        add_file_meta_to_index_dict(index, file_hash, file_meta)
+        write_repo_index(file_path, index)
+
+    return file_hash, file_meta
 
 
 def copy_repo(old_file_path, new_file_path):
@@ -57,13 +110,12 @@ def copy_repo(old_file_path, new_file_path):
     if old_file_path == new_file_path:
         return
 
-    # Remove any lingering repo in the new location
-    remove_repo(new_file_path)
-
-    shutil.copytree(repo_path(old_file_path), repo_path(new_file_path))
+    backend = repo_backend()
+    with backend.transaction():
+        backend.copy_repo(repo_id(old_file_path), repo_id(new_file_path))
 
-    # Update repo key in the new location
-    write_repo_key(new_file_path)
+        # Update repo key in the new location
+        write_repo_key(new_file_path)
 
 
 def move_repo(old_file_path, new_file_path):
@@ -74,8 +126,16 @@ def move_repo(old_file_path, new_file_path):
     :param new_file_path: full file location (inclusive of name and extension)
     :return: None
     """
-    copy_repo(old_file_path, new_file_path)
-    remove_repo(old_file_path)
+    if not old_file_path or not new_file_path:
+        raise Exception('Unable to move repo: Invalid path/s given')
+
+    if old_file_path == new_file_path:
+        return
+
+    backend = repo_backend()
+    with backend.transaction():
+        backend.move_repo(repo_id(old_file_path), repo_id(new_file_path))
+        write_repo_key(new_file_path)
 
 
 def remove_repo(file_path):
@@ -88,7 +148,7 @@ def remove_repo(file_path):
     if not repo_exists(file_path):
         return
 
-    shutil.rmtree(repo_path(file_path))
+    repo_backend().remove_repo(repo_id(file_path))
 
 
 def rebuilt_repo(file_path, file_data):
@@ -97,10 +157,10 @@ def rebuilt_repo(file_path, file_data):
 
     :param file_path: full file location (inclusive of name and extension)
     :param file_data: file contents
-    :return: None
+    :return: tuple of hash and metadata of the first version
     """
     remove_repo(file_path)
-    init_repo(file_path, file_data)
+    return init_repo(file_path, file_data)
 
 
 def repo_exists(file_path):
@@ -110,103 +170,229 @@ def repo_exists(file_path):
     :param file_path: full file location (inclusive of name and extension)
     :return: Boolean representing existence of repo
     """
-    return os.path.exists(repo_path(file_path))
+    return repo_backend().repo_exists(repo_id(file_path))
 
 
-def repo_path(file_path):
+def make_repo(file_path):
     """
-    Return repo location.
+    Create the empty shell of a repo.
 
     :param file_path: full file location (inclusive of name and extension)
-    :return: Location of repo in string format
+    :return: None
     """
-    file_path_hash = get_hash(file_path)
+    repo_backend().create_repo(repo_id(file_path))
+
 
+def repo_id(file_path):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :return: hash of file_path, which names the repo of the file
+    """
+    return get_hash(file_path)
+
+
+def repos_path():
+    """
+    :return: Location of the folder that holds all repos kept as loose files - in string format
+    """
     if USE_APP_DATA_LOCATION:
-        return os.path.join(APP_DATA_LOCATION, APP_NAME, REPOS, file_path_hash[0:2], file_path_hash[2:])
+        return os.path.join(APP_DATA_LOCATION, APP_NAME, REPOS)
     else:
-        return os.path.join(REPOS, file_path_hash[0:2], file_path_hash[2:])
+        return REPOS
 
 
-def repo_key_path(file_path):
+def repo_database_path():
+    """
+    :return: Location of the SQLite database that holds all repos kept in SQLite - in string format
     """
-    Return location of a file named 'key' in repo directory.
+    if USE_APP_DATA_LOCATION:
+        return os.path.join(APP_DATA_LOCATION, APP_NAME, DATABASE)
+    else:
+        return DATABASE
 
-    :param file_path: full file location (inclusive of name and extension)
-    :return: Location of 'key' file in repo directory - in string format
+
+def repo_backend():
     """
-    return os.path.join(repo_path(file_path), KEY)
+    Return the storage backend that holds all repos - the one set by set_repo_backend or, failing that,
+    the one STORAGE_BACKEND names.
+
+    :return: StorageBackend
+    """
+    if _repo_backend is not None:
+        return _repo_backend
+
+    if STORAGE_BACKEND == STORAGE_LOOSE:
+        location = repos_path()
+    elif STORAGE_BACKEND == STORAGE_SQLITE:
+        location = repo_database_path()
+    elif STORAGE_BACKEND == STORAGE_MEMORY:
+        location = None
+    else:
+        raise Exception('Unable to open repo storage: Unknown storage backend {}'.format(STORAGE_BACKEND))
+
+    return open_storage_backend(STORAGE_BACKEND, location)
 
 
-def repo_index_path(file_path):
+def open_storage_backend(name, location):
     """
-    Return location of a file named 'index' in repo directory.
+    :param name: 'loose', 'sqlite' or 'memory'
+    :param location: folder of loose repos or SQLite database, None for memory
+    :return: the shared StorageBackend of a kind and location - created on first use
+    """
+    key = (name, location)
+    backend = _storage_backends.get(key)
+    if backend is None:
+        if name == STORAGE_LOOSE:
+            backend = LooseBackend(location)
+        elif name == STORAGE_SQLITE:
+            backend = SQLiteBackend(location)
+        else:
+            backend = MemoryBackend()
+        backend = _storage_backends.setdefault(key, backend)
+    return backend
+
+
+def set_repo_backend(backend):
+    """
+    Keep repos in a given backend instead of the configured one - e.g. a MemoryBackend for tests and benchmarks.
 
-    :param file_path: full file location (inclusive of name and extension)
-    :return: Location of 'index' file in repo directory - in string format
+    :param backend: StorageBackend, None to go back to the configured one
+    :return: None
     """
-    return os.path.join(repo_path(file_path), INDEX)
+    global _repo_backend
+    _repo_backend = backend
 
 
-def repo_file_objects_path(file_path):
+def repo_transaction():
     """
-    Return location of a folder named 'objects' in repo directory.
+    Group repo writes so that they land together.
 
-    :param file_path: full file location (inclusive of name and extension)
-    :return: Location of objects folder in repo directory - in string format
+    :return: context manager
     """
-    return os.path.join(repo_path(file_path), OBJECTS)
+    return repo_backend().transaction()
 
 
 def repo_key(file_path):
     """
-    Return 'key' object in repo directory.
+    Return 'key' object of repo.
 
     :param file_path: full file location (inclusive of name and extension)
     :return: 'key' object
     """
-    with open(repo_key_path(file_path), 'r') as f:
-        key = f.read()
-    return key
+    return repo_backend().read_key(repo_id(file_path))
 
 
 def write_repo_key(file_path):
     """
-    Write file_path to a file named 'key' in repo directory.
+    Write file_path as 'key' object of repo.
 
     :param file_path: full file location (inclusive of name and extension)
     :return: None
     """
-    with open(repo_key_path(file_path), 'w') as f:
-        f.write(file_path)
+    repo_backend().write_key(repo_id(file_path), file_path)
 
 
+@profiled(CATEGORY_REPO)
 def repo_index(file_path):
     """
-    Return 'index' object in repo directory.
+    Return 'index' object of repo.
 
     :param file_path: full file location (inclusive of name and extension)
     :return: 'index' object
     """
-    with open(repo_index_path(file_path), 'rb') as f:
-        binary_index = f.read()
-        json_index = zlib.decompress(binary_index)
-        dict_index = json.loads(json_index)
-    return dict_index
+    return decode_index_data(repo_index_data(file_path))
 
 
+@profiled(CATEGORY_REPO)
+def repo_compact_index(file_path):
+    """
+    Return 'index' object of repo with versions numbered - for readers that walk the whole history, e.g. the timeline.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: CompactIndex object
+    """
+    return decode_compact_index_data(repo_index_data(file_path))
+
+
+def repo_index_data(file_path):
+    """
+    Return 'index' object as it is stored.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: compressed 'index' object
+    """
+    return bytes(repo_backend().read_index(repo_id(file_path)))
+
+
+def safe_repo_index(file_path):
+    """
+    Return 'index' object of repo, or None if it cannot be read.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: 'index' object or None
+    """
+    try:
+        return repo_index(file_path)
+    except (OSError, ValueError, zlib.error):
+        return None
+
+
+@profiled(CATEGORY_REPO)
 def write_repo_index(file_path, dict_index):
     """
-    Write dict_index to file named 'index' in repo directory.
+    Write dict_index as 'index' object of repo.
 
     :param file_path: full file location (inclusive of name and extension)
     :param dict_index: a python dict object
     :return: None
     """
-    with open(repo_index_path(file_path), 'wb') as f:
-        json_index = json.dumps(dict_index)
-        binary_index = zlib.compress(json_index.encode())
-        f.write(binary_index)
+    repo_backend().write_index(repo_id(file_path), encode_index_dict(dict_index))
+
+
+def encode_index_dict(dict_index):
+    """
+    :param dict_index: a python dict object
+    :return: compressed 'index' object, as it is stored
+    """
+    return zlib.compress(CompactIndex.from_index_dict(dict_index).to_bytes())
+
+
+def decode_index_data(binary_index):
+    """
+    Indexes written before the compact form are JSON, and are read as such until they are next written.
+
+    :param binary_index: compressed 'index' object, as it is stored
+    :return: 'index' object - raises ValueError or zlib.error if it is damaged
+    """
+    index_data = zlib.decompress(binary_index)
+    if is_compact_index(index_data):
+        return CompactIndex.from_bytes(index_data).to_index_dict()
+
+    return decode_legacy_index_data(index_data)
+
+
+def decode_compact_index_data(binary_index):
+    """
+    :param binary_index: compressed 'index' object, as it is stored
+    :return: CompactIndex object - raises ValueError or zlib.error if it is damaged
+    """
+    index_data = zlib.decompress(binary_index)
+    if is_compact_index(index_data):
+        return CompactIndex.from_bytes(index_data)
+
+    return CompactIndex.from_index_dict(decode_legacy_index_data(index_data))
+
+
+def decode_legacy_index_data(index_data):
+    """
+    :param index_data: decompressed JSON 'index' object
+    :return: 'index' object - raises ValueError if it is damaged, parsed or not
+    """
+    index = json.loads(index_data.decode())
+    if not index_dict_is_well_formed(index):
+        raise ValueError('Index is damaged')
+
+    return index
 
 
 def repo_index_head(file_path):
@@ -229,10 +415,21 @@ def update_repo_index_head(file_path, file_hash):
     :return: None
     """
     index = repo_index(file_path)
-    index[INDEX_HEAD] = file_hash
+    update_index_dict_head(index, file_hash)
     write_repo_index(file_path, index)
 
 
+def update_index_dict_head(index, file_hash):
+    """
+    Update head without touching the disk.
+
+    :param index: python dict object
+    :param file_hash: hash that represents file content
+    :return: None
+    """
+    index[INDEX_HEAD] = file_hash
+
+
 def build_index_dict(file_data):
     """
     Create a new python dict object called index.
@@ -250,30 +447,77 @@ def build_index_dict(file_data):
     return index
 
 
+@profiled(CATEGORY_REPO)
 def repo_file_object(file_path, file_hash):
     """
-    Decompress file object and return file content.
+    Decompress file object and return file content. Chunked file objects are put together from their chunks.
 
     :param file_path: full file location (inclusive of name and extension)
     :param file_hash: Hash of file content
     :return: file content
     """
-    with open(repo_file_object_path(file_path, file_hash), 'rb') as f:
-        binary_file_data = f.read()
+    binary_file_data = repo_file_object_data(file_path, file_hash)
+    if is_chunked_object(binary_file_data):
+        encoded_file_data = repo_chunks_data(file_path, parse_chunked_object(binary_file_data))
+    else:
         encoded_file_data = zlib.decompress(binary_file_data)
-        file_data = encoded_file_data.decode()
+    file_data = encoded_file_data.decode()
     return file_data
 
 
-def repo_file_object_path(file_path, file_hash):
+def repo_chunks_data(file_path, chunks):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :param chunks: list of (hash, length) tuples
+    :return: encoded content of chunks, back to back
+    """
+    backend = repo_backend()
+    parts = []
+    for chunk_hash, length in chunks:
+        chunk_data = backend.read_chunk(repo_id(file_path), chunk_hash)
+        if chunk_data is None:
+            raise FileNotFoundError(errno.ENOENT, 'No such chunk', chunk_hash)
+        parts.append(decompress_chunk(chunk_data))
+    return b''.join(parts)
+
+
+def repo_file_object_chunks(file_path, file_hash):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: list of (hash, length) tuples of chunks of file object, empty if it is stored whole or missing
+    """
+    binary_file_data = repo_backend().read_object(repo_id(file_path), file_hash)
+    if binary_file_data is None or not is_chunked_object(binary_file_data):
+        return []
+
+    try:
+        return parse_chunked_object(binary_file_data)
+    except ValueError:
+        return []
+
+
+def repo_file_object_data(file_path, file_hash):
+    """
+    Return a file object as it is stored.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: compressed file content
     """
-    Return location of a certain file object.
+    binary_file_data = repo_backend().read_object(repo_id(file_path), file_hash)
+    if binary_file_data is None:
+        raise FileNotFoundError(errno.ENOENT, 'No such file object', file_hash)
+    return binary_file_data
+
 
+def repo_file_object_stat(file_path, file_hash):
+    """
     :param file_path: full file location (inclusive of name and extension)
     :param file_hash: Hash of file content
-    :return: path of file object
+    :return: tuple of size of file object and time it was written, None if there is no such file object
     """
-    return os.path.join(repo_file_objects_path(file_path), file_hash)
+    return repo_backend().object_stat(repo_id(file_path), file_hash)
 
 
 def repo_file_object_exists(file_path, file_hash):
@@ -284,37 +528,212 @@ def repo_file_object_exists(file_path, file_hash):
     :param file_hash: Hash of file content
     :return: Boolean representing existence of file object
     """
-    return os.path.exists(repo_file_object_path(file_path, file_hash))
+    return repo_backend().object_exists(repo_id(file_path), file_hash)
 
 
-def write_repo_file_object(file_path, file_data):
+@profiled(CATEGORY_REPO)
+def write_repo_file_object(file_path, file_data, base_file_hash=None):
     """
-    Write a file object.
+    Write a file object. Large files are written in chunks - only the chunks that no other version has yet are
+    compressed and written, and the file object itself just lists them.
 
     :param file_path: full file location (inclusive of name and extension)
     :param file_data: file content
-    :return: None
+    :param base_file_hash: Hash of the version the content was edited from, whose chunks are looked at first
+    :return: python dict object of metadata of the file object - its compressed size being the bytes it added
     """
     file_hash = get_hash(file_data)
-    with open(repo_file_object_path(file_path, file_hash), 'wb') as f:
-        binary_file_data = zlib.compress(file_data.encode())
-        f.write(binary_file_data)
+    encoded_file_data = file_data.encode()
+    if len(encoded_file_data) >= CHUNKING_THRESHOLD:
+        binary_file_data, chunks_size = write_repo_chunks(file_path, encoded_file_data, base_file_hash)
+    else:
+        binary_file_data, chunks_size = zlib.compress(encoded_file_data), 0
+    repo_backend().write_object(repo_id(file_path), file_hash, binary_file_data)
+
+    preview = build_file_preview(file_data)
+    write_repo_file_preview(file_path, file_hash, preview)
+
+    return build_file_meta(preview[PREVIEW_SIZE], preview[PREVIEW_NUM_LINES], len(binary_file_data) + chunks_size)
+
+
+def write_repo_chunks(file_path, encoded_file_data, base_file_hash=None):
+    """
+    Split file content into chunks and write the ones the repo does not have.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param encoded_file_data: encoded file content
+    :param base_file_hash: Hash of the version the content was edited from
+    :return: tuple of chunked file object and number of bytes of chunks written
+    """
+    backend = repo_backend()
+    repo = repo_id(file_path)
+
+    base_chunks = repo_file_object_chunks(file_path, base_file_hash) if base_file_hash else []
+    known_chunk_hashes = {chunk_hash for chunk_hash, _ in base_chunks}
+
+    chunks_size = 0
+    chunks = split_into_chunks(encoded_file_data, base_chunks)
+    for chunk_hash, start, end in chunks:
+        if chunk_hash in known_chunk_hashes or backend.chunk_exists(repo, chunk_hash):
+            continue
+
+        chunk_data = compress_chunk(encoded_file_data[start:end])
+        backend.write_chunk(repo, chunk_hash, chunk_data)
+        chunks_size += len(chunk_data)
+        known_chunk_hashes.add(chunk_hash)
+
+    return build_chunked_object([(chunk_hash, end - start) for chunk_hash, start, end in chunks]), chunks_size
+
+
+def remove_unused_repo_chunks(file_path):
+    """
+    Remove chunks no file object lists anymore, e.g. once the file objects were removed by a repair.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: number of chunks removed
+    """
+    backend = repo_backend()
+    repo = repo_id(file_path)
+
+    used_chunk_hashes = set()
+    for file_hash in repo_file_object_hashes(file_path):
+        used_chunk_hashes.update(chunk_hash for chunk_hash, _ in repo_file_object_chunks(file_path, file_hash))
+
+    unused_chunk_hashes = [chunk_hash for chunk_hash in backend.chunk_hashes(repo)
+                           if chunk_hash not in used_chunk_hashes]
+    with repo_transaction():
+        for chunk_hash in unused_chunk_hashes:
+            backend.remove_chunk(repo, chunk_hash)
+
+    return len(unused_chunk_hashes)
+
+
+@profiled(CATEGORY_REPO)
+def repo_file_preview(file_path, file_hash):
+    """
+    Return the preview of a file object. Previews missing from repos written before they existed, or damaged ones,
+    are rebuilt from the file object.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: python dict object of the first lines, number of lines and size of file content
+    """
+    try:
+        return json.loads(repo_backend().read_preview(repo_id(file_path), file_hash))
+    except (TypeError, ValueError):
+        pass
+
+    preview = build_file_preview(repo_file_object(file_path, file_hash))
+    write_repo_file_preview(file_path, file_hash, preview)
+    return preview
+
+
+def write_repo_file_preview(file_path, file_hash, preview):
+    """
+    Write the preview of a file object.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :param preview: python dict object returned by build_file_preview
+    :return: None
+    """
+    repo_backend().write_preview(repo_id(file_path), file_hash, json.dumps(preview))
+
+
+@profiled(CATEGORY_REPO)
+def repo_editor_state(file_path, file_hash):
+    """
+    Return the editor state saved along with a version - its undo log, cursor and scroll position.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: python dict object, None if there is none or it cannot be read
+    """
+    state_data = repo_backend().read_editor_state(repo_id(file_path), file_hash)
+    try:
+        return json.loads(zlib.decompress(state_data).decode())
+    except (TypeError, ValueError, zlib.error):
+        return None
 
 
-def add_file_object_to_index(file_path, file_data, adopted=False):
+@profiled(CATEGORY_REPO)
+def write_repo_editor_state(file_path, file_hash, state):
+    """
+    Save the editor state of a version.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :param state: python dict object
+    :return: None
+    """
+    json_state = json.dumps(state, separators=(',', ':'))
+    repo_backend().write_editor_state(repo_id(file_path), file_hash, zlib.compress(json_state.encode()))
+
+
+def repo_file_object_and_editor_state(file_path, file_hash):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: tuple of file content and editor state of a version
+    """
+    return repo_file_object(file_path, file_hash), repo_editor_state(file_path, file_hash)
+
+
+def build_file_preview(file_data):
+    """
+    :param file_data: file content
+    :return: python dict object of the first lines, number of lines and size of file content
+    """
+    lines = file_data.splitlines()
+    prefix = [line[:PREVIEW_LINE_LENGTH] for line in lines[:PREVIEW_LINES]]
+
+    return {
+        PREVIEW_PREFIX: '\n'.join(prefix),
+        PREVIEW_NUM_LINES: len(lines),
+        PREVIEW_SIZE: len(file_data.encode())
+    }
+
+
+@profiled(CATEGORY_REPO)
+def add_file_object_to_index(file_path, file_data, adopted=False, merged_file_hash=None):
     """
     Add a new file object to index.
 
     :param file_path: full file location (inclusive of name and extension)
     :param file_data: file content
     :param adopted: Boolean representing if the relationship is not natural
-    :return: None
+    :param merged_file_hash: Hash of the version merged into head, which becomes a second parent
+    :return: tuple of hash and metadata of the new version
     """
-    index = repo_index(file_path)
     file_hash = get_hash(file_data)
+    index = repo_index(file_path)
+    base_file_hash = index[INDEX_HEAD]
+    add_file_hash_to_index_dict(index, file_hash, adopted=adopted, merged_file_hash=merged_file_hash)
+
+    # Object goes first so that the index never refers to a missing object
+    with repo_transaction():
+        file_meta = write_repo_file_object(file_path, file_data, base_file_hash)
+        add_file_meta_to_index_dict(index, file_hash, file_meta)
+        write_repo_index(file_path, index)
+
+    return file_hash, file_meta
+
+
+def add_file_hash_to_index_dict(index, file_hash, adopted=False, merged_file_hash=None):
+    """
+    Add a new version as a child of head and make it the new head - without touching the disk.
+
+    :param index: python dict object
+    :param file_hash: hash that represents file content
+    :param adopted: Boolean representing if the relationship is not natural
+    :param merged_file_hash: Hash of the version merged into head, which becomes a second parent
+    :return: None
+    """
     parent_file_hash = index[INDEX_HEAD]
 
     index[parent_file_hash].append(file_hash)
+    if merged_file_hash and merged_file_hash != parent_file_hash:
+        index[merged_file_hash].append(file_hash)
     index[INDEX_HEAD] = file_hash
 
     if file_hash not in index:
@@ -323,10 +742,583 @@ def add_file_object_to_index(file_path, file_data, adopted=False):
     if adopted:
         index[INDEX_ADOPTS].append((parent_file_hash, file_hash))
 
+
+def copy_index_dict(index):
+    """
+    Return a copy of index that can be mutated without affecting the original.
+
+    :param index: python dict object
+    :return: python dict object
+    """
+    index_copy = {key: list(value) if isinstance(value, list) else value for key, value in index.items()}
+    if INDEX_META in index:
+        index_copy[INDEX_META] = copy_index_meta_dict(index[INDEX_META])
+
+    return index_copy
+
+
+def build_index_meta_dict():
+    """
+    Create an empty metadata table.
+
+    :return: python dict object
+    """
+    meta = {column: [] for column in (META_HASHES,) + META_COLUMNS}
+    meta[META_LABELS] = {}
+    return meta
+
+
+def copy_index_meta_dict(meta):
+    meta_copy = {column: list(meta[column]) for column in (META_HASHES,) + META_COLUMNS}
+    meta_copy[META_LABELS] = dict(meta[META_LABELS])
+    return meta_copy
+
+
+def build_file_meta(size, lines, compressed, created=None):
+    """
+    :param size: size of file content in bytes
+    :param lines: number of lines in file content
+    :param compressed: size of file object in bytes
+    :param created: time the version was recorded, in seconds since the epoch - now if not given
+    :return: python dict object with an entry per metadata column
+    """
+    return {
+        META_CREATED: int(time.time()) if created is None else int(created),
+        META_SIZE: size,
+        META_LINES: lines,
+        META_COMPRESSED: compressed
+    }
+
+
+def add_file_meta_to_index_dict(index, file_hash, file_meta):
+    """
+    Add a row to the metadata table of index - without touching the disk. Versions recorded before keep their row.
+
+    :param index: python dict object
+    :param file_hash: hash that represents file content
+    :param file_meta: python dict object returned by build_file_meta
+    :return: None
+    """
+    meta = index.setdefault(INDEX_META, build_index_meta_dict())
+    rows = index_meta_rows(meta)
+    if file_hash in rows:
+        return
+
+    rows[file_hash] = len(meta[META_HASHES])
+    meta[META_HASHES].append(file_hash)
+    for column in META_COLUMNS:
+        meta[column].append(file_meta[column])
+
+
+def index_dict_file_meta(index, file_hash):
+    """
+    Look up the metadata of a version.
+
+    :param index: python dict object
+    :param file_hash: hash that represents file content
+    :return: python dict object with an entry per metadata column and the label, None if version has no row
+    """
+    meta = index.get(INDEX_META)
+    row = index_meta_rows(meta).get(file_hash) if meta else None
+    if row is None:
+        return None
+
+    file_meta = {column: meta[column][row] for column in META_COLUMNS}
+    file_meta[META_LABEL] = meta[META_LABELS].get(file_hash)
+    return file_meta
+
+
+def index_meta_rows(meta):
+    """
+    Look-up of rows by hash, built on first use and kept in the metadata table along with the columns.
+
+    :param meta: metadata table of an index
+    :return: python dict object of hash to row
+    """
+    rows = meta.get(META_ROWS)
+
+    # Tables read from disk, copied or pruned have none yet
+    if rows is None or len(rows) != len(meta[META_HASHES]):
+        rows = meta[META_ROWS] = {file_hash: row for row, file_hash in enumerate(meta[META_HASHES])}
+
+    return rows
+
+
+def index_dict_meta_column(index, column):
+    """
+    Read a whole metadata column, e.g. to find versions by time or to add up sizes.
+
+    :param index: python dict object
+    :param column: one of META_COLUMNS
+    :return: list of tuples of hash and value, in the order versions were recorded
+    """
+    meta = index.get(INDEX_META)
+    if not meta:
+        return []
+
+    return list(zip(meta[META_HASHES], meta[column]))
+
+
+def update_index_dict_label(index, file_hash, label):
+    """
+    Label a version, or remove its label if label is empty - without touching the disk.
+
+    :param index: python dict object
+    :param file_hash: hash that represents file content
+    :param label: label text
+    :return: None
+    """
+    labels = index.setdefault(INDEX_META, build_index_meta_dict())[META_LABELS]
+    if label:
+        labels[file_hash] = label
+    else:
+        labels.pop(file_hash, None)
+
+
+def update_repo_index_label(file_path, file_hash, label):
+    """
+    Label a version in the repo, or remove its label if label is empty.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: hash that represents file content
+    :param label: label text
+    :return: None
+    """
+    index = repo_index(file_path)
+    update_index_dict_label(index, file_hash, label)
+    write_repo_index(file_path, index)
+
+
+def prune_index_meta_dict(meta, file_hashes):
+    """
+    :param meta: metadata table of an index
+    :param file_hashes: set of hashes to retain
+    :return: metadata table that only has rows of versions in file_hashes
+    """
+    pruned = build_index_meta_dict()
+    for row, file_hash in enumerate(meta[META_HASHES]):
+        if file_hash not in file_hashes:
+            continue
+        pruned[META_HASHES].append(file_hash)
+        for column in META_COLUMNS:
+            pruned[column].append(meta[column][row])
+
+    pruned[META_LABELS] = {file_hash: label for file_hash, label in meta[META_LABELS].items()
+                           if file_hash in file_hashes}
+    return pruned
+
+
+def rebuilt_index_meta_dict(file_path, file_hashes):
+    """
+    Build the metadata table of versions from the previews and file system entries of their file objects. Meant
+    for repos recorded before the table existed - versions without a file object get no row.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hashes: list of hashes, oldest first
+    :return: python dict object
+    """
+    index = {}
+    for file_hash in file_hashes:
+        object_stat = repo_file_object_stat(file_path, file_hash)
+        if not object_stat:
+            continue
+
+        preview = repo_file_preview(file_path, file_hash)
+        file_meta = build_file_meta(preview[PREVIEW_SIZE], preview[PREVIEW_NUM_LINES], *object_stat)
+        add_file_meta_to_index_dict(index, file_hash, file_meta)
+
+    return index.get(INDEX_META, build_index_meta_dict())
+
+
+@profiled(CATEGORY_REPO)
+def open_repo(file_path, file_data):
+    """
+    Bring a repo in line with the content of its file when the file is opened - creating the repo if there is none,
+    repairing it if a crash left the index unreadable, and recording content edited by a 3rd party.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_data: file content
+    :return: 'index' object
+    """
+    if not repo_exists(file_path):
+        init_repo(file_path, file_data)
+        return repo_index(file_path)
+
+    # A crash during an earlier write may have left the index unreadable
+    if not index_dict_is_well_formed(safe_repo_index(file_path)):
+        repair_repo(file_path)
+
+    # Repos recorded before versions had metadata get their table once
+    index = repo_index(file_path)
+    if INDEX_META not in index:
+        index[INDEX_META] = rebuilt_index_meta_dict(file_path, repo_file_object_hashes(file_path))
+        write_repo_index(file_path, index)
+
+    file_hash = get_hash(file_data)
+    if repo_index_head(file_path) != file_hash:
+        # Check if content is pre-existing in repo history.
+        if repo_file_object_exists(file_path, file_hash):
+            update_repo_index_head(file_path, file_hash)
+        else:
+            # This means file was somehow edited by 3rd party, which forces the current history to adopt it.
+            add_file_object_to_index(file_path, file_data, adopted=True)
+
+    return repo_index(file_path)
+
+
+def reopen_repo(file_path):
+    """
+    Bring a repo in line with the content its file has on disk.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: 'index' object
+    """
+    with open(file_path, 'r') as f:
+        return open_repo(file_path, f.read())
+
+
+def rebuilt_repo_from_file_object(file_path, file_hash):
+    """
+    Remove an existing repo and initialise a new one that starts off from one of its versions.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: tuple of hash and metadata of the first version
+    """
+    return rebuilt_repo(file_path, repo_file_object(file_path, file_hash))
+
+
+@profiled(CATEGORY_REPO)
+def verify_repo(file_path):
+    """
+    Check the integrity of a repo - every object must hash to its name and every indexed version must have an object.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: python dict object listing corrupt objects, missing objects, leftover temp files and index damage
+    """
+    report = {
+        REPORT_CORRUPT_OBJECTS: [],
+        REPORT_MISSING_OBJECTS: [],
+        REPORT_TEMP_FILES: [],
+        REPORT_INDEX_DAMAGED: False
+    }
+
+    report[REPORT_TEMP_FILES] = repo_backend().temp_files(repo_id(file_path))
+
+    valid_hashes = set()
+    for file_hash in repo_file_object_hashes(file_path):
+        if repo_file_object_is_valid(file_path, file_hash):
+            valid_hashes.add(file_hash)
+        else:
+            report[REPORT_CORRUPT_OBJECTS].append(file_hash)
+
+    index = safe_repo_index(file_path)
+    if not index_dict_is_well_formed(index):
+        report[REPORT_INDEX_DAMAGED] = True
+        return report
+
+    for file_hash in index_dict_nodes(index):
+        if file_hash not in valid_hashes:
+            report[REPORT_MISSING_OBJECTS].append(file_hash)
+
+    return report
+
+
+def repo_is_healthy(report):
+    """
+    :param report: python dict object returned by verify_repo
+    :return: Boolean representing if the report found no problems
+    """
+    return not any(report.values())
+
+
+@profiled(CATEGORY_REPO)
+def repair_repo(file_path):
+    """
+    Remove corrupt objects and temp files left behind by a crash, and rebuild the index from the surviving objects.
+
+    If the old index is readable, its edges are kept and versions whose objects are gone are spliced out.
+    Otherwise, the objects are chained in the order they were written. Spliced and re-chained edges are
+    marked as adopted, as they are not natural relationships.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: python dict object returned by verify_repo before the repair
+    """
+    report = verify_repo(file_path)
+    if repo_is_healthy(report):
+        return report
+
+    if report[REPORT_TEMP_FILES]:
+        repo_backend().remove_temp_files(repo_id(file_path))
+
+    for file_hash in report[REPORT_CORRUPT_OBJECTS]:
+        repo_backend().remove_object(repo_id(file_path), file_hash)
+    remove_unused_repo_chunks(file_path)
+
+    file_hashes = repo_file_object_hashes(file_path)
+    if not file_hashes:
+        raise Exception('Unable to repair repo: No intact file objects left')
+
+    # Prefer the version that is currently in the working file as head
+    live_file_hash = None
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as f:
+            live_file_hash = get_hash(f.read())
+
+    if report[REPORT_INDEX_DAMAGED]:
+        index = build_index_dict_from_file_hashes(file_hashes, live_file_hash)
+        index[INDEX_META] = rebuilt_index_meta_dict(file_path, file_hashes)
+    else:
+        index = prune_index_dict(repo_index(file_path), set(file_hashes))
+
     write_repo_index(file_path, index)
-    write_repo_file_object(file_path, file_data)
+    write_repo_key(file_path)
+
+    return report
+
+
+def repo_file_object_hashes(file_path):
+    """
+    Return hashes of all file objects, oldest first.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: list of hashes
+    """
+    return repo_backend().object_hashes(repo_id(file_path))
+
+
+@profiled(CATEGORY_REPO)
+def export_repo(file_path, pack_path):
+    """
+    Write the history of a file - its index and every file object - to a single pack file. Chunked file objects
+    are put together and written whole, so a pack holds everything it takes to import it.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param pack_path: location of pack file to write
+    :return: None
+    """
+    if not repo_exists(file_path):
+        raise Exception('Unable to export repo: Repo does not exist')
+
+    write_pack(pack_path, repo_index_data(file_path), repo_file_object_hashes(file_path),
+               lambda file_hash: repo_whole_file_object_data(file_path, file_hash))
+
+
+def repo_whole_file_object_data(file_path, file_hash):
+    """
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: compressed file content - of a chunked file object too
+    """
+    binary_file_data = repo_file_object_data(file_path, file_hash)
+    if not is_chunked_object(binary_file_data):
+        return binary_file_data
+
+    return zlib.compress(repo_chunks_data(file_path, parse_chunked_object(binary_file_data)))
+
+
+@profiled(CATEGORY_REPO)
+def import_repo(pack_path, file_path):
+    """
+    Replace the history of a file with one exported to a pack file. The pack is checked in full first, then
+    handed over to the storage backend - loose repos keep it as is, in pack form.
+
+    :param pack_path: location of pack file to read
+    :param file_path: full file location (inclusive of name and extension)
+    :return: None
+    """
+    with PackReader(pack_path) as pack_reader:
+        try:
+            index = decode_index_data(pack_reader.index_data())
+        except (ValueError, zlib.error):
+            index = None
+        if not index_dict_is_well_formed(index):
+            raise Exception('Unable to import repo: Index in pack is damaged')
+
+        for file_hash in pack_reader.file_hashes():
+            try:
+                file_data = zlib.decompress(pack_reader.object_data(file_hash)).decode()
+            except (ValueError, zlib.error):
+                file_data = None
+            if file_data is None or get_hash(file_data) != file_hash:
+                raise Exception('Unable to import repo: File object {} in pack is damaged'.format(file_hash))
+
+    remove_repo(file_path)
+
+    with repo_transaction():
+        make_repo(file_path)
+        repo_backend().import_pack(repo_id(file_path), pack_path)
+        write_repo_index(file_path, index)
+        write_repo_key(file_path)
 
 
+@profiled(CATEGORY_REPO)
+def pack_repo(file_path):
+    """
+    Cut down on the storage overhead of a repo - chunks no version lists are removed, and loose repos are put in
+    pack form, with every file object moved into one pack file. New versions are written loose, until the repo is
+    packed again.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :return: None
+    """
+    remove_unused_repo_chunks(file_path)
+    repo_backend().compact_repo(repo_id(file_path))
+
+
+def repo_file_object_is_valid(file_path, file_hash):
+    """
+    Check if a file object can be decompressed and hashes to its name.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param file_hash: Hash of file content
+    :return: Boolean
+    """
+    try:
+        return get_hash(repo_file_object(file_path, file_hash)) == file_hash
+    except (OSError, ValueError, zlib.error):
+        return False
+
+
+def index_dict_is_well_formed(index):
+    """
+    :param index: python dict object
+    :return: Boolean representing if index has its critical entries and every edge points to a version
+    """
+    if not isinstance(index, dict):
+        return False
+
+    if any(key not in index for key in (INDEX_ROOT, INDEX_HEAD, INDEX_ADOPTS)):
+        return False
+
+    nodes = index_dict_nodes(index)
+    if index[INDEX_ROOT] not in nodes or index[INDEX_HEAD] not in nodes:
+        return False
+
+    if not all(isinstance(index[file_hash], list) for file_hash in nodes):
+        return False
+
+    return all(isinstance(child, str) and child in nodes for file_hash in nodes for child in index[file_hash])
+
+
+@profiled(CATEGORY_REPO)
+def merge_file_objects(file_path, base_file_hash, file_hash, other_file_hash):
+    """
+    Three-way merge of two versions against their common ancestor.
+
+    :param file_path: full file location (inclusive of name and extension)
+    :param base_file_hash: Hash of common ancestor
+    :param file_hash: Hash of the version merged into
+    :param other_file_hash: Hash of the version merged in
+    :return: tuple of merged file content and number of conflicts
+    """
+    return merge_text(repo_file_object(file_path, base_file_hash),
+                      repo_file_object(file_path, file_hash),
+                      repo_file_object(file_path, other_file_hash),
+                      ours_name=file_hash[:8], theirs_name=other_file_hash[:8])
+
+
+def index_dict_nodes(index):
+    """
+    :param index: python dict object
+    :return: set of hashes of all versions in index
+    """
+    return set(index.keys()) - {INDEX_ROOT, INDEX_HEAD, INDEX_ADOPTS, INDEX_META}
+
+
+def build_index_dict_from_file_hashes(file_hashes, head_file_hash=None):
+    """
+    Create an index that chains versions one after another.
+
+    :param file_hashes: list of hashes, oldest first
+    :param head_file_hash: hash to use as head, if present in file_hashes
+    :return: python dict object
+    """
+    index = {
+        INDEX_ROOT: file_hashes[0],
+        INDEX_HEAD: head_file_hash if head_file_hash in file_hashes else file_hashes[-1],
+        INDEX_ADOPTS: []
+    }
+
+    for file_hash in file_hashes:
+        index[file_hash] = []
+
+    for parent_file_hash, file_hash in zip(file_hashes, file_hashes[1:]):
+        index[parent_file_hash].append(file_hash)
+        index[INDEX_ADOPTS].append((parent_file_hash, file_hash))
+
+    return index
+
+
+def prune_index_dict(index, file_hashes):
+    """
+    Create an index that only contains versions in file_hashes. Children of a dropped version are adopted by
+    its nearest surviving ancestor, and versions the old index did not know of are adopted by the root.
+
+    :param index: python dict object
+    :param file_hashes: set of hashes to retain
+    :return: python dict object
+    """
+    pruned = {INDEX_ADOPTS: []}
+    adopts = set(tuple(edge) for edge in index[INDEX_ADOPTS])
+    head_file_hash = None
+
+    # Iterative DFS - each stack entry is (node, natural parent, nearest surviving ancestor)
+    stack = [(index[INDEX_ROOT], None, None)]
+    visited = set()
+    while stack:
+        file_hash, parent_file_hash, ancestor_file_hash = stack.pop()
+
+        # A merged version is reached once per parent - a retained one keeps an edge from each surviving ancestor,
+        # a dropped one is passed through once per surviving ancestor so the versions under it keep them too
+        if file_hash in pruned:
+            if ancestor_file_hash is not None and file_hash not in pruned[ancestor_file_hash]:
+                pruned[ancestor_file_hash].append(file_hash)
+                if ancestor_file_hash != parent_file_hash or (parent_file_hash, file_hash) in adopts:
+                    pruned[INDEX_ADOPTS].append((ancestor_file_hash, file_hash))
+            continue
+        if (file_hash, ancestor_file_hash) in visited:
+            continue
+        visited.add((file_hash, ancestor_file_hash))
+
+        if file_hash in file_hashes:
+            pruned[file_hash] = []
+            if ancestor_file_hash is None:
+                if INDEX_ROOT in pruned:
+                    ancestor_file_hash = pruned[INDEX_ROOT]
+                else:
+                    pruned[INDEX_ROOT] = file_hash
+
+            if ancestor_file_hash is not None:
+                pruned[ancestor_file_hash].append(file_hash)
+                if ancestor_file_hash != parent_file_hash or (parent_file_hash, file_hash) in adopts:
+                    pruned[INDEX_ADOPTS].append((ancestor_file_hash, file_hash))
+            ancestor_file_hash = file_hash
+
+        if file_hash == index[INDEX_HEAD] and head_file_hash is None:
+            head_file_hash = ancestor_file_hash
+
+        for child_file_hash in reversed(index.get(file_hash, [])):
+            stack.append((child_file_hash, file_hash, ancestor_file_hash))
+
+    for file_hash in file_hashes:
+        if file_hash in pruned:
+            continue
+        if INDEX_ROOT not in pruned:
+            pruned[INDEX_ROOT] = file_hash
+            pruned[file_hash] = []
+            continue
+        pruned[file_hash] = []
+        pruned[pruned[INDEX_ROOT]].append(file_hash)
+        pruned[INDEX_ADOPTS].append((pruned[INDEX_ROOT], file_hash))
+
+    pruned[INDEX_HEAD] = head_file_hash or pruned[INDEX_ROOT]
+    if INDEX_META in index:
+        pruned[INDEX_META] = prune_index_meta_dict(index[INDEX_META], file_hashes)
+    return pruned
+
+
+@profiled(CATEGORY_HASH)
 def get_hash(data):
     """
     Get hash of file content.
@@ -0,0 +1,127 @@
+import threading
+import traceback
+from collections import deque
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class RepositoryJobRunner(QRunnable):
+    """
+    Runnable that drains the job queue of a single repo, one job at a time.
+
+    """
+    def __init__(self, pool, file_path):
+        super().__init__()
+        self.pool = pool
+        self.file_path = file_path
+
+    def run(self):
+        while True:
+            job = self.pool.next_job(self.file_path)
+            if job is None:
+                return
+
+            sequence, function, args, callback, latest_only = job
+            try:
+                result = function(*args)
+            except Exception:
+                self.pool.job_failed.emit(self.file_path, traceback.format_exc())
+                continue
+
+            if callback:
+                self.pool.job_finished.emit(self.file_path, sequence, (callback, result, latest_only))
+
+
+class RepositoryWorkerPool(QObject):
+    """
+    A class to represent the worker pool that carries out repo I/O for all open documents.
+
+    Jobs are queued per repo - jobs of the same repo run one after another in the order they were submitted,
+    while jobs of different repos run in parallel. Callbacks are invoked on the main thread.
+
+    """
+
+    # Signals
+    job_finished = pyqtSignal(str, int, object)
+    job_failed = pyqtSignal(str, str)
+
+    # Constants
+    MAX_THREAD_COUNT = 4
+
+    def __init__(self):
+        super().__init__()
+
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(self.MAX_THREAD_COUNT)
+
+        # Queued jobs of every repo that has a runner at work, and the latest sequence number issued for every repo
+        self.queues = {}
+        self.sequences = {}
+        self.condition = threading.Condition()
+
+        self.job_finished.connect(self.handle_job_finished)
+
+    def submit(self, file_path, function, *args, callback=None, latest_only=False):
+        """
+        Queue a job to run against a repo.
+
+        :param file_path: full file location (inclusive of name and extension) of the repo the job works on
+        :param function: function to run in a worker thread
+        :param args: arguments of function
+        :param callback: function to invoke with the result on the main thread
+        :param latest_only: invoke callback only if no other job was submitted for the repo in the meantime
+        :return: None
+        """
+        with self.condition:
+            sequence = self.sequences.get(file_path, 0) + 1
+            self.sequences[file_path] = sequence
+
+            job = (sequence, function, args, callback, latest_only)
+            if file_path in self.queues:
+                self.queues[file_path].append(job)
+                return
+
+            self.queues[file_path] = deque([job])
+
+        self.thread_pool.start(RepositoryJobRunner(self, file_path))
+
+    def next_job(self, file_path):
+        """
+        Pop the next job of a repo, retiring its queue once it is empty. Called from worker threads.
+
+        :param file_path: full file location (inclusive of name and extension)
+        :return: job tuple or None
+        """
+        with self.condition:
+            queue = self.queues[file_path]
+            if queue:
+                return queue.popleft()
+
+            del self.queues[file_path]
+            self.condition.notify_all()
+            return None
+
+    def is_busy(self, file_path):
+        with self.condition:
+            return file_path in self.queues
+
+    def wait_for_repo(self, file_path):
+        """
+        Block until every job queued for a repo has run.
+
+        :param file_path: full file location (inclusive of name and extension)
+        :return: None
+        """
+        with self.condition:
+            while file_path in self.queues:
+                self.condition.wait()
+
+    def wait_for_all(self):
+        self.thread_pool.waitForDone()
+
+    # Slot Function
+    def handle_job_finished(self, file_path, sequence, job_result):
+        callback, result, latest_only = job_result
+        if latest_only and sequence != self.sequences.get(file_path):
+            return
+
+        callback(result)
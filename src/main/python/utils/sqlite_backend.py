@@ -0,0 +1,237 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from utils.storage_backend import StorageBackend
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    A class to represent a storage backend that keeps every repo - key, index, file objects, their previews and
+    chunks - in a single SQLite database, instead of a directory tree per repo.
+
+    Repos are identified by the hash of their file path, the way repo directories are. Each thread gets its own
+    connection. The database runs in WAL mode, so readers never wait for the writer, and writes made within
+    a transaction block are committed together.
+
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS repos ('
+        '    repo TEXT PRIMARY KEY,'
+        '    key TEXT,'
+        '    repo_index BLOB'
+        ')',
+        'CREATE TABLE IF NOT EXISTS objects ('
+        '    id INTEGER PRIMARY KEY,'
+        '    repo TEXT NOT NULL,'
+        '    hash TEXT NOT NULL,'
+        '    data BLOB NOT NULL,'
+        '    written REAL NOT NULL,'
+        '    preview TEXT,'
+        '    editor_state BLOB,'
+        '    UNIQUE (repo, hash)'
+        ')',
+        'CREATE TABLE IF NOT EXISTS chunks ('
+        '    repo TEXT NOT NULL,'
+        '    hash TEXT NOT NULL,'
+        '    data BLOB NOT NULL,'
+        '    PRIMARY KEY (repo, hash)'
+        ')'
+    )
+
+    # Columns added since the first schema - databases created before them get them on open
+    ADDED_COLUMNS = (
+        ('objects', 'editor_state', 'BLOB'),
+    )
+    BUSY_TIMEOUT = 10000
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.local = threading.local()
+
+        directory = os.path.dirname(database_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self.transaction() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+            for table, column, column_type in self.ADDED_COLUMNS:
+                columns = [row[1] for row in connection.execute('PRAGMA table_info({})'.format(table))]
+                if column not in columns:
+                    connection.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table, column, column_type))
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.database_path, timeout=self.BUSY_TIMEOUT / 1000,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.depth = 0
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commit every write within the block at once, or none of them. Nested blocks are folded into the outermost one.
+
+        :return: sqlite3 connection of the calling thread
+        """
+        connection = self.connection
+        if self.local.depth:
+            self.local.depth += 1
+            try:
+                yield connection
+            finally:
+                self.local.depth -= 1
+            return
+
+        connection.execute('BEGIN IMMEDIATE')
+        self.local.depth = 1
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+        finally:
+            self.local.depth = 0
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    # Repos
+
+    def repo_exists(self, repo):
+        return self.connection.execute('SELECT 1 FROM repos WHERE repo = ?', (repo,)).fetchone() is not None
+
+    def create_repo(self, repo):
+        self.connection.execute('INSERT OR IGNORE INTO repos (repo) VALUES (?)', (repo,))
+
+    def remove_repo(self, repo):
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM objects WHERE repo = ?', (repo,))
+            connection.execute('DELETE FROM chunks WHERE repo = ?', (repo,))
+            connection.execute('DELETE FROM repos WHERE repo = ?', (repo,))
+
+    def copy_repo(self, old_repo, new_repo):
+        with self.transaction() as connection:
+            self.remove_repo(new_repo)
+            connection.execute('INSERT INTO repos (repo, key, repo_index) '
+                               'SELECT ?, key, repo_index FROM repos WHERE repo = ?', (new_repo, old_repo))
+            connection.execute('INSERT INTO objects (repo, hash, data, written, preview, editor_state) '
+                               'SELECT ?, hash, data, written, preview, editor_state FROM objects '
+                               'WHERE repo = ? ORDER BY id',
+                               (new_repo, old_repo))
+            connection.execute('INSERT INTO chunks (repo, hash, data) SELECT ?, hash, data FROM chunks WHERE repo = ?',
+                               (new_repo, old_repo))
+
+    def move_repo(self, old_repo, new_repo):
+        with self.transaction() as connection:
+            self.remove_repo(new_repo)
+            connection.execute('UPDATE repos SET repo = ? WHERE repo = ?', (new_repo, old_repo))
+            connection.execute('UPDATE objects SET repo = ? WHERE repo = ?', (new_repo, old_repo))
+            connection.execute('UPDATE chunks SET repo = ? WHERE repo = ?', (new_repo, old_repo))
+
+    def repos(self):
+        return [row[0] for row in self.connection.execute('SELECT repo FROM repos')]
+
+    # Key and index
+
+    def read_key(self, repo):
+        return self.read_repo_column(repo, 'key')
+
+    def write_key(self, repo, key):
+        self.connection.execute('UPDATE repos SET key = ? WHERE repo = ?', (key, repo))
+
+    def read_index(self, repo):
+        return self.read_repo_column(repo, 'repo_index')
+
+    def write_index(self, repo, index_data):
+        self.connection.execute('UPDATE repos SET repo_index = ? WHERE repo = ?', (index_data, repo))
+
+    def read_repo_column(self, repo, column):
+        row = self.connection.execute('SELECT {} FROM repos WHERE repo = ?'.format(column), (repo,)).fetchone()
+        if row is None or row[0] is None:
+            raise FileNotFoundError('No {} in repo {}'.format(column, repo))
+        return row[0]
+
+    # File objects
+
+    def read_object(self, repo, file_hash):
+        row = self.connection.execute('SELECT data FROM objects WHERE repo = ? AND hash = ?',
+                                      (repo, file_hash)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write_object(self, repo, file_hash, object_data, written=None):
+        # Objects are named by their content, so a rewrite of an object keeps its row and age
+        self.connection.execute('INSERT OR IGNORE INTO objects (repo, hash, data, written) VALUES (?, ?, ?, ?)',
+                                (repo, file_hash, object_data, time.time() if written is None else written))
+        self.connection.execute('UPDATE objects SET data = ? WHERE repo = ? AND hash = ?',
+                                (object_data, repo, file_hash))
+
+    def remove_object(self, repo, file_hash):
+        self.connection.execute('DELETE FROM objects WHERE repo = ? AND hash = ?', (repo, file_hash))
+
+    def object_exists(self, repo, file_hash):
+        return self.connection.execute('SELECT 1 FROM objects WHERE repo = ? AND hash = ?',
+                                       (repo, file_hash)).fetchone() is not None
+
+    def object_stat(self, repo, file_hash):
+        row = self.connection.execute('SELECT length(data), written FROM objects WHERE repo = ? AND hash = ?',
+                                      (repo, file_hash)).fetchone()
+        return tuple(row) if row else None
+
+    def object_hashes(self, repo):
+        return [row[0] for row in self.connection.execute('SELECT hash FROM objects WHERE repo = ? ORDER BY id',
+                                                          (repo,))]
+
+    def read_preview(self, repo, file_hash):
+        row = self.connection.execute('SELECT preview FROM objects WHERE repo = ? AND hash = ?',
+                                      (repo, file_hash)).fetchone()
+        return row[0] if row else None
+
+    def write_preview(self, repo, file_hash, preview_data):
+        self.connection.execute('UPDATE objects SET preview = ? WHERE repo = ? AND hash = ?',
+                                (preview_data, repo, file_hash))
+
+    def read_editor_state(self, repo, file_hash):
+        row = self.connection.execute('SELECT editor_state FROM objects WHERE repo = ? AND hash = ?',
+                                      (repo, file_hash)).fetchone()
+        return bytes(row[0]) if row and row[0] is not None else None
+
+    def write_editor_state(self, repo, file_hash, state_data):
+        self.connection.execute('UPDATE objects SET editor_state = ? WHERE repo = ? AND hash = ?',
+                                (state_data, repo, file_hash))
+
+    # Chunks
+
+    def read_chunk(self, repo, chunk_hash):
+        row = self.connection.execute('SELECT data FROM chunks WHERE repo = ? AND hash = ?',
+                                      (repo, chunk_hash)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write_chunk(self, repo, chunk_hash, chunk_data):
+        self.connection.execute('INSERT OR REPLACE INTO chunks (repo, hash, data) VALUES (?, ?, ?)',
+                                (repo, chunk_hash, chunk_data))
+
+    def remove_chunk(self, repo, chunk_hash):
+        self.connection.execute('DELETE FROM chunks WHERE repo = ? AND hash = ?', (repo, chunk_hash))
+
+    def chunk_exists(self, repo, chunk_hash):
+        return self.connection.execute('SELECT 1 FROM chunks WHERE repo = ? AND hash = ?',
+                                       (repo, chunk_hash)).fetchone() is not None
+
+    def chunk_hashes(self, repo):
+        return [row[0] for row in self.connection.execute('SELECT hash FROM chunks WHERE repo = ?', (repo,))]
@@ -0,0 +1,582 @@
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+from utils.atomic_write import atomic_write, atomic_open, batched_fsync, is_temp_file
+from utils.pack_file import PackReader, open_pack_reader, forget_pack_reader, write_pack
+
+KEY = 'key'
+INDEX = 'index'
+OBJECTS = 'objects'
+PREVIEWS = 'previews'
+STATES = 'states'
+CHUNKS = 'chunks'
+PACK = 'pack'
+
+
+class StorageBackend:
+    """
+    A class to represent where repos are kept. repository_control speaks to storage only through this interface,
+    so a backend decides the layout and the cost of I/O, and nothing above it has to change.
+
+    Repos are identified by the hash of the file path they track. Index, file objects, chunks and editor states are
+    handed over as they are stored - compressed - and previews as JSON text. Chunks are pieces of large files,
+    shared by the file objects that list them, and named by the hash of their content.
+
+    """
+
+    def transaction(self):
+        """
+        Group writes so that they land together. Nested blocks are folded into the outermost one.
+
+        :return: context manager
+        """
+        raise NotImplementedError
+
+    def repos(self):
+        """
+        :return: list of ids of all repos
+        """
+        raise NotImplementedError
+
+    def repo_exists(self, repo):
+        raise NotImplementedError
+
+    def create_repo(self, repo):
+        """
+        Create an empty repo. Key and index are written separately.
+        """
+        raise NotImplementedError
+
+    def remove_repo(self, repo):
+        raise NotImplementedError
+
+    def copy_repo(self, old_repo, new_repo):
+        """
+        Copy everything but the key - the caller writes the key of the new location. Any repo at new_repo is replaced.
+        """
+        raise NotImplementedError
+
+    def move_repo(self, old_repo, new_repo):
+        self.copy_repo(old_repo, new_repo)
+        self.remove_repo(old_repo)
+
+    def read_key(self, repo):
+        """
+        :return: file path the repo tracks - raises FileNotFoundError if there is none
+        """
+        raise NotImplementedError
+
+    def write_key(self, repo, key):
+        raise NotImplementedError
+
+    def read_index(self, repo):
+        """
+        :return: compressed index - raises FileNotFoundError if there is none
+        """
+        raise NotImplementedError
+
+    def write_index(self, repo, index_data):
+        raise NotImplementedError
+
+    def read_object(self, repo, file_hash):
+        """
+        :return: compressed file content, None if there is no such file object
+        """
+        raise NotImplementedError
+
+    def write_object(self, repo, file_hash, object_data, written=None):
+        """
+        :param written: time the file object was first written, when it is copied over from elsewhere
+        """
+        raise NotImplementedError
+
+    def remove_object(self, repo, file_hash):
+        """
+        Remove a file object along with its preview and editor state.
+        """
+        raise NotImplementedError
+
+    def object_exists(self, repo, file_hash):
+        return self.object_stat(repo, file_hash) is not None
+
+    def object_stat(self, repo, file_hash):
+        """
+        :return: tuple of size of file object and time it was written, None if there is no such file object
+        """
+        raise NotImplementedError
+
+    def object_hashes(self, repo):
+        """
+        :return: list of hashes of all file objects, in the order they were written
+        """
+        raise NotImplementedError
+
+    def read_preview(self, repo, file_hash):
+        """
+        :return: preview as JSON text, None if there is none
+        """
+        raise NotImplementedError
+
+    def write_preview(self, repo, file_hash, preview_data):
+        raise NotImplementedError
+
+    def read_editor_state(self, repo, file_hash):
+        """
+        :return: compressed editor state saved along with a version, None if there is none
+        """
+        raise NotImplementedError
+
+    def write_editor_state(self, repo, file_hash, state_data):
+        raise NotImplementedError
+
+    def read_chunk(self, repo, chunk_hash):
+        """
+        :return: compressed chunk, None if there is no such chunk
+        """
+        raise NotImplementedError
+
+    def write_chunk(self, repo, chunk_hash, chunk_data):
+        raise NotImplementedError
+
+    def remove_chunk(self, repo, chunk_hash):
+        raise NotImplementedError
+
+    def chunk_exists(self, repo, chunk_hash):
+        raise NotImplementedError
+
+    def chunk_hashes(self, repo):
+        """
+        :return: list of hashes of all chunks
+        """
+        raise NotImplementedError
+
+    def import_pack(self, repo, pack_path):
+        """
+        Take over every file object of a pack that was checked beforehand. The repo must be empty.
+
+        :param repo: id of repo
+        :param pack_path: location of pack file
+        :return: None
+        """
+        with self.transaction(), PackReader(pack_path) as pack_reader:
+            for file_hash in pack_reader.file_hashes():
+                self.write_object(repo, file_hash, pack_reader.object_data(file_hash))
+
+    def compact_repo(self, repo):
+        """
+        Cut down on the storage overhead of a repo. Does nothing unless a backend has something to gain.
+        """
+        pass
+
+    def temp_files(self, repo):
+        """
+        :return: list of locations of leftovers of interrupted writes that are safe to remove
+        """
+        return []
+
+    def remove_temp_files(self, repo):
+        """
+        Remove the leftovers of interrupted writes listed by temp_files. Does nothing unless a backend leaves any.
+        """
+        pass
+
+
+class LooseBackend(StorageBackend):
+    """
+    A class to represent repos kept as a directory tree each - a 'key' and an 'index' file, a file per
+    file object in 'objects', a file per preview in 'previews', a file per editor state in 'states', a file per
+    chunk in 'chunks' and, for repos in pack form, a 'pack' file that holds older file objects. Writes are atomic, and flushed together
+    within a transaction.
+
+    """
+
+    def __init__(self, root):
+        """
+        :param root: location of the folder that holds all repos
+        """
+        self.root = root
+
+    def repo_path(self, repo):
+        return os.path.join(self.root, repo[0:2], repo[2:])
+
+    def key_path(self, repo):
+        return os.path.join(self.repo_path(repo), KEY)
+
+    def index_path(self, repo):
+        return os.path.join(self.repo_path(repo), INDEX)
+
+    def objects_path(self, repo):
+        return os.path.join(self.repo_path(repo), OBJECTS)
+
+    def previews_path(self, repo):
+        return os.path.join(self.repo_path(repo), PREVIEWS)
+
+    def states_path(self, repo):
+        return os.path.join(self.repo_path(repo), STATES)
+
+    def chunks_path(self, repo):
+        return os.path.join(self.repo_path(repo), CHUNKS)
+
+    def pack_path(self, repo):
+        return os.path.join(self.repo_path(repo), PACK)
+
+    def object_path(self, repo, file_hash):
+        return os.path.join(self.objects_path(repo), file_hash)
+
+    def preview_path(self, repo, file_hash):
+        return os.path.join(self.previews_path(repo), file_hash)
+
+    def state_path(self, repo, file_hash):
+        return os.path.join(self.states_path(repo), file_hash)
+
+    def chunk_path(self, repo, chunk_hash):
+        return os.path.join(self.chunks_path(repo), chunk_hash)
+
+    @contextmanager
+    def pack_reader(self, repo):
+        """
+        Lend out the PackReader of the repo for the duration of a block.
+
+        :return: PackReader of the repo, None if the repo is not in pack form
+        """
+        pack_path = self.pack_path(repo)
+        if not os.path.exists(pack_path):
+            yield None
+            return
+
+        with open_pack_reader(pack_path) as pack_reader:
+            yield pack_reader
+
+    def transaction(self):
+        return batched_fsync()
+
+    def repos(self):
+        repos = []
+        if not os.path.isdir(self.root):
+            return repos
+
+        for prefix in sorted(os.listdir(self.root)):
+            prefix_path = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for name in sorted(os.listdir(prefix_path)):
+                if os.path.isfile(os.path.join(prefix_path, name, KEY)):
+                    repos.append(prefix + name)
+
+        return repos
+
+    def repo_exists(self, repo):
+        return os.path.exists(self.repo_path(repo))
+
+    def create_repo(self, repo):
+        os.makedirs(self.objects_path(repo))
+        os.makedirs(self.previews_path(repo))
+
+    def remove_repo(self, repo):
+        if not self.repo_exists(repo):
+            return
+
+        forget_pack_reader(self.pack_path(repo))
+        shutil.rmtree(self.repo_path(repo))
+
+    def copy_repo(self, old_repo, new_repo):
+        # Remove any lingering repo in the new location
+        self.remove_repo(new_repo)
+        shutil.copytree(self.repo_path(old_repo), self.repo_path(new_repo))
+
+    def move_repo(self, old_repo, new_repo):
+        # Repos share a root, so moving one is a rename
+        self.remove_repo(new_repo)
+        forget_pack_reader(self.pack_path(old_repo))
+        os.makedirs(os.path.dirname(self.repo_path(new_repo)), exist_ok=True)
+        os.rename(self.repo_path(old_repo), self.repo_path(new_repo))
+
+    def read_key(self, repo):
+        with open(self.key_path(repo), 'r') as f:
+            return f.read()
+
+    def write_key(self, repo, key):
+        atomic_write(self.key_path(repo), key)
+
+    def read_index(self, repo):
+        with open(self.index_path(repo), 'rb') as f:
+            return f.read()
+
+    def write_index(self, repo, index_data):
+        atomic_write(self.index_path(repo), index_data)
+
+    def read_object(self, repo, file_hash):
+        # Loose first, then the pack
+        try:
+            with open(self.object_path(repo, file_hash), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.pack_reader(repo) as pack_reader:
+                return pack_reader.object_data(file_hash) if pack_reader else None
+
+    def write_object(self, repo, file_hash, object_data, written=None):
+        # A file records when it was written by itself. Objects are named by their content, so a rewrite of an object
+        # keeps the time of its first write - the order objects were written in is read from it
+        object_path = self.object_path(repo, file_hash)
+        if os.path.exists(object_path):
+            written = os.path.getmtime(object_path)
+        atomic_write(object_path, object_data, written)
+
+    def remove_object(self, repo, file_hash):
+        if os.path.exists(self.object_path(repo, file_hash)):
+            os.remove(self.object_path(repo, file_hash))
+        else:
+            # A file object in the pack is dropped by writing the pack anew - once the old one is let go of
+            with self.pack_reader(repo) as pack_reader:
+                packed = bool(pack_reader) and file_hash in pack_reader
+                file_hashes = [h for h in pack_reader.file_hashes() if h != file_hash] if packed else None
+            if packed:
+                self.write_pack(repo, file_hashes)
+
+        for path in (self.preview_path(repo, file_hash), self.state_path(repo, file_hash)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def object_exists(self, repo, file_hash):
+        if os.path.exists(self.object_path(repo, file_hash)):
+            return True
+
+        with self.pack_reader(repo) as pack_reader:
+            return bool(pack_reader) and file_hash in pack_reader
+
+    def object_stat(self, repo, file_hash):
+        object_path = self.object_path(repo, file_hash)
+        if os.path.exists(object_path):
+            return os.path.getsize(object_path), os.path.getmtime(object_path)
+
+        with self.pack_reader(repo) as pack_reader:
+            if pack_reader and file_hash in pack_reader:
+                return pack_reader.object_length(file_hash), os.path.getmtime(self.pack_path(repo))
+
+        return None
+
+    def object_hashes(self, repo):
+        # Objects in the pack are older than loose ones
+        with self.pack_reader(repo) as pack_reader:
+            packed_file_hashes = pack_reader.file_hashes() if pack_reader else []
+
+        objects_path = self.objects_path(repo)
+        packed = set(packed_file_hashes)
+        names = [name for name in os.listdir(objects_path) if not is_temp_file(name) and name not in packed]
+        return packed_file_hashes + sorted(names, key=lambda name: os.path.getmtime(os.path.join(objects_path, name)))
+
+    def read_preview(self, repo, file_hash):
+        try:
+            with open(self.preview_path(repo, file_hash), 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_preview(self, repo, file_hash, preview_data):
+        os.makedirs(self.previews_path(repo), exist_ok=True)
+        atomic_write(self.preview_path(repo, file_hash), preview_data)
+
+    def read_editor_state(self, repo, file_hash):
+        try:
+            with open(self.state_path(repo, file_hash), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_editor_state(self, repo, file_hash, state_data):
+        os.makedirs(self.states_path(repo), exist_ok=True)
+        atomic_write(self.state_path(repo, file_hash), state_data)
+
+    def read_chunk(self, repo, chunk_hash):
+        try:
+            with open(self.chunk_path(repo, chunk_hash), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_chunk(self, repo, chunk_hash, chunk_data):
+        os.makedirs(self.chunks_path(repo), exist_ok=True)
+        atomic_write(self.chunk_path(repo, chunk_hash), chunk_data)
+
+    def remove_chunk(self, repo, chunk_hash):
+        if os.path.exists(self.chunk_path(repo, chunk_hash)):
+            os.remove(self.chunk_path(repo, chunk_hash))
+
+    def chunk_exists(self, repo, chunk_hash):
+        return os.path.exists(self.chunk_path(repo, chunk_hash))
+
+    def chunk_hashes(self, repo):
+        chunks_path = self.chunks_path(repo)
+        if not os.path.isdir(chunks_path):
+            return []
+        return [name for name in os.listdir(chunks_path) if not is_temp_file(name)]
+
+    def import_pack(self, repo, pack_path):
+        # The pack is kept as is - the repo is left in pack form
+        with atomic_open(self.pack_path(repo)) as f, open(pack_path, 'rb') as pack:
+            shutil.copyfileobj(pack, f)
+            forget_pack_reader(self.pack_path(repo))
+
+    def compact_repo(self, repo):
+        """
+        Put a repo in pack form - move every file object into one pack file, to cut down on files and the cost of
+        opening them. New versions are written loose, until the repo is packed again. Chunks stay loose.
+        """
+        self.write_pack(repo, self.object_hashes(repo))
+
+        # Loose objects are only removed once the pack that holds them is on disk
+        for name in os.listdir(self.objects_path(repo)):
+            if not is_temp_file(name):
+                os.remove(os.path.join(self.objects_path(repo), name))
+
+    def write_pack(self, repo, file_hashes):
+        # The copy of the index in a pack is only read on import - a damaged index must not stop a repair
+        try:
+            index_data = self.read_index(repo)
+        except OSError:
+            index_data = b''
+
+        write_pack(self.pack_path(repo), index_data, file_hashes, lambda file_hash: self.read_object(repo, file_hash))
+
+    def temp_files(self, repo):
+        temp_files = []
+        for directory in (self.repo_path(repo), self.objects_path(repo), self.previews_path(repo),
+                          self.states_path(repo), self.chunks_path(repo)):
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if is_temp_file(name):
+                    temp_files.append(os.path.join(directory, name))
+
+        return temp_files
+
+    def remove_temp_files(self, repo):
+        for temp_file_path in self.temp_files(repo):
+            os.remove(temp_file_path)
+
+
+class MemoryBackend(StorageBackend):
+    """
+    A class to represent repos kept in memory only - for tests and benchmarks that measure the cost of
+    the algorithms apart from the cost of disk I/O. Nothing survives the process.
+
+    """
+
+    def __init__(self):
+        # Repo id -> python dict object of key, index, file objects (hash -> [data, written, preview, state])
+        # and chunks (hash -> data)
+        self.store = {}
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            yield
+
+    def repos(self):
+        return list(self.store)
+
+    def repo_exists(self, repo):
+        return repo in self.store
+
+    def create_repo(self, repo):
+        with self.lock:
+            self.store.setdefault(repo, {KEY: None, INDEX: None, OBJECTS: {}, CHUNKS: {}})
+
+    def remove_repo(self, repo):
+        with self.lock:
+            self.store.pop(repo, None)
+
+    def copy_repo(self, old_repo, new_repo):
+        with self.lock:
+            old = self.store[old_repo]
+            self.store[new_repo] = {
+                KEY: old[KEY],
+                INDEX: old[INDEX],
+                OBJECTS: {file_hash: list(entry) for file_hash, entry in old[OBJECTS].items()},
+                CHUNKS: dict(old[CHUNKS])
+            }
+
+    def move_repo(self, old_repo, new_repo):
+        with self.lock:
+            self.store[new_repo] = self.store.pop(old_repo)
+
+    def read_key(self, repo):
+        return self.read_entry(repo, KEY)
+
+    def write_key(self, repo, key):
+        self.store[repo][KEY] = key
+
+    def read_index(self, repo):
+        return self.read_entry(repo, INDEX)
+
+    def write_index(self, repo, index_data):
+        self.store[repo][INDEX] = index_data
+
+    def read_entry(self, repo, name):
+        value = self.store.get(repo, {}).get(name)
+        if value is None:
+            raise FileNotFoundError('No {} in repo {}'.format(name, repo))
+        return value
+
+    def read_object(self, repo, file_hash):
+        entry = self.store[repo][OBJECTS].get(file_hash) if repo in self.store else None
+        return entry[0] if entry else None
+
+    def write_object(self, repo, file_hash, object_data, written=None):
+        with self.lock:
+            objects = self.store[repo][OBJECTS]
+            if file_hash in objects:
+                objects[file_hash][0] = object_data
+            else:
+                objects[file_hash] = [object_data, time.time() if written is None else written, None, None]
+
+    def remove_object(self, repo, file_hash):
+        with self.lock:
+            self.store[repo][OBJECTS].pop(file_hash, None)
+
+    def object_stat(self, repo, file_hash):
+        entry = self.store[repo][OBJECTS].get(file_hash) if repo in self.store else None
+        return (len(entry[0]), entry[1]) if entry else None
+
+    def object_hashes(self, repo):
+        # Dicts keep the order their keys were added in
+        return list(self.store[repo][OBJECTS])
+
+    def read_preview(self, repo, file_hash):
+        entry = self.store[repo][OBJECTS].get(file_hash) if repo in self.store else None
+        return entry[2] if entry else None
+
+    def write_preview(self, repo, file_hash, preview_data):
+        entry = self.store[repo][OBJECTS].get(file_hash)
+        if entry:
+            entry[2] = preview_data
+
+    def read_editor_state(self, repo, file_hash):
+        entry = self.store[repo][OBJECTS].get(file_hash) if repo in self.store else None
+        return entry[3] if entry else None
+
+    def write_editor_state(self, repo, file_hash, state_data):
+        entry = self.store[repo][OBJECTS].get(file_hash)
+        if entry:
+            entry[3] = state_data
+
+    def read_chunk(self, repo, chunk_hash):
+        return self.store[repo][CHUNKS].get(chunk_hash) if repo in self.store else None
+
+    def write_chunk(self, repo, chunk_hash, chunk_data):
+        with self.lock:
+            self.store[repo][CHUNKS][chunk_hash] = chunk_data
+
+    def remove_chunk(self, repo, chunk_hash):
+        with self.lock:
+            self.store[repo][CHUNKS].pop(chunk_hash, None)
+
+    def chunk_exists(self, repo, chunk_hash):
+        return repo in self.store and chunk_hash in self.store[repo][CHUNKS]
+
+    def chunk_hashes(self, repo):
+        return list(self.store[repo][CHUNKS])
@@ -0,0 +1,120 @@
+from array import array
+from itertools import chain
+import numpy as np
+
+
+class TimelineGraph:
+    """
+    The graph a timeline draws - the versions of an index, with segments standing in for collapsed runs of them.
+    Nodes are integer ids, and edges are kept in flat arrays the way CompactIndex keeps them, so a graph of every
+    version of an index shares the arrays of the index instead of copying them.
+
+    size - number of node ids, drawn or not - ids of versions within a collapsed run are not drawn
+    nodes - array of ids of drawn nodes, ascending
+    child_offsets, child_ids - children of node i are child_ids[child_offsets[i]:child_offsets[i + 1]]
+    parent_offsets, parent_ids - same for parents, built on first use
+
+    """
+
+    def __init__(self, size, nodes, child_offsets, child_ids):
+        self.size = size
+        self.nodes = nodes
+        self.child_offsets = child_offsets
+        self.child_ids = child_ids
+        self.parent_offsets = None
+        self.parent_ids = None
+
+    @classmethod
+    def from_compact_index(cls, index):
+        """
+        :param index: CompactIndex object
+        :return: graph that draws every version of index
+        """
+        return cls(index.num_nodes, np.arange(index.num_nodes), index.child_offsets, index.child_ids)
+
+    @classmethod
+    def from_children(cls, size, children):
+        """
+        :param size: number of node ids
+        :param children: python dict object of drawn node to the list of its children
+        :return: graph that draws the nodes of children
+        """
+        nodes = np.array(sorted(children), dtype=np.intp)
+
+        offsets = np.zeros(size + 1, dtype=np.uint32)
+        offsets[nodes + 1] = [len(children[node]) for node in nodes.tolist()]
+        np.cumsum(offsets, out=offsets)
+
+        child_offsets = array('I')
+        child_offsets.frombytes(offsets.tobytes())
+        child_ids = array('I', chain.from_iterable(children[node] for node in nodes.tolist()))
+        return cls(size, nodes, child_offsets, child_ids)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def children(self, node):
+        return self.child_ids[self.child_offsets[node]:self.child_offsets[node + 1]]
+
+    def parents(self, node):
+        if self.parent_offsets is None:
+            self.build_parents()
+        return self.parent_ids[self.parent_offsets[node]:self.parent_offsets[node + 1]]
+
+    def num_parents(self, node):
+        if self.parent_offsets is None:
+            self.build_parents()
+        return self.parent_offsets[node + 1] - self.parent_offsets[node]
+
+    def build_parents(self):
+        """
+        Invert the children arrays - a stable sort of edges by child keeps the parents of a node in ascending order.
+
+        :return: None
+        """
+        sources, targets = self.edges()
+        order = np.argsort(targets, kind='stable')
+
+        offsets = np.zeros(self.size + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum(np.bincount(targets, minlength=self.size))
+
+        self.parent_offsets = array('I')
+        self.parent_offsets.frombytes(offsets.tobytes())
+        self.parent_ids = array('I')
+        self.parent_ids.frombytes(sources[order].astype(np.uint32).tobytes())
+
+    def edges(self):
+        """
+        :return: tuple of arrays of the nodes at the start and at the end of every edge
+        """
+        offsets = np.frombuffer(self.child_offsets, dtype=np.uint32)
+        sources = np.repeat(np.arange(self.size, dtype=np.intp), np.diff(offsets).astype(np.intp))
+        targets = np.frombuffer(self.child_ids, dtype=np.uint32).astype(np.intp)
+        return sources, targets
+
+    def neighbours(self, nodes):
+        """
+        :param nodes: iterable of nodes
+        :return: set of the children and parents of nodes
+        """
+        neighbours = set()
+        for node in nodes:
+            neighbours.update(self.children(node))
+            neighbours.update(self.parents(node))
+        return neighbours
+
+    def to_networkx(self):
+        """
+        Export the graph, e.g. to analyse a history with networkx - which the timeline itself does not need.
+
+        :return: networkx DiGraph object
+        """
+        try:
+            import networkx as nx
+        except ImportError:
+            raise Exception('Unable to export graph: networkx is not installed')
+
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.nodes.tolist())
+        graph.add_edges_from(zip(*(column.tolist() for column in self.edges())))
+        return graph
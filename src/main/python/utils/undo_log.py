@@ -0,0 +1,132 @@
+# Keys of a serialised log
+LOG_STEPS = 'steps'
+LOG_POSITION = 'position'
+LOG_CLEAN = 'clean'
+
+
+class OperationLog:
+    """
+    A class to represent the undo history of a document as a list of steps. A step is what a single undo or redo
+    reverts or replays - a list of operations, each a (position, removed text, added text) span.
+
+    Steps before position are done, steps from position on can be redone. The clean position is the step the
+    document was last loaded or saved at - -1 once it cannot be reached anymore.
+
+    """
+
+    MAX_STEPS = 1000
+
+    def __init__(self, steps=None, position=None, clean=None):
+        self.steps = steps or []
+        self.position = len(self.steps) if position is None else position
+        self.clean = self.position if clean is None else clean
+
+    def record(self, position, removed, added, group=False):
+        """
+        Record an edit. Redoable steps are dropped. Consecutive typing and deleting within a line merge into one step.
+
+        :param position: position the edit starts at
+        :param removed: text the edit removed
+        :param added: text the edit added in its place
+        :param group: Boolean representing if the edit belongs to the last step, e.g. made by the same key press
+        :return: None
+        """
+        if self.position < len(self.steps):
+            del self.steps[self.position:]
+            if self.clean > self.position:
+                self.clean = -1
+
+        operation = (position, removed, added)
+        if group and self.steps:
+            self.steps[-1].append(operation)
+        elif self.steps and self.position != self.clean and self.can_merge(self.steps[-1], operation):
+            self.steps[-1] = [self.merge(self.steps[-1][0], operation)]
+        else:
+            self.steps.append([operation])
+
+        if len(self.steps) > self.MAX_STEPS:
+            del self.steps[0]
+            self.clean = self.clean - 1 if self.clean > 0 else -1
+
+        self.position = len(self.steps)
+
+    @staticmethod
+    def can_merge(step, operation):
+        """
+        :param step: last step
+        :param operation: new operation
+        :return: Boolean representing if operation continues the typing or deleting of a single-operation step
+        """
+        if len(step) != 1:
+            return False
+
+        last_position, last_removed, last_added = step[0]
+        position, removed, added = operation
+        if '\n' in removed + added or '\n' in last_removed + last_added:
+            return False
+
+        # Typing
+        if not removed and not last_removed and len(added) == 1:
+            return position == last_position + len(last_added)
+
+        # Backspace and delete
+        if not added and not last_added and len(removed) == 1:
+            return position + len(removed) == last_position or position == last_position
+
+        return False
+
+    @staticmethod
+    def merge(last_operation, operation):
+        last_position, last_removed, last_added = last_operation
+        position, removed, added = operation
+
+        if not removed:
+            return last_position, '', last_added + added
+        if position < last_position:
+            return position, removed + last_removed, ''
+        return last_position, last_removed + removed, ''
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.steps)
+
+    def undo(self):
+        """
+        :return: list of (position, length, text) replacements that revert the last step, None if there is none
+        """
+        if not self.can_undo():
+            return None
+
+        self.position -= 1
+        return [(position, len(added), removed) for position, removed, added in reversed(self.steps[self.position])]
+
+    def redo(self):
+        """
+        :return: list of (position, length, text) replacements that replay the next step, None if there is none
+        """
+        if not self.can_redo():
+            return None
+
+        self.position += 1
+        return [(position, len(removed), added) for position, removed, added in self.steps[self.position - 1]]
+
+    def is_clean(self):
+        return self.position == self.clean
+
+    def set_clean(self):
+        self.clean = self.position
+
+    def to_dict(self):
+        return {
+            LOG_STEPS: [[list(operation) for operation in step] for step in self.steps],
+            LOG_POSITION: self.position,
+            LOG_CLEAN: self.clean
+        }
+
+    @classmethod
+    def from_dict(cls, log):
+        steps = [[tuple(operation) for operation in step] for step in log[LOG_STEPS]]
+        return cls(steps, log[LOG_POSITION], log[LOG_CLEAN])
+